@@ -0,0 +1,293 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+# Porcupine expects 16 kHz mono int16 in 512-sample frames, so the shared
+# stream is opened in that format and every consumer reads from it.
+SAMPLE_RATE = 16000
+FRAME_LENGTH = 512
+
+# How much audio the ring buffer retains, and how much audio from before the
+# wake word is handed to the command recorder.
+BUFFER_SECONDS = float(os.getenv("NOVA_CAPTURE_BUFFER_SECONDS", "30"))
+PREROLL_MS = int(os.getenv("NOVA_PREROLL_MS", "300"))
+
+# pyaudio.paInputOverflow, the callback status flag for dropped input
+_INPUT_OVERFLOW = 0x2
+
+
+class RingBuffer:
+    """Preallocated int16 ring buffer addressed by absolute sample position"""
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self._buffer = np.zeros(self.capacity, dtype=np.int16)
+        self._written = 0
+        self._closed = False
+        # Samples readers lost because they fell more than a buffer behind
+        self.overruns = 0
+        self._cond = threading.Condition()
+
+    @property
+    def position(self):
+        """Absolute position of the next sample to be written"""
+        return self._written
+
+    @property
+    def oldest(self):
+        """Absolute position of the oldest sample still held in the buffer"""
+        return max(0, self._written - self.capacity)
+
+    def write(self, samples):
+        """Append samples; only the capture thread may call this.
+
+        A block longer than the buffer keeps only its last `capacity`
+        samples, but still advances the position by its full length.
+        """
+        n = len(samples)
+        if n == 0:
+            return
+        skipped = max(0, n - self.capacity)
+        samples = samples[skipped:]
+
+        count = len(samples)
+        # Copy under the lock so a reader never sees half-overwritten samples
+        with self._cond:
+            start = (self._written + skipped) % self.capacity
+            first = min(count, self.capacity - start)
+            self._buffer[start:start + first] = samples[:first]
+            if first < count:
+                self._buffer[:count - first] = samples[first:]
+            self._written += n
+            self._cond.notify_all()
+
+    def read(self, position, count, out=None, timeout=None):
+        """Copy `count` samples starting at `position`, blocking until they exist.
+
+        Returns the samples and the position at which they actually started,
+        which is later than requested if the reader fell out of the buffer.
+        """
+        if out is None:
+            out = np.empty(count, dtype=np.int16)
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: self._closed or self._written >= position + count,
+                timeout
+            )
+            if not ready:
+                raise TimeoutError("Timed out waiting for audio")
+            if self._written < position + count:
+                raise EOFError("Audio capture has been closed")
+
+            oldest = self.oldest
+            if position < oldest:
+                self.overruns += oldest - position
+                logger.warning("Capture reader overrun, skipped %s samples", oldest - position)
+                position = oldest
+
+            # The writer holds the same lock, so these samples can't change mid-copy
+            start = position % self.capacity
+            first = min(count, self.capacity - start)
+            out[:first] = self._buffer[start:start + first]
+            if first < count:
+                out[first:count] = self._buffer[:count - first]
+        return out, position
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class CaptureReader:
+    """Independent cursor over the shared capture buffer"""
+
+    def __init__(self, ring, position):
+        self._ring = ring
+        self.position = position
+
+    def read(self, count, out=None, timeout=None):
+        """Read the next `count` samples and advance the cursor"""
+        samples, start = self._ring.read(self.position, count, out=out, timeout=timeout)
+        self.position = start + count
+        return samples
+
+
+class AudioCaptureService:
+    """Opens the microphone once and feeds a shared ring buffer"""
+
+    def __init__(self, sample_rate=SAMPLE_RATE, frame_length=FRAME_LENGTH,
+                 buffer_seconds=BUFFER_SECONDS, preroll_ms=PREROLL_MS):
+        self.sample_rate = sample_rate
+        self.frame_length = frame_length
+        self.preroll_samples = int(sample_rate * preroll_ms / 1000)
+        self.ring = RingBuffer(int(sample_rate * buffer_seconds))
+        self._pa = None
+        self._stream = None
+        # Callbacks in which PortAudio reported that input was dropped
+        self.overflows = 0
+
+    @property
+    def running(self):
+        return self._stream is not None
+
+    @property
+    def position(self):
+        return self.ring.position
+
+    def start(self):
+        if self.running:
+            return
+        if self.ring.closed:
+            self.ring = RingBuffer(self.ring.capacity)
+        # Imported here so offline tools can use the buffer without PortAudio
+        import pyaudio
+
+        logger.info("Opening microphone at %s Hz", self.sample_rate)
+        self._pa = pyaudio.PyAudio()
+        self._stream = self._pa.open(
+            rate=self.sample_rate,
+            channels=1,
+            format=pyaudio.paInt16,
+            input=True,
+            frames_per_buffer=self.frame_length,
+            stream_callback=self._on_audio,
+        )
+        self._stream.start_stream()
+
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        if status & _INPUT_OVERFLOW:
+            self.overflows += 1
+        self.ring.write(np.frombuffer(in_data, dtype=np.int16))
+        return (None, 0)  # pyaudio.paContinue
+
+    def stop(self):
+        if not self.running:
+            return
+        logger.info("Closing microphone")
+        try:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._pa.terminate()
+        finally:
+            self._stream = None
+            self._pa = None
+            self.ring.close()
+
+    def reader(self, position=None):
+        """Create a reader starting at `position` (defaults to live audio)"""
+        if position is None:
+            position = self.ring.position
+        return CaptureReader(self.ring, position)
+
+    def preroll_position(self, position):
+        """Position `preroll_samples` before `position`, clamped to the buffer"""
+        return max(position - self.preroll_samples, self.ring.oldest)
+
+    def stats(self):
+        return {"overflows": self.overflows, "overruns": self.ring.overruns}
+
+
+class ReplayCaptureService(AudioCaptureService):
+    """Feeds the ring buffer from recorded clips instead of the microphone.
+
+    Like a live microphone it produces audio continuously: queued clips are
+    written in order at `speed` times real time, with quiet noise between
+    them. For benchmarks and offline development.
+    """
+
+    def __init__(self, speed=1.0, noise_level=3, **kwargs):
+        super().__init__(**kwargs)
+        self.speed = speed
+        self.noise_level = noise_level
+        self._clips = deque()
+        self._clips_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        if self.ring.closed:
+            self.ring = RingBuffer(self.ring.capacity)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="replay-capture", daemon=True)
+        self._thread.start()
+
+    def play(self, samples):
+        """Queue an int16 clip; the future resolves to its start position"""
+        future = Future()
+        with self._clips_lock:
+            self._clips.append((np.asarray(samples, dtype=np.int16), future))
+        return future
+
+    def _run(self):
+        rng = np.random.default_rng(0)
+        frame_seconds = self.frame_length / self.sample_rate / self.speed
+        next_time = time.perf_counter()
+        clip, offset = None, 0
+        while not self._stop.is_set():
+            if clip is None:
+                with self._clips_lock:
+                    if self._clips:
+                        clip, future = self._clips.popleft()
+                        offset = 0
+                        future.set_result(self.ring.position)
+            if clip is not None:
+                frame = clip[offset:offset + self.frame_length]
+                offset += len(frame)
+                if offset >= len(clip):
+                    clip = None
+            else:
+                frame = rng.normal(0, self.noise_level, self.frame_length).astype(np.int16)
+            self.ring.write(frame)
+
+            next_time += frame_seconds
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.ring.close()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_capture_service():
+    """Return the process-wide capture service, starting it on first use"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = AudioCaptureService()
+        _service.start()
+        return _service
+
+
+def stop_capture_service():
+    """Close the microphone if the capture service was started"""
+    with _service_lock:
+        if _service is not None:
+            _service.stop()
+            logger.info("Capture stopped: %s", _service.stats())
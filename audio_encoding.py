@@ -0,0 +1,132 @@
+import os
+import threading
+import wave
+from dataclasses import dataclass
+from io import BytesIO
+from math import gcd
+import numpy as np
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+# Speech models are trained on 16 kHz audio; anything above that is wasted uplink
+TARGET_SAMPLE_RATE = 16000
+
+# "wav" (PCM16), or "flac"/"ogg" when the optional soundfile package is installed
+AUDIO_CODEC = os.getenv("NOVA_AUDIO_CODEC", "wav")
+
+_SOUNDFILE_FORMATS = {
+    "flac": ("FLAC", "PCM_16"),
+    "ogg": ("OGG", "VORBIS"),
+}
+
+
+@dataclass
+class EncodedAudio:
+    """Audio payload ready for upload"""
+    data: bytes
+    codec: str
+    sample_rate: int
+    duration: float
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def as_file(self):
+        """File-like view of the payload, named so SDKs can infer the format"""
+        audio_file = BytesIO(self.data)
+        audio_file.name = f"command.{self.codec}"
+        return audio_file
+
+
+class UploadStats:
+    """Running totals of audio bytes sent to speech services"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.total_bytes = 0
+        self.last_bytes = 0
+
+    def record(self, encoded):
+        with self._lock:
+            self.requests += 1
+            self.total_bytes += encoded.size
+            self.last_bytes = encoded.size
+        logger.info(
+            "Uploading %s bytes of %s audio (%.2fs at %s Hz)",
+            encoded.size, encoded.codec, encoded.duration, encoded.sample_rate
+        )
+
+    def summary(self):
+        with self._lock:
+            average = self.total_bytes / self.requests if self.requests else 0
+            return {
+                "requests": self.requests,
+                "total_bytes": self.total_bytes,
+                "last_bytes": self.last_bytes,
+                "average_bytes": average,
+            }
+
+
+upload_stats = UploadStats()
+
+
+def resample(audio, from_rate, to_rate=TARGET_SAMPLE_RATE):
+    """Polyphase-resample int16 audio to `to_rate`"""
+    if from_rate == to_rate or len(audio) == 0:
+        return audio
+    # scipy.signal is slow to import and only needed for non-16 kHz input
+    from scipy.signal import resample_poly
+
+    divisor = gcd(int(from_rate), int(to_rate))
+    resampled = resample_poly(audio.astype(np.float32), to_rate // divisor, from_rate // divisor)
+    return np.clip(resampled, -32768, 32767).astype(np.int16)
+
+
+def _encode_wav(audio, sample_rate):
+    buffer = BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(audio.tobytes())
+    return buffer.getvalue()
+
+
+def _encode_soundfile(audio, sample_rate, codec):
+    import soundfile
+
+    file_format, subtype = _SOUNDFILE_FORMATS[codec]
+    buffer = BytesIO()
+    soundfile.write(buffer, audio, sample_rate, format=file_format, subtype=subtype)
+    return buffer.getvalue()
+
+
+def encode_audio(audio, sample_rate, codec=None):
+    """Resample to 16 kHz and encode in memory, without touching the filesystem"""
+    codec = codec or AUDIO_CODEC
+    audio = resample(np.asarray(audio, dtype=np.int16).reshape(-1), sample_rate)
+
+    data = None
+    if codec in _SOUNDFILE_FORMATS:
+        try:
+            data = _encode_soundfile(audio, TARGET_SAMPLE_RATE, codec)
+        except ImportError:
+            logger.warning("soundfile is not installed, falling back to wav instead of %s", codec)
+            codec = "wav"
+    elif codec != "wav":
+        logger.warning("Unknown audio codec '%s', falling back to wav", codec)
+        codec = "wav"
+
+    if data is None:
+        data = _encode_wav(audio, TARGET_SAMPLE_RATE)
+
+    return EncodedAudio(
+        data=data,
+        codec=codec,
+        sample_rate=TARGET_SAMPLE_RATE,
+        duration=len(audio) / TARGET_SAMPLE_RATE,
+    )
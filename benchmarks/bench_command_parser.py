@@ -0,0 +1,112 @@
+"""Micro-benchmark for the rule-based command parser.
+
+Run from the project root:
+
+    python benchmarks/bench_command_parser.py [--iterations N]
+
+Reports per-call latency over a corpus of transcripts, compares it with the
+old nested keyword scan, and shows how matching cost changes as the keyword
+vocabulary grows.
+
+On the shipped vocabulary the current parser is slower per call than the
+old scan. It also splits compound requests, scores confidence and locates
+every keyword, and the old scan only checked whether keywords appeared.
+The trie regex is a little slower than a bare substring check at this size
+and only wins as the vocabulary grows.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import command_parser  # noqa: E402
+
+CORPUS = [
+    "pause",
+    "pause the music",
+    "stop on youtube",
+    "resume",
+    "play",
+    "next song",
+    "skip this track",
+    "previous track on youtube",
+    "go back",
+    "volume up",
+    "turn it down a little bit",
+    "louder please",
+    "set volume to 40%",
+    "set the volume at 75 percent",
+    "play hotel california on spotify",
+    "play don't stop me now",
+    "play start me up on youtube",
+    "put on bohemian rhapsody by queen in spotify",
+    "play the best lofi hip hop radio beats to relax and study to on youtube",
+    "hey nova can you play something by the beatles",
+    "what's the weather like today",
+]
+
+def naive_parse(text):
+    """The previous implementation: a substring scan per keyword group"""
+    text = text.lower().strip()
+    for action, keywords in command_parser.VOLUME_COMMANDS.items():
+        if any(keyword in text for keyword in keywords):
+            return {"action": f"volume_{action}"}
+    for action, keywords in command_parser.MEDIA_COMMANDS.items():
+        if any(keyword in text for keyword in keywords):
+            platform = None
+            for p, platform_keywords in command_parser.PLATFORMS.items():
+                if any(keyword in text for keyword in platform_keywords):
+                    platform = p
+                    break
+            return {"action": action, "platform": platform or "spotify"}
+    if "play" in text:
+        platform = None
+        for p, keywords in command_parser.PLATFORMS.items():
+            if any(keyword in text for keyword in keywords):
+                platform = p
+                break
+        platform = platform or "spotify"
+        for cmd in command_parser.PLAY_COMMANDS + command_parser.PLATFORMS[platform]:
+            text = text.replace(cmd, "")
+        return {"action": "play", "platform": platform, "song": text.strip()}
+    return None
+
+def time_per_call(func, corpus, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text in corpus:
+            func(text)
+    return (time.perf_counter() - start) / (iterations * len(corpus))
+
+def synthetic_vocabulary(size):
+    vocabulary = command_parser.build_vocabulary()
+    for i in range(size):
+        vocabulary[f"keyword{i} phrase{i % 97}"] = ("action", "pause")
+    return vocabulary
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--iterations", type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    print(f"Corpus: {len(CORPUS)} transcripts x {args.iterations} iterations\n")
+
+    compiled = time_per_call(command_parser.parse_command, CORPUS, args.iterations)
+    naive = time_per_call(naive_parse, CORPUS, args.iterations)
+    print(f"{'parser':<28}{'us/call':>10}{'calls/s':>14}")
+    print(f"{'rule parser (current)':<28}{compiled * 1e6:>10.2f}{1 / compiled:>14,.0f}")
+    print(f"{'old nested substring scan':<28}{naive * 1e6:>10.2f}{1 / naive:>14,.0f}")
+
+    print(f"\n{'vocabulary size':<28}{'us/match':>10}{'us/scan':>14}")
+    iterations = max(1, args.iterations // 20)
+    for extra in (0, 100, 1000, 10000):
+        vocabulary = synthetic_vocabulary(extra)
+        matcher = command_parser.KeywordMatcher(vocabulary)
+        matched = time_per_call(matcher.find, CORPUS, iterations)
+        scanned = time_per_call(lambda text: [k for k in vocabulary if k in text], CORPUS, iterations)
+        print(f"{len(vocabulary):<28}{matched * 1e6:>10.2f}{scanned * 1e6:>14.2f}")
+
+if __name__ == "__main__":
+    main()
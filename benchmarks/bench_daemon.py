@@ -0,0 +1,185 @@
+"""Load test of the text command API with fake services.
+
+Run from the project root:
+
+    python benchmarks/bench_daemon.py [--requests N] [--concurrency C] [--no-wait]
+        [--unix] [--workers W] [--backlog B] [--llm-delay S] [--control-latency S]
+
+Starts the command API in-process against the local fake LLM/YouTube server
+and the fake control backend, then sends the benchmark corpus from C client
+threads. Reports client-side latency percentiles and throughput, the
+server's own per-stage latencies, and how many requests were turned away
+because the worker pool and backlog were full.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import CORPUS, load_app  # noqa: E402
+from fake_services import FakeServiceServer  # noqa: E402
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def run(args):
+    server = FakeServiceServer(
+        answers=dict(CORPUS), llm_delay=args.llm_delay, token_delay=args.llm_token_delay
+    ).start()
+    app = load_app(server)
+    logging.getLogger("nova").setLevel(logging.WARNING)
+
+    from control_bridge import FakeControlBackend, set_control_backend
+    from daemon import CommandServer, CommandService
+    from tiered_parser import parse
+
+    control = FakeControlBackend(latency=args.control_latency)
+    set_control_backend(control)
+
+    socket_dir = tempfile.mkdtemp() if args.unix else None
+    socket_path = os.path.join(socket_dir, "nova.sock") if args.unix else ""
+    api = CommandServer(
+        CommandService(parse, app.dispatch_commands), port=0, socket_path=socket_path,
+        workers=args.workers, backlog=args.backlog,
+    ).start()
+
+    def connect():
+        if args.unix:
+            return UnixHTTPConnection(socket_path)
+        host, port = api.address.rsplit("/", 1)[-1].split(":")
+        return http.client.HTTPConnection(host, int(port))
+
+    texts = [CORPUS[i % len(CORPUS)][0] for i in range(args.requests)]
+    next_request = iter(range(args.requests))
+    lock = threading.Lock()
+    latencies = []
+    statuses = Counter()
+
+    def client():
+        while True:
+            with lock:
+                index = next(next_request, None)
+            if index is None:
+                return
+            body = json.dumps({"text": texts[index], "wait": not args.no_wait})
+            start = time.perf_counter()
+            connection = connect()
+            try:
+                connection.request("POST", "/commands", body, {"Content-Type": "application/json"})
+                response = connection.getresponse()
+                status = response.status
+                response.read()
+            except OSError:
+                status = "error"
+            finally:
+                connection.close()
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[status] += 1
+                if status in (200, 202):
+                    latencies.append(elapsed)
+
+    wall_start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+
+    # Requests that didn't wait may still be running on the player queues
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        stats = api.service.stats()["requests"]
+        if sum(stats.values()) - stats["rejected"] >= len(latencies):
+            break
+        time.sleep(0.05)
+    service_stats = api.service.stats()
+    api.stop()
+    server.stop()
+    if socket_dir:
+        os.rmdir(socket_dir)
+
+    ordered = sorted(latencies)
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "wait": not args.no_wait,
+        "transport": "unix" if args.unix else "tcp",
+        "wall": wall,
+        "throughput": len(latencies) / wall,
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "client": {q: _percentile(ordered, p) for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "server": service_stats,
+        "llm_requests": server.requests["llm"],
+        "control_submits": len(control.calls),
+    }
+
+
+def report(results):
+    print(
+        f"{results['requests']} requests from {results['concurrency']} clients over {results['transport']}, "
+        f"{'waiting for' if results['wait'] else 'not waiting for'} execution\n"
+    )
+    print(f"throughput        {results['throughput']:.0f} requests/s over {results['wall']:.2f} s")
+    print(f"responses         {', '.join(f'{k}: {v}' for k, v in sorted(results['statuses'].items()))}")
+    client = results["client"]
+    print(
+        f"client latency    p50 {client['p50'] * 1000:.2f} ms, p95 {client['p95'] * 1000:.2f} ms, "
+        f"p99 {client['p99'] * 1000:.2f} ms"
+    )
+    print(f"\n{'server stage':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, stats in results["server"]["latency"].items():
+        print(
+            f"{stage:<18}{stats['count']:>7}{stats['p50'] * 1000:>10.2f}{stats['p95'] * 1000:>10.2f}"
+            f"{stats['p99'] * 1000:>10.2f}"
+        )
+    print(f"\nserver outcomes   {results['server']['requests']}")
+    print(f"backend calls     {results['llm_requests']} llm, {results['control_submits']} control submits")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--requests", type=int, default=2000)
+    arg_parser.add_argument("--concurrency", type=int, default=32, help="client threads")
+    arg_parser.add_argument("--no-wait", action="store_true", help="fire-and-forget requests")
+    arg_parser.add_argument("--unix", action="store_true", help="use a Unix socket instead of TCP")
+    arg_parser.add_argument("--workers", type=int, default=8, help="server worker pool size")
+    arg_parser.add_argument("--backlog", type=int, default=64, help="requests that may wait for a worker")
+    arg_parser.add_argument("--llm-delay", type=float, default=0.4, help="seconds to the first fake LLM token")
+    arg_parser.add_argument("--llm-token-delay", type=float, default=0.02, help="seconds per fake LLM token")
+    arg_parser.add_argument("--control-latency", type=float, default=0.002, help="seconds per control round trip")
+    arg_parser.add_argument("--json", help="write the results to this file")
+    args = arg_parser.parse_args()
+
+    results = run(args)
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
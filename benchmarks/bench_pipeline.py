@@ -0,0 +1,474 @@
+"""End-to-end benchmark of the voice pipeline with recorded audio and fake services.
+
+Run from the project root:
+
+    python benchmarks/bench_pipeline.py [--corpus DIR] [--repeat N] [--speed X]
+        [--stt-delay S] [--llm-delay S] [--llm-token-delay S] [--control-latency S]
+        [--stt-slow-rate R] [--stt-error-rate R] [--llm-slow-rate R] [--llm-error-rate R]
+        [--slow-delay S] [--hedge]
+        [--json OUT] [--baseline FILE] [--save-baseline FILE]
+
+Every clip in the corpus is replayed through a ReplayCaptureService into the
+real pipeline: VAD endpointing, a FakeSTTBackend returning the clip's scripted
+transcript, the tiered parser with a local fake LLM server behind it, and
+execution against a FakeControlBackend. No microphone, API key or media
+player is needed.
+
+The fault options make that fraction of STT or LLM calls slow or failing.
+With --hedge a second fake STT backend and a second fake LLM server are
+configured as fallbacks, so the provider router can hedge and fail over.
+
+A corpus directory holds 16 kHz mono int16 WAV files and a manifest.json
+listing {"file", "transcript", "expected"} entries, where "expected" is the
+list of commands the transcript should parse to. Without --corpus a synthetic
+corpus is generated.
+
+Reports latency percentiles per stage, throughput, CPU time and memory per
+stage and for the whole process, and with --baseline flags stages that got
+slower than the stored run by more than --tolerance. Exits with status 1 on
+a regression.
+
+Stage memory is how much the process's peak RSS grew while the stage ran,
+summed over its calls, and with --tracemalloc also the mean change in
+traced Python heap per call. Stages overlap on different threads, so
+growth is charged to every stage running when it happens.
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import io
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+from collections import Counter, defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeServiceServer  # noqa: E402
+
+SAMPLE_RATE = 16000
+
+# Transcript and the commands it should produce. Some are deliberately
+# outside what the rules handle confidently so the LLM tier is exercised.
+CORPUS = [
+    ("pause the music", [{"action": "pause", "platform": "spotify"}]),
+    ("play hotel california on spotify", [{"action": "play", "platform": "spotify", "song": "hotel california"}]),
+    ("next song", [{"action": "next", "platform": "spotify"}]),
+    ("volume up", [{"action": "volume_up"}]),
+    ("set volume to 40%", [{"action": "set_volume", "volume_level": 40}]),
+    ("play bohemian rhapsody on youtube", [{"action": "play", "platform": "youtube", "song": "bohemian rhapsody"}]),
+    ("skip this video on youtube", [{"action": "next", "platform": "youtube"}]),
+    ("pause spotify and set the volume to 30", [
+        {"action": "pause", "platform": "spotify"},
+        {"action": "set_volume", "volume_level": 30},
+    ]),
+    ("could you make it a bit quieter", [{"action": "volume_down"}]),
+    ("hey nova can you play something by the beatles", [
+        {"action": "play", "platform": "spotify", "song": "something by the beatles"},
+    ]),
+    ("resume", [{"action": "resume", "platform": "spotify"}]),
+    ("go back to the last track", [{"action": "previous", "platform": "spotify"}]),
+]
+
+# Stages shown in the report, in pipeline order
+STAGES = [
+    "listen", "record", "stt", "parse", "parse.local", "parse.model", "parse.llm",
+    "llm.first_command", "execute", "control", "wake_to_action",
+]
+
+# Seconds of synthetic "speech" per word, matching FakeSTTBackend's default
+SECONDS_PER_WORD = 0.3
+
+# ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT / 2 ** 20
+
+def synthesize(transcript, rng):
+    """Speech-like audio: one band-limited noise burst per word"""
+    lead = np.zeros(int(0.15 * SAMPLE_RATE))
+    bursts = []
+    for _ in transcript.split():
+        n = int(SECONDS_PER_WORD * SAMPLE_RATE)
+        envelope = np.sin(np.linspace(0, np.pi, n)) ** 0.5
+        noise = np.convolve(rng.normal(0, 1, n), np.ones(8) / 8, mode="same")
+        bursts.append(noise * envelope * 6000)
+    audio = np.concatenate([lead] + bursts)
+    return np.clip(audio, -32768, 32767).astype(np.int16)
+
+def write_wav(path, samples):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.tobytes())
+
+def read_wav(path):
+    with wave.open(path, "rb") as f:
+        if f.getnchannels() != 1 or f.getsampwidth() != 2 or f.getframerate() != SAMPLE_RATE:
+            raise ValueError(f"{path}: expected 16 kHz mono 16-bit audio")
+        return np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+
+def generate_corpus(directory):
+    """Write the built-in corpus as WAV files plus a manifest"""
+    rng = np.random.default_rng(0)
+    manifest = []
+    for i, (transcript, expected) in enumerate(CORPUS):
+        name = f"{i:02d}.wav"
+        write_wav(os.path.join(directory, name), synthesize(transcript, rng))
+        manifest.append({"file": name, "transcript": transcript, "expected": expected})
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+def load_corpus(directory):
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    for entry in manifest:
+        entry["audio"] = read_wav(os.path.join(directory, entry["file"]))
+    return manifest
+
+def load_app(server, secondary=None):
+    """Import the app wired to the fake services"""
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ["OPENAI_BASE_URL"] = f"{server.url}/v1"
+    if secondary is not None:
+        os.environ["NOVA_LLM_SECONDARY_BASE_URL"] = f"{secondary.url}/v1"
+    else:
+        os.environ.pop("NOVA_LLM_SECONDARY_BASE_URL", None)
+    os.environ["NOVA_YOUTUBE_SEARCH_URL"] = f"{server.url}/results"
+    # Keep the run self-contained: no caches carried over from earlier runs
+    os.environ.pop("NOVA_PARSE_CACHE_DB", None)
+    os.environ.pop("NOVA_YOUTUBE_CACHE_DB", None)
+
+    import main as app
+    logging.getLogger("nova").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return app
+
+def run(corpus, args):
+    answers = {entry["transcript"]: entry["expected"] for entry in corpus}
+    server = FakeServiceServer(
+        answers=answers,
+        llm_delay=args.llm_delay,
+        token_delay=args.llm_token_delay,
+        search_delay=args.search_delay,
+        slow_rate=args.llm_slow_rate,
+        slow_delay=args.slow_delay,
+        error_rate=args.llm_error_rate,
+        seed=0,
+    ).start()
+    secondary = None
+    if args.hedge:
+        secondary = FakeServiceServer(
+            answers=answers, llm_delay=args.llm_delay, token_delay=args.llm_token_delay
+        ).start()
+    app = load_app(server, secondary)
+
+    from audio_capture import ReplayCaptureService
+    from control_bridge import FakeControlBackend, set_control_backend
+    from pipeline import Pipeline
+    from speculation import SpeculativeParser, SPECULATION_ENABLED
+    from speech import listen_to_command
+    from stt import FakeSTTBackend, get_stt_router
+    from llm_parser import get_llm_router
+    from tracing import tracer
+
+    tracer.reset()
+    tracer.enabled = True
+    control = FakeControlBackend(latency=args.control_latency)
+    set_control_backend(control)
+    stt = FakeSTTBackend(
+        seconds_per_word=SECONDS_PER_WORD, final_delay=args.stt_delay,
+        slow_rate=args.stt_slow_rate, slow_delay=args.slow_delay, error_rate=args.stt_error_rate, seed=0,
+    )
+    fallbacks = []
+    if args.hedge:
+        fallbacks.append(FakeSTTBackend(seconds_per_word=SECONDS_PER_WORD, final_delay=args.stt_delay, name="fallback"))
+    capture = ReplayCaptureService(speed=args.speed)
+    capture.start()
+
+    turns = [entry for _ in range(args.repeat) for entry in corpus]
+    remaining = iter(turns)
+    finished = threading.Event()
+    lock = threading.Lock()
+    done = [0]
+    cpu = defaultdict(list)
+    rss_growth = defaultdict(float)
+    heap_delta = defaultdict(list)
+    executed = []
+
+    def complete():
+        with lock:
+            done[0] += 1
+            if done[0] == len(turns):
+                finished.set()
+
+    def cpu_timed(stage, func):
+        """Wrap `func` to record the CPU time and memory growth of each call"""
+        @functools.wraps(func)
+        def wrapper(*a, **kw):
+            start = time.thread_time()
+            rss = peak_rss_mb()
+            heap = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+            try:
+                return func(*a, **kw)
+            finally:
+                cpu[stage].append(time.thread_time() - start)
+                grown = peak_rss_mb() - rss
+                with lock:
+                    rss_growth[stage] += grown
+                if heap is not None and tracemalloc.is_tracing():
+                    heap_delta[stage].append(tracemalloc.get_traced_memory()[0] - heap)
+        return wrapper
+
+    def detect_wake_word():
+        entry = next(remaining, None)
+        if entry is None:
+            finished.wait()
+            raise EOFError("Corpus finished")
+        for backend in [stt] + fallbacks:
+            backend.transcript = entry["transcript"]
+        # The wake word ends where the clip starts
+        return capture.play(entry["audio"]).result()
+
+    def on_done(turn, ok):
+        # Called for every turn, including ones that fail before execution
+        if turn.commands:
+            with lock:
+                executed.append(json.dumps([c.model_dump(exclude_none=True) for c in turn.commands], sort_keys=True))
+        complete()
+
+    parse = cpu_timed("parse", app.parse_commands)
+    prepare = cpu_timed("prepare", app.prepare_commands)
+    pipeline = Pipeline(
+        detect_wake_word=detect_wake_word,
+        listen=cpu_timed("listen", functools.partial(
+            listen_to_command, capture=capture, backend=stt, fallbacks=fallbacks
+        )),
+        parse=parse,
+        execute=cpu_timed("execute", app.dispatch_commands),
+        make_speculator=(lambda: SpeculativeParser(parse, prepare)) if SPECULATION_ENABLED else None,
+        on_feedback=lambda message: None,
+        on_done=on_done,
+    )
+
+    async def drive():
+        task = asyncio.ensure_future(pipeline.run())
+        await asyncio.get_running_loop().run_in_executor(None, finished.wait, args.timeout)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    rss_start = peak_rss_mb()
+    if args.tracemalloc:
+        tracemalloc.start()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(drive())
+    wall = time.perf_counter() - wall_start
+    process_cpu = time.process_time() - cpu_start
+    heap_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+
+    capture.stop()
+    server.stop()
+    if secondary is not None:
+        secondary.stop()
+
+    # Turns may finish parsing out of order, so match executed commands as a multiset
+    expected = Counter(json.dumps(entry["expected"], sort_keys=True) for entry in turns)
+    correct = sum((expected & Counter(executed)).values())
+    spans = tracer.summary()
+    stages = {}
+    for stage in STAGES:
+        if stage not in spans:
+            continue
+        span = spans[stage]
+        stages[stage] = {
+            "count": span["count"],
+            "mean": span["mean"],
+            **{key: span[key] for key in ("p50", "p95", "p99", "max")},
+        }
+        if cpu.get(stage):
+            stages[stage]["cpu_mean"] = sum(cpu[stage]) / len(cpu[stage])
+            stages[stage]["rss_growth_mb"] = rss_growth[stage]
+        if heap_delta.get(stage):
+            stages[stage]["heap_delta_kb"] = sum(heap_delta[stage]) / len(heap_delta[stage]) / 1024
+
+    return {
+        "config": {
+            "turns": len(turns),
+            "speed": args.speed,
+            "stt_delay": args.stt_delay,
+            "llm_delay": args.llm_delay,
+            "llm_token_delay": args.llm_token_delay,
+            "search_delay": args.search_delay,
+            "control_latency": args.control_latency,
+            "stt_slow_rate": args.stt_slow_rate,
+            "stt_error_rate": args.stt_error_rate,
+            "llm_slow_rate": args.llm_slow_rate,
+            "llm_error_rate": args.llm_error_rate,
+            "slow_delay": args.slow_delay,
+            "hedge": args.hedge,
+        },
+        "completed": done[0],
+        "wall": wall,
+        "throughput": done[0] / wall,
+        "process_cpu": process_cpu,
+        "cpu_utilization": process_cpu / wall,
+        "startup_rss_mb": rss_start,
+        "peak_rss_mb": peak_rss_mb(),
+        "heap_peak_mb": heap_peak / 2 ** 20 if heap_peak is not None else None,
+        "parse_accuracy": correct / len(turns),
+        "requests": {
+            **server.requests,
+            "llm_secondary": secondary.requests["llm"] if secondary is not None else 0,
+            "control_submits": len(control.calls),
+        },
+        "llm_prompt_chars": server.prompt_chars / server.requests["llm"] if server.requests["llm"] else 0,
+        "stages": stages,
+        "routers": {
+            "stt": get_stt_router([stt.name] + [backend.name for backend in fallbacks]).stats(),
+            "llm": get_llm_router().stats(),
+        },
+    }
+
+def report(results):
+    config = results["config"]
+    print(
+        f"Turns: {results['completed']}/{config['turns']} at {config['speed']}x real time "
+        f"(stt {config['stt_delay'] * 1000:.0f} ms, llm {config['llm_delay'] * 1000:.0f} ms "
+        f"+ {config['llm_token_delay'] * 1000:.0f} ms/token, "
+        f"control {config['control_latency'] * 1000:.0f} ms)"
+    )
+    faults = {key: config[key] for key in ("stt_slow_rate", "stt_error_rate", "llm_slow_rate", "llm_error_rate")}
+    if any(faults.values()) or config["hedge"]:
+        print(
+            f"Faults: {', '.join(f'{key} {value:.0%}' for key, value in faults.items())}, "
+            f"slow by {config['slow_delay'] * 1000:.0f} ms; hedging {'on' if config['hedge'] else 'off'}"
+        )
+    print()
+    print(
+        f"{'stage':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'cpu ms':>10}"
+        f"{'rss+ MB':>10}{'heap KB':>10}"
+    )
+    for stage, stats in results["stages"].items():
+        cpu = f"{stats['cpu_mean'] * 1000:>10.2f}" if "cpu_mean" in stats else f"{'':>10}"
+        rss = f"{stats['rss_growth_mb']:>10.1f}" if "rss_growth_mb" in stats else f"{'':>10}"
+        heap = f"{stats['heap_delta_kb']:>10.1f}" if "heap_delta_kb" in stats else f"{'':>10}"
+        print(
+            f"{stage:<18}{stats['count']:>7}{stats['p50'] * 1000:>10.2f}{stats['p95'] * 1000:>10.2f}"
+            f"{stats['p99'] * 1000:>10.2f}{stats['max'] * 1000:>10.2f}{cpu}{rss}{heap}"
+        )
+
+    print(f"\nthroughput        {results['throughput']:.2f} turns/s over {results['wall']:.1f} s")
+    print(f"process cpu       {results['process_cpu']:.2f} s ({results['cpu_utilization'] * 100:.0f}% of one core)")
+    print(f"peak rss          {results['peak_rss_mb']:.0f} MB ({results['startup_rss_mb']:.0f} MB before the first turn)")
+    if results["heap_peak_mb"] is not None:
+        print(f"python heap peak  {results['heap_peak_mb']:.1f} MB")
+    print(f"parse accuracy    {results['parse_accuracy'] * 100:.0f}%")
+    requests = results["requests"]
+    print(
+        f"requests          {requests['llm']} llm ({requests['errors']} failed), "
+        f"{requests['llm_secondary']} secondary llm, {requests['search']} search, "
+        f"{requests['control_submits']} control submits"
+    )
+    print(f"llm prompt        {results['llm_prompt_chars']:.0f} chars per request")
+    for kind, providers in results["routers"].items():
+        for name, stats in providers.items():
+            print(
+                f"{kind + ' ' + name:<18}{stats['calls']} calls, {stats['wins']} won, {stats['hedges']} hedged, "
+                f"{stats['failures']} failed, {stats['timeouts']} timed out, circuit {stats['breaker']}"
+            )
+
+def compare(results, baseline, tolerance, min_delta):
+    """Print changes against a baseline run; returns the regressions found"""
+    if baseline["config"] != results["config"]:
+        print("\nwarning: baseline was recorded with a different configuration")
+
+    print(f"\n{'vs baseline':<18}{'metric':>7}{'base ms':>10}{'now ms':>10}{'change':>10}")
+    regressions = []
+    for stage, base in baseline["stages"].items():
+        current = results["stages"].get(stage)
+        if current is None:
+            continue
+        for metric in ("p50", "p95"):
+            before, after = base[metric], current[metric]
+            change = (after - before) / before if before else 0.0
+            slower = change > tolerance and (after - before) > min_delta
+            flag = "  REGRESSION" if slower else ""
+            print(f"{stage:<18}{metric:>7}{before * 1000:>10.2f}{after * 1000:>10.2f}{change * 100:>9.1f}%{flag}")
+            if slower:
+                regressions.append(f"{stage} {metric}")
+
+    change = (results["throughput"] - baseline["throughput"]) / baseline["throughput"]
+    flag = "  REGRESSION" if change < -tolerance else ""
+    print(f"{'throughput':<18}{'':>7}{baseline['throughput']:>10.2f}{results['throughput']:>10.2f}{change * 100:>9.1f}%{flag}")
+    if flag:
+        regressions.append("throughput")
+    return regressions
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--corpus", help="directory with WAV files and manifest.json")
+    arg_parser.add_argument("--repeat", type=int, default=2, help="times to replay the corpus")
+    arg_parser.add_argument("--speed", type=float, default=4.0, help="replay speed relative to real time")
+    arg_parser.add_argument("--stt-delay", type=float, default=0.15, help="seconds from end of audio to transcript")
+    arg_parser.add_argument("--llm-delay", type=float, default=0.4, help="seconds to the first fake LLM token")
+    arg_parser.add_argument("--llm-token-delay", type=float, default=0.02, help="seconds per fake LLM token")
+    arg_parser.add_argument("--search-delay", type=float, default=0.1, help="seconds per fake YouTube search")
+    arg_parser.add_argument("--control-latency", type=float, default=0.02, help="seconds per control round trip")
+    arg_parser.add_argument("--stt-slow-rate", type=float, default=0.0, help="fraction of slow transcripts")
+    arg_parser.add_argument("--stt-error-rate", type=float, default=0.0, help="fraction of failed transcripts")
+    arg_parser.add_argument("--llm-slow-rate", type=float, default=0.0, help="fraction of slow completions")
+    arg_parser.add_argument("--llm-error-rate", type=float, default=0.0, help="fraction of failed completions")
+    arg_parser.add_argument("--slow-delay", type=float, default=1.0, help="seconds a slow call takes longer")
+    arg_parser.add_argument("--hedge", action="store_true", help="configure fallback STT and LLM fakes")
+    arg_parser.add_argument("--timeout", type=float, default=300.0)
+    arg_parser.add_argument("--tracemalloc", action="store_true", help="also measure the Python heap, overall and per stage")
+    arg_parser.add_argument("--json", help="write the results to this file")
+    arg_parser.add_argument("--baseline", help="compare against results saved with --save-baseline")
+    arg_parser.add_argument("--save-baseline", help="store these results as the new baseline")
+    arg_parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown before flagging")
+    arg_parser.add_argument("--min-delta-ms", type=float, default=10.0, help="ignore changes smaller than this")
+    args = arg_parser.parse_args()
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            generate_corpus(directory)
+            corpus = load_corpus(directory)
+
+    results = run(corpus, args)
+    report(results)
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms / 1000)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
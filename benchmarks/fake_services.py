@@ -0,0 +1,185 @@
+"""Local stand-ins for the network services Nova talks to.
+
+FakeServiceServer answers on 127.0.0.1 with:
+
+- an OpenAI-compatible ``POST /v1/chat/completions`` endpoint that returns
+  the commands for the transcript in the last user message, streamed as
+  server-sent events when the request asks for ``stream``, and
+- a YouTube-style ``GET /results`` page with a fixed videoId per query.
+
+Point the app at it with ``OPENAI_BASE_URL=<url>/v1`` and
+``NOVA_YOUTUBE_SEARCH_URL=<url>/results``. A second instance can stand in
+for the secondary LLM endpoint (``NOVA_LLM_SECONDARY_BASE_URL=<url>/v1``).
+
+Completions can be made slow or failing at random with ``slow_rate``,
+``slow_delay`` and ``error_rate``, to exercise the provider router.
+"""
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import command_parser  # noqa: E402
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server.owner
+        url = urlparse(self.path)
+        if url.path != "/results":
+            self._send(404, "{}")
+            return
+        query = parse_qs(url.query).get("search_query", [""])[0]
+        server.count("search")
+        time.sleep(server.search_delay)
+        video_id = hashlib.sha1(query.encode()).hexdigest()[:11]
+        self._send(200, f'<script>var ytInitialData = {{"videoId":"{video_id}"}};</script>', "text/html")
+
+    def do_POST(self):
+        server = self.server.owner
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._send(404, "{}")
+            return
+
+        messages = request.get("messages", [])
+        server.count("llm", prompt_chars=sum(len(m.get("content") or "") for m in messages))
+        extra_delay, fail = server.inject()
+        time.sleep(server.llm_delay + extra_delay)
+        if fail:
+            server.count("errors")
+            self._send(500, json.dumps({"error": {"message": "Injected failure", "type": "server_error"}}))
+            return
+        transcript = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        content = json.dumps({"commands": server.answer(transcript)})
+        if request.get("stream"):
+            self._stream(request, content)
+            return
+        # Without streaming the whole reply is generated before anything is sent
+        time.sleep(server.token_delay * -(-len(content) // server.chars_per_token))
+        self._send(200, json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }))
+
+
+    def _stream(self, request, content):
+        """Send the reply a few characters at a time, like a model generating tokens"""
+        server = self.server.owner
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta, finish_reason=None):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        event({"role": "assistant", "content": ""})
+        for i in range(0, len(content), server.chars_per_token):
+            time.sleep(server.token_delay)
+            event({"content": content[i:i + server.chars_per_token]})
+        event({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class FakeServiceServer:
+    """Threaded local HTTP server for the fake LLM and YouTube search"""
+
+    def __init__(self, answers=None, llm_delay=0.0, search_delay=0.0, token_delay=0.0, chars_per_token=4,
+                 slow_rate=0.0, slow_delay=0.0, error_rate=0.0, seed=None):
+        # Scripted transcript -> commands; anything else goes through the rule parser
+        self.answers = {command_parser._normalize(k): v for k, v in (answers or {}).items()}
+        # llm_delay is the time to the first token; streamed replies then take token_delay per token
+        self.llm_delay = llm_delay
+        self.token_delay = token_delay
+        self.chars_per_token = chars_per_token
+        self.search_delay = search_delay
+        # Fraction of completions delayed by slow_delay before the first token, and that fail with a 500
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.requests = {"llm": 0, "search": 0, "errors": 0}
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.owner = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._httpd.server_port}"
+
+    def answer(self, transcript):
+        scripted = self.answers.get(command_parser._normalize(transcript))
+        if scripted is not None:
+            return scripted
+        commands, _ = command_parser.parse_commands_with_confidence(transcript)
+        return commands
+
+    def inject(self):
+        """Extra delay and whether to fail, for one completion"""
+        with self._lock:
+            slow = self.slow_rate and self._random.random() < self.slow_rate
+            fail = self.error_rate and self._random.random() < self.error_rate
+        return (self.slow_delay if slow else 0.0), bool(fail)
+
+    def count(self, kind, prompt_chars=0):
+        with self._lock:
+            self.requests[kind] += 1
+            self.prompt_chars += prompt_chars
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-services", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
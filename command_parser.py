@@ -1,87 +1,270 @@
-def parse_command(text):
+import re
+from collections import namedtuple
+
+# Media control commands
+MEDIA_COMMANDS = {
+    "pause": ["pause", "stop"],
+    "resume": ["resume", "continue", "unpause"],
+    "next": ["next", "skip", "next song", "next track", "next video"],
+    "previous": ["previous", "back", "go back", "last song", "last track", "last video"]
+}
+
+# Keywords that start a play request; whatever follows them is the song
+PLAY_COMMANDS = ["play", "start", "begin", "put on"]
+
+# Platform keywords
+PLATFORMS = {
+    "spotify": ["spotify", "on spotify", "in spotify"],
+    "youtube": ["youtube", "on youtube", "in youtube", "yt", "on yt"]
+}
+
+# Volume commands
+VOLUME_COMMANDS = {
+    "up": ["volume up", "increase volume", "increase the volume", "louder", "turn up", "turn it up"],
+    "down": ["volume down", "decrease volume", "decrease the volume", "quieter", "turn down", "turn it down"]
+}
+
+# Keywords that introduce an explicit volume level ("set volume to 40%")
+SET_VOLUME_COMMANDS = ["set volume", "set the volume", "set volume to", "set the volume to", "volume to", "volume at"]
+
+# Words that carry no meaning for the rule-based parser; anything else left
+# over after removing keywords means the rules may have missed something
+FILLER_WORDS = {
+    "the", "a", "my", "it", "this", "that", "some", "please", "now", "music",
+    "song", "track", "video", "playback", "volume", "little", "bit",
+    "up", "down", "to", "on", "in", "hey", "nova", "can", "you", "could",
+    "percent", "set", "at",
+}
+
+# Words that join two commands in one request ("pause and set the volume to 30")
+CONJUNCTIONS = ["and", "then", "and then", "also", "and also", "after that"]
+
+KeywordHit = namedtuple("KeywordHit", ["kind", "value", "start", "end"])
+
+def _trie_pattern(words):
+    """Regex source for `words` arranged as a character trie.
+
+    Alternatives share their prefixes, so the regex engine walks the trie
+    once per position instead of trying every keyword in turn, and matching
+    cost stays flat as the vocabulary grows.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+def build_vocabulary():
+    """Map every keyword to the (kind, value) it stands for"""
+    vocabulary = {}
+    for action, keywords in MEDIA_COMMANDS.items():
+        vocabulary.update({k: ("action", action) for k in keywords})
+    vocabulary.update({k: ("play", "play") for k in PLAY_COMMANDS})
+    for platform, keywords in PLATFORMS.items():
+        vocabulary.update({k: ("platform", platform) for k in keywords})
+    for direction, keywords in VOLUME_COMMANDS.items():
+        vocabulary.update({k: ("volume", f"volume_{direction}") for k in keywords})
+    vocabulary.update({k: ("set_volume", "set_volume") for k in SET_VOLUME_COMMANDS})
+    return vocabulary
+
+class KeywordMatcher:
+    """Finds every keyword and number in a transcript in a single regex pass"""
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+        self.pattern = re.compile(
+            rf"(?<!\w)(?:(?P<kw>{_trie_pattern(vocabulary)})|(?P<num>\d{{1,3}})(?:\s?%| percent)?)(?!\w)"
+        )
+
+    def find(self, text):
+        hits = []
+        for match in self.pattern.finditer(text):
+            keyword = match.group("kw")
+            if keyword is not None:
+                kind, value = self.vocabulary[keyword]
+            else:
+                kind, value = "number", int(match.group("num"))
+            hits.append(KeywordHit(kind, value, match.start(), match.end()))
+        return hits
+
+matcher = KeywordMatcher(build_vocabulary())
+
+_CONJUNCTION = re.compile(rf"\s*(?:,|(?<!\w)(?:{_trie_pattern(CONJUNCTIONS)})(?!\w))\s*")
+
+# Keyword kinds that can open a new command after a conjunction
+_COMMAND_STARTS = {"action", "volume", "set_volume", "play"}
+
+def _normalize(text):
+    return " ".join(text.lower().split())
+
+_WORD = re.compile(r"[\w']+")
+
+def _has_content(text):
+    return any(word not in FILLER_WORDS for word in _WORD.findall(text))
+
+def _unknown_words(text, spans):
+    """Non-filler words of `text` outside the given (sorted) spans"""
+    unknown = 0
+    position = 0
+    for start, end in spans:
+        if start > position:
+            unknown += sum(1 for word in _WORD.findall(text, position, start) if word not in FILLER_WORDS)
+        position = max(position, end)
+    unknown += sum(1 for word in _WORD.findall(text, position) if word not in FILLER_WORDS)
+    return unknown
+
+def _interpret(text, hits):
+    """Turn keyword hits into a command dict plus a confidence score"""
+    play = next((hit for hit in hits if hit.kind == "play"), None)
+    song_span = None
+    if play is not None:
+        # The song runs from the play keyword to the next platform keyword
+        end = next(
+            (hit.start for hit in hits if hit.kind == "platform" and hit.start >= play.end),
+            len(text)
+        )
+        # A span of filler ("play the music") is a resume, not a song
+        if _has_content(text[play.end:end]):
+            song_span = (play.end, end)
+            # Keywords inside a song title ("play don't stop me now") don't count
+            hits = [hit for hit in hits if hit.end <= play.end or hit.start >= end]
+
+    platform_hit = number = set_volume = action = None
+    actions = set()
+    spans = []
+    for hit in hits:
+        kind = hit.kind
+        if kind == "action" or kind == "volume":
+            actions.add(hit.value)
+            action = action or hit.value
+        elif kind == "platform":
+            platform_hit = platform_hit or hit
+        elif kind == "number":
+            number = number or hit
+        elif kind == "set_volume":
+            set_volume = hit
+        spans.append((hit.start, hit.end))
+    if song_span is not None:
+        spans.append(song_span)
+        spans.sort()
+
+    platform = platform_hit.value if platform_hit else "spotify"
+    penalty = 0.25 * _unknown_words(text, spans)
+
+    if number is not None and (set_volume is not None or "volume" in text):
+        result = {"action": "set_volume", "volume_level": min(number.value, 100)}
+        return result, max(0.1, (0.3 if actions else 0.95) - penalty)
+
+    if song_span is not None:
+        song = text[song_span[0]:song_span[1]].strip(" .,!?")
+        result = {"action": "play", "platform": platform, "song": song}
+        return result, max(0.1, (0.9 if platform_hit else 0.8) - penalty)
+
+    if action is None:
+        if play is None:
+            return None, 0.0
+        # A bare "play" with nothing after it means resume
+        action = "resume"
+
+    if action.startswith("volume_"):
+        result = {"action": action}
+    else:
+        result = {"action": action, "platform": platform}
+
+    if len(actions) > 1:
+        return result, 0.3
+    return result, max(0.1, 0.95 - penalty)
+
+def parse_command_with_confidence(text):
+    """Parse with the rules and estimate how far the result can be trusted.
+
+    Returns a (command dict, confidence) pair; confidence is 0.0 when the
+    rules found nothing. Transcripts made only of known keywords score high,
+    while unexplained words or competing actions score low.
+    """
+    if not text:
+        return None, 0.0
+    text = _normalize(text)
+    return _interpret(text, matcher.find(text))
+
+def _split(text, hits):
+    """(start, end) spans of the separate commands in a transcript.
+
+    A conjunction only splits when the next thing after it is a command
+    keyword, so song titles like "simon and garfunkel" stay in one piece.
+    """
+    spans = []
+    start = 0
+    for match in _CONJUNCTION.finditer(text):
+        following = next((hit for hit in hits if hit.start >= match.end()), None)
+        if following is None or following.kind not in _COMMAND_STARTS:
+            continue
+        if _has_content(text[match.end():following.start]):
+            continue
+        if match.start() > start:
+            spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+def parse_commands_with_confidence(text):
+    """Parse a transcript that may hold several commands.
+
+    Returns an ordered list of command dicts and the confidence of the
+    least certain one. A command without its own platform inherits the
+    platform named earlier ("pause youtube and skip this video").
+    """
     if not text:
-        return None
-
-    text = text.lower().strip()
-
-    # Media control commands
-    media_commands = {
-        "pause": ["pause", "stop"],
-        "resume": ["resume", "play", "continue"],
-        "next": ["next", "skip", "next song", "next track"],
-        "previous": ["previous", "back", "last song", "last track"]
-    }
-
-    # Platform keywords
-    platforms = {
-        "spotify": ["spotify", "on spotify", "in spotify"],
-        "youtube": ["youtube", "on youtube", "in youtube", "yt"]
-    }
-
-    # Volume commands
-    volume_commands = {
-        "up": ["volume up", "increase volume", "louder", "turn up"],
-        "down": ["volume down", "decrease volume", "quieter", "turn down"]
-    }
-
-    # Check for volume commands first
-    for action, keywords in volume_commands.items():
-        if any(keyword in text for keyword in keywords):
-            return {"action": f"volume_{action}"}
-
-    # Check for media control commands
-    for action, keywords in media_commands.items():
-        if any(keyword in text for keyword in keywords):
-            # Determine platform
-            platform = None
-            for p, platform_keywords in platforms.items():
-                if any(keyword in text for keyword in platform_keywords):
-                    platform = p
-                    break
-
-            # If no platform specified, default to Spotify
-            if not platform:
-                platform = "spotify"
-
-            return {
-                "action": action,
-                "platform": platform
-            }
-
-    # Check for play commands
-    if "play" in text:
-        # Determine platform
-        platform = None
-        for p, keywords in platforms.items():
-            if any(keyword in text for keyword in keywords):
-                platform = p
-                break
-
-        # If no platform specified, default to Spotify
-        if not platform:
-            platform = "spotify"
-
-        return {
-            "action": "play",
-            "platform": platform,
-            "song": extract_song(text, platform)
-        }
-
-    return None
-
-def extract_song(text, platform):
-    # Remove play commands
-    play_commands = ["play", "start", "begin", "put on"]
-    for cmd in play_commands:
-        text = text.replace(cmd, "")
-
-    # Remove platform commands
-    platform_commands = {
-        "spotify": ["spotify", "on spotify", "in spotify"],
-        "youtube": ["youtube", "on youtube", "in youtube", "yt"]
-    }
-    for cmd in platform_commands[platform]:
-        text = text.replace(cmd, "")
-
-    # Clean up the text
-    return text.strip()
+        return [], 0.0
+    text = _normalize(text)
+    hits = matcher.find(text)
+    if _CONJUNCTION.search(text) is None:
+        result, confidence = _interpret(text, hits)
+        return ([result], confidence) if result else ([], 0.0)
+
+    results = []
+    confidence = 1.0
+    platform = None
+    for start, end in _split(text, hits):
+        segment_hits = [
+            hit._replace(start=hit.start - start, end=hit.end - start)
+            for hit in hits if hit.start >= start and hit.end <= end
+        ]
+        segment = text[start:end]
+        result, segment_confidence = _interpret(segment, segment_hits)
+        if result is None and not _has_content(segment):
+            continue
+        if result is None:
+            # Part of the request is unexplained; let a smarter tier look at it
+            confidence = min(confidence, 0.2)
+            continue
+        if any(hit.kind == "platform" for hit in segment_hits):
+            platform = result.get("platform")
+        elif platform and "platform" in result:
+            result["platform"] = platform
+        results.append(result)
+        confidence = min(confidence, segment_confidence)
+
+    return results, (confidence if results else 0.0)
+
+def parse_command(text):
+    result, _ = parse_command_with_confidence(text)
+    return result
+
+def extract_song(text, platform=None):
+    """Return the song named after a play keyword, or an empty string"""
+    result = parse_command(text)
+    if result and result["action"] == "play":
+        return result["song"]
+    return ""
@@ -0,0 +1,498 @@
+import itertools
+import json
+import os
+import select
+import subprocess
+import sys
+import threading
+import time
+import webbrowser
+from dataclasses import dataclass
+from typing import Any, Optional
+from dotenv import load_dotenv
+from logger import logger
+from registry import LazyRegistry
+
+load_dotenv()
+
+# "applescript" (macOS), "mpris" (Linux D-Bus) or "fake" (in-process, for tests)
+CONTROL_BACKEND = os.getenv(
+    "NOVA_CONTROL_BACKEND", "applescript" if sys.platform == "darwin" else "mpris"
+)
+# Seconds the AppleScript bridge waits for the replies to one submit
+BRIDGE_TIMEOUT = float(os.getenv("NOVA_CONTROL_TIMEOUT", "10"))
+
+
+@dataclass(frozen=True)
+class ControlOp:
+    """One player or system operation.
+
+    `action` is one of play, pause, resume, next, previous, get_volume or
+    set_volume. For play, `arg` is the song query on Spotify and the video
+    link on YouTube; for set_volume it is the level (0-100).
+    """
+    action: str
+    platform: Optional[str] = None
+    arg: Any = None
+
+
+@dataclass
+class ControlResult:
+    ok: bool
+    output: str = ""
+    error: str = ""
+
+    # Mirror subprocess.CompletedProcess so callers can treat both alike
+    @property
+    def returncode(self):
+        return 0 if self.ok else 1
+
+    @property
+    def stdout(self):
+        return self.output
+
+    @property
+    def stderr(self):
+        return self.error
+
+
+class ControlBackend:
+    """A long-lived channel to the media players and system volume"""
+    name = None
+
+    def submit(self, ops):
+        """Run several operations in one round trip; returns one result per op"""
+        raise NotImplementedError
+
+    def execute(self, op):
+        return self.submit([op])[0]
+
+    def close(self):
+        pass
+
+
+def _quote(text):
+    """Escape text for use inside an AppleScript string literal"""
+    return str(text).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _chrome_js(javascript):
+    return f'''
+        tell application "Google Chrome"
+            execute front window's active tab javascript "{_quote(javascript)}"
+        end tell
+        '''
+
+
+_SPOTIFY_SCRIPTS = {
+    "pause": 'tell application "Spotify" to pause',
+    "resume": 'tell application "Spotify" to play',
+    "next": 'tell application "Spotify" to next track',
+    "previous": 'tell application "Spotify" to previous track',
+}
+
+_YOUTUBE_SCRIPTS = {
+    "pause": _chrome_js("document.querySelector('video').pause()"),
+    "resume": _chrome_js("document.querySelector('video').play()"),
+    "next": _chrome_js("document.querySelector('.ytp-next-button').click()"),
+    "previous": _chrome_js("document.querySelector('.ytp-prev-button').click()"),
+}
+
+
+def applescript_for(op):
+    """AppleScript source implementing a ControlOp"""
+    if op.action == "get_volume":
+        return "output volume of (get volume settings)"
+    if op.action == "set_volume":
+        return f"set volume output volume {max(0, min(100, int(op.arg)))}"
+    if op.action == "play" and op.platform == "spotify":
+        return f'''
+        tell application "Spotify"
+            activate
+            play track "{_quote(f"spotify:search:{op.arg}")}"
+        end tell
+        '''
+    if op.action == "play" and op.platform == "youtube":
+        return f'''
+        tell application "Google Chrome"
+            if (count of windows) = 0 then
+                make new window
+            end if
+            set theUrl to "{_quote(op.arg)}"
+            if (count of tabs of front window) = 0 then
+                make new tab at end of tabs of front window with properties {{URL:theUrl}}
+            else
+                set URL of active tab of front window to theUrl
+            end if
+            activate
+        end tell
+        '''
+    scripts = _SPOTIFY_SCRIPTS if op.platform == "spotify" else _YOUTUBE_SCRIPTS
+    if op.platform in ("spotify", "youtube") and op.action in scripts:
+        return scripts[op.action]
+    raise ValueError(f"Unsupported operation: {op}")
+
+
+# JavaScript for Automation loop run by a single osascript process. It reads
+# one JSON request per line, compiles and runs the AppleScript source with
+# NSAppleScript, and answers with one JSON line per request.
+_JXA_BRIDGE = r"""
+ObjC.import('Foundation');
+var stdin = $.NSFileHandle.fileHandleWithStandardInput;
+var stdout = $.NSFileHandle.fileHandleWithStandardOutput;
+function respond(message) {
+    var line = $(JSON.stringify(message) + '\n');
+    stdout.writeData(line.dataUsingEncoding($.NSUTF8StringEncoding));
+}
+var buffer = '';
+while (true) {
+    var data = stdin.availableData;
+    if (data.length === 0) break;
+    buffer += $.NSString.alloc.initWithDataEncoding(data, $.NSUTF8StringEncoding).js;
+    var newline;
+    while ((newline = buffer.indexOf('\n')) >= 0) {
+        var line = buffer.slice(0, newline);
+        buffer = buffer.slice(newline + 1);
+        if (!line) continue;
+        var request = JSON.parse(line);
+        var error = Ref();
+        var script = $.NSAppleScript.alloc.initWithSource($(request.script));
+        var descriptor = script.executeAndReturnError(error);
+        if (descriptor && !descriptor.isNil()) {
+            var output = descriptor.stringValue;
+            respond({id: request.id, ok: true, output: output.isNil() ? '' : output.js});
+        } else {
+            var details = ObjC.deepUnwrap(error[0]) || {};
+            respond({id: request.id, ok: false, error: String(details.NSAppleScriptErrorMessage || 'AppleScript error')});
+        }
+    }
+}
+"""
+
+
+class _BridgeProcess:
+    """One osascript interpreter and the pipe protocol spoken with it"""
+
+    def __init__(self, channel, timeout):
+        self.channel = channel
+        self.timeout = timeout
+        self._process = None
+        self._pending = b""
+        self._lock = threading.Lock()
+
+    def _ensure_process(self):
+        if self._process is not None and self._process.poll() is None:
+            return
+        logger.info("Starting AppleScript bridge for %s", self.channel)
+        self._pending = b""
+        self._process = subprocess.Popen(
+            ["osascript", "-l", "JavaScript", "-e", _JXA_BRIDGE],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def _send(self, requests):
+        self._ensure_process()
+        payload = "".join(json.dumps(request) + "\n" for request in requests)
+        self._process.stdin.write(payload.encode())
+        self._process.stdin.flush()
+
+    def _read_line(self, deadline):
+        """Read one reply line, giving up at `deadline` (time.monotonic).
+
+        Reads the raw pipe so select() sees exactly what hasn't been consumed.
+        """
+        fd = self._process.stdout.fileno()
+        while b"\n" not in self._pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise TimeoutError(f"AppleScript bridge did not answer within {self.timeout:.1f}s")
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise BrokenPipeError("AppleScript bridge exited")
+            self._pending += chunk
+        line, _, self._pending = self._pending.partition(b"\n")
+        return line
+
+    def _receive(self, requests):
+        """Collect the replies to `requests`; stops early if the bridge fails"""
+        deadline = time.monotonic() + self.timeout
+        replies = {}
+        try:
+            while len(replies) < len(requests):
+                reply = json.loads(self._read_line(deadline))
+                replies[reply["id"]] = reply
+        except (TimeoutError, BrokenPipeError, OSError, ValueError) as e:
+            logger.error("AppleScript bridge for %s failed (%s), restarting it on the next call", self.channel, e)
+            self._kill()
+            error = str(e)
+            for request in requests:
+                replies.setdefault(request["id"], {"ok": False, "error": error})
+        return [replies[request["id"]] for request in requests]
+
+    def exchange(self, requests):
+        """Send `requests` and return one reply per request"""
+        with self._lock:
+            try:
+                self._send(requests)
+            except OSError as e:
+                # Nothing reached an interpreter that died (or never started),
+                # so the batch is safe to send once more to a fresh one
+                logger.warning("AppleScript bridge for %s failed (%s), restarting", self.channel, e)
+                self._kill()
+                self._send(requests)
+            return self._receive(requests)
+
+    def _kill(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+        self._pending = b""
+
+    def close(self):
+        with self._lock:
+            if self._process is not None:
+                self._process.stdin.close()
+                try:
+                    self._process.wait(timeout=1)
+                except subprocess.TimeoutExpired:
+                    self._kill()
+                self._process = None
+
+
+class AppleScriptBridge(ControlBackend):
+    """Keeps osascript processes open and pipelines scripts over their stdin.
+
+    Spawning osascript costs far more than running a short script, so the
+    bridge starts a JavaScript for Automation interpreter and sends every
+    script to it as a JSON line. Several operations are written before any
+    reply is read, so a batch costs a single round trip.
+
+    Each player (and the system volume) gets its own interpreter, since one
+    interpreter runs its scripts strictly in turn: a slow Chrome call then
+    doesn't hold up Spotify or the volume.
+
+    Replies are awaited for at most `timeout` seconds. A hung or crashed
+    interpreter is killed and restarted on the next submit; the operations
+    it didn't answer are reported as failed rather than sent again, since
+    they may already have run.
+    """
+    name = "applescript"
+
+    def __init__(self, timeout=BRIDGE_TIMEOUT):
+        self.timeout = timeout
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _channel(self, op):
+        name = op.platform or "system"
+        with self._lock:
+            if name not in self._channels:
+                self._channels[name] = _BridgeProcess(name, self.timeout)
+            return self._channels[name]
+
+    def submit(self, ops):
+        results = [None] * len(ops)
+        runs = []
+        for index, op in enumerate(ops):
+            try:
+                request = {"id": next(self._ids), "index": index, "script": applescript_for(op)}
+            except ValueError as e:
+                results[index] = ControlResult(False, error=str(e))
+                continue
+            # Consecutive operations on the same channel share a round trip
+            channel = self._channel(op)
+            if runs and runs[-1][0] is channel:
+                runs[-1][1].append(request)
+            else:
+                runs.append((channel, [request]))
+
+        for channel, requests in runs:
+            for request, reply in zip(requests, channel.exchange(requests)):
+                results[request["index"]] = ControlResult(
+                    reply["ok"], reply.get("output", "").strip(), reply.get("error", "")
+                )
+                if not reply["ok"]:
+                    logger.error("AppleScript failed with error: %s", reply.get('error'))
+        return results
+
+    def close(self):
+        with self._lock:
+            channels = list(self._channels.values())
+        for channel in channels:
+            channel.close()
+
+
+class MPRISBackend(ControlBackend):
+    """Controls Linux media players over a persistent D-Bus session connection.
+
+    Transport commands go to the player's MPRIS interface. Volume is the MPRIS
+    Volume property of NOVA_MPRIS_VOLUME_PLAYER, since there is no portable
+    system volume on D-Bus. YouTube links are opened in the default browser.
+    Player bus names are looked up once and cached until a call fails.
+    Requires the `jeepney` package, installed on Linux from requirements.txt.
+    """
+    name = "mpris"
+
+    _PLAYER = "org.mpris.MediaPlayer2.Player"
+
+    def __init__(self, players=None, volume_player=None):
+        from jeepney.io.blocking import open_dbus_connection
+
+        self.players = players or {
+            "spotify": os.getenv("NOVA_MPRIS_SPOTIFY_PLAYER", "spotify"),
+            "youtube": os.getenv("NOVA_MPRIS_YOUTUBE_PLAYER", "chromium"),
+        }
+        self.volume_player = volume_player or os.getenv("NOVA_MPRIS_VOLUME_PLAYER", "spotify")
+        self._connection = open_dbus_connection(bus="SESSION")
+        self._lock = threading.Lock()
+        self._names = {}
+
+    def _bus_name(self, player, refresh=False):
+        """Bus name of a running player, cached until a call to it fails"""
+        from jeepney import DBusAddress, new_method_call
+
+        if not refresh and player in self._names:
+            return self._names[player]
+        # Browsers register with an instance suffix, so match on prefix
+        prefix = f"org.mpris.MediaPlayer2.{player}"
+        bus = DBusAddress("/org/freedesktop/DBus", bus_name="org.freedesktop.DBus",
+                          interface="org.freedesktop.DBus")
+        with self._lock:
+            reply = self._connection.send_and_get_reply(new_method_call(bus, "ListNames"))
+        for name in reply.body[0]:
+            if name == prefix or name.startswith(prefix + "."):
+                self._names[player] = name
+                return name
+        self._names.pop(player, None)
+        raise RuntimeError(f"No MPRIS player named {player} is running")
+
+    def _player_call(self, player, interface, method, signature=None, body=()):
+        """Call a method on a player, looking its bus name up again if the call fails"""
+        from jeepney import DBusAddress, MessageType, new_method_call
+        from jeepney.wrappers import DBusErrorResponse
+
+        for refresh in (False, True):
+            address = DBusAddress("/org/mpris/MediaPlayer2", bus_name=self._bus_name(player, refresh),
+                                  interface=interface)
+            try:
+                # The connection is shared, but only one call may wait on it at a time
+                with self._lock:
+                    reply = self._connection.send_and_get_reply(new_method_call(address, method, signature, body))
+            except DBusErrorResponse as e:
+                error = e
+            else:
+                if reply.header.message_type != MessageType.error:
+                    return reply
+                error = reply.body
+            # The player may have restarted under a new instance name
+            logger.debug("MPRIS call %s on %s failed (%s)", method, player, error)
+        raise RuntimeError(f"MPRIS call {method} on {player} failed: {error}")
+
+    def _call(self, player, method, signature=None, body=()):
+        return self._player_call(player, self._PLAYER, method, signature, body)
+
+    def _properties(self, player, method, signature, body):
+        return self._player_call(player, "org.freedesktop.DBus.Properties", method, signature, body)
+
+    def _run(self, op):
+        methods = {"pause": "Pause", "resume": "Play", "next": "Next", "previous": "Previous"}
+        if op.action == "get_volume":
+            reply = self._properties(self.volume_player, "Get", "ss", (self._PLAYER, "Volume"))
+            return str(round(reply.body[0][1] * 100))
+        if op.action == "set_volume":
+            level = max(0, min(100, int(op.arg))) / 100
+            self._properties(self.volume_player, "Set", "ssv", (self._PLAYER, "Volume", ("d", level)))
+            return ""
+        if op.action == "play" and op.platform == "youtube":
+            webbrowser.open(op.arg)
+            return ""
+        if op.action == "play" and op.platform == "spotify":
+            self._call(self.players["spotify"], "OpenUri", "s", (f"spotify:search:{op.arg}",))
+            return ""
+        if op.action in methods and op.platform in self.players:
+            self._call(self.players[op.platform], methods[op.action])
+            return ""
+        raise ValueError(f"Unsupported operation: {op}")
+
+    def submit(self, ops):
+        results = []
+        for op in ops:
+            try:
+                results.append(ControlResult(True, self._run(op)))
+            except Exception as e:
+                logger.error("MPRIS operation %s failed: %s", op, e)
+                results.append(ControlResult(False, error=str(e)))
+        return results
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class FakeControlBackend(ControlBackend):
+    """In-process stand-in that records operations and simulates player state"""
+    name = "fake"
+
+    def __init__(self, latency=0.0, volume=50):
+        self.latency = latency
+        self.volume = volume
+        self.state = {"spotify": "paused", "youtube": "paused"}
+        self.calls = []
+        self.ops = []
+        self._lock = threading.Lock()
+
+    def submit(self, ops):
+        if self.latency:
+            time.sleep(self.latency)
+        results = []
+        with self._lock:
+            self.calls.append(list(ops))
+            for op in ops:
+                self.ops.append(op)
+                if op.action == "get_volume":
+                    results.append(ControlResult(True, str(self.volume)))
+                    continue
+                if op.action == "set_volume":
+                    self.volume = max(0, min(100, int(op.arg)))
+                elif op.action in ("play", "resume", "next", "previous"):
+                    self.state[op.platform] = "playing"
+                elif op.action == "pause":
+                    self.state[op.platform] = "paused"
+                else:
+                    results.append(ControlResult(False, error=f"Unsupported operation: {op}"))
+                    continue
+                results.append(ControlResult(True))
+        return results
+
+
+# jeepney and osascript are only touched when their backend is created
+backends = LazyRegistry("control backend", {
+    "applescript": AppleScriptBridge,
+    "mpris": MPRISBackend,
+    "fake": FakeControlBackend,
+})
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_control_backend():
+    """Return the shared control backend, creating it on first use"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = backends.resolve(CONTROL_BACKEND)()
+        return _backend
+
+
+def set_control_backend(backend):
+    """Replace the shared control backend (for tests and benchmarks)"""
+    global _backend
+    with _backend_lock:
+        if _backend is not None and _backend is not backend:
+            _backend.close()
+        _backend = backend
@@ -0,0 +1,371 @@
+"""Text command API: parse and execute commands sent over HTTP.
+
+Listens on localhost TCP, or on a Unix socket when NOVA_DAEMON_SOCKET is
+set, so other automation and load tests can drive the assistant without
+audio hardware. Run it on its own with `python daemon.py`, or next to the
+voice loop with NOVA_DAEMON=1; either way it uses the same parser,
+caches and player backends as voice commands.
+
+    POST /commands          {"text": "pause spotify", "wait": true}
+    GET  /commands/<id>     status and latency of an earlier request
+    GET  /stats             request latencies, worker pool and dispatch queues
+    GET  /health
+"""
+import itertools
+import json
+import os
+import re
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from dotenv import load_dotenv
+from logger import logger
+from tracing import Histogram, tracer
+
+load_dotenv()
+
+DAEMON_ENABLED = os.getenv("NOVA_DAEMON", "0") == "1"
+DAEMON_HOST = os.getenv("NOVA_DAEMON_HOST", "127.0.0.1")
+DAEMON_PORT = int(os.getenv("NOVA_DAEMON_PORT", "8765"))
+# Serve on this Unix socket instead of TCP
+DAEMON_SOCKET = os.getenv("NOVA_DAEMON_SOCKET", "")
+# Requests handled at once, and how many more may wait before new ones get a 503
+DAEMON_WORKERS = int(os.getenv("NOVA_DAEMON_WORKERS", "8"))
+DAEMON_BACKLOG = int(os.getenv("NOVA_DAEMON_BACKLOG", "64"))
+# Longest a waiting request blocks for its commands to finish
+DAEMON_TIMEOUT = float(os.getenv("NOVA_DAEMON_TIMEOUT", "15"))
+# Finished requests kept for GET /commands/<id>
+DAEMON_HISTORY = int(os.getenv("NOVA_DAEMON_HISTORY", "1024"))
+
+_BUSY = b"HTTP/1.0 503 Service Unavailable\r\nContent-Type: application/json\r\nContent-Length: 17\r\n\r\n{\"error\":\"busy\"}\n"
+
+
+def _snapshot(record):
+    # Requests that don't wait are still updated after they have been answered
+    return {**record, "commands": list(record["commands"]), "latency": dict(record["latency"])}
+
+
+class CommandService:
+    """Parses and executes text commands and keeps their latencies.
+
+    `parse(text)` returns a tiered_parser.ParseResult and
+    `dispatch(commands, prepared)` a Future that resolves to True once the
+    commands have run, as main.dispatch_commands does.
+    """
+
+    def __init__(self, parse, dispatch, timeout=DAEMON_TIMEOUT, history=DAEMON_HISTORY):
+        self.parse = parse
+        self.dispatch = dispatch
+        self.timeout = timeout
+        self.history = history
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._requests = OrderedDict()
+        self._latency = {stage: Histogram() for stage in ("queue", "parse", "execute", "total")}
+        self.counts = {"ok": 0, "failed": 0, "not_understood": 0, "rejected": 0}
+
+    def _observe(self, record):
+        with self._lock:
+            self.counts[record["status"]] += 1
+            for stage, seconds in record["latency"].items():
+                self._latency[stage].observe(seconds)
+        total = record["latency"]["total"]
+        tracer.record("daemon.request", total, error=record["status"] != "ok")
+        logger.info("Request %s %s in %.1f ms: %s", record["id"], record["status"], total * 1000, record["text"])
+
+    def _remember(self, record):
+        with self._lock:
+            self._requests[record["id"]] = record
+            while len(self._requests) > self.history:
+                self._requests.popitem(last=False)
+
+    def _update(self, record, **fields):
+        """Change a record under the lock, since `get` may be reading it"""
+        latency = fields.pop("latency", {})
+        with self._lock:
+            record.update(fields)
+            record["latency"].update(latency)
+
+    def _finish(self, record, ok, executed, received):
+        # May run on a backend worker thread, via the dispatch Future's callback
+        now = time.perf_counter()
+        self._update(
+            record, status="ok" if ok else "failed",
+            latency={"execute": now - executed, "total": now - received},
+        )
+        self._observe(record)
+
+    def submit(self, text, wait=True, received=None):
+        """Parse `text` and run its commands.
+
+        With `wait`, returns once the commands have finished. Otherwise it
+        returns as soon as they are queued on the player backends, with
+        status "running"; the final status can be fetched with `get`.
+        """
+        received = received or time.perf_counter()
+        started = time.perf_counter()
+        record = {
+            "id": next(self._ids),
+            "text": text,
+            "status": "parsing",
+            "commands": [],
+            "latency": {"queue": started - received},
+        }
+        self._remember(record)
+
+        try:
+            result = self.parse(text)
+        except Exception:
+            now = time.perf_counter()
+            self._update(record, status="failed", latency={"parse": now - started, "total": now - received})
+            self._observe(record)
+            raise
+        executed = time.perf_counter()
+        self._update(
+            record, tier=result.tier,
+            commands=[command.model_dump(exclude_none=True) for command in result.commands],
+            latency={"parse": executed - started},
+        )
+        if not result.commands:
+            self._update(record, status="not_understood", latency={"total": executed - received})
+            self._observe(record)
+            return self._snapshot(record)
+
+        future = self.dispatch(result.commands, {})
+        if not wait:
+            self._update(record, status="running")
+            snapshot = self._snapshot(record)
+            future.add_done_callback(
+                lambda done: self._finish(
+                    record, not done.cancelled() and done.exception() is None and bool(done.result()),
+                    executed, received,
+                )
+            )
+            return snapshot
+
+        try:
+            ok = bool(future.result(self.timeout))
+        except Exception as e:
+            logger.error("Request %s did not finish: %s", record["id"], e)
+            ok = False
+        self._finish(record, ok, executed, received)
+        return self._snapshot(record)
+
+    def _snapshot(self, record):
+        with self._lock:
+            return _snapshot(record)
+
+    def reject(self):
+        with self._lock:
+            self.counts["rejected"] += 1
+
+    def get(self, request_id):
+        with self._lock:
+            record = self._requests.get(request_id)
+            return _snapshot(record) if record is not None else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": dict(self.counts),
+                "latency": {stage: histogram.summary() for stage, histogram in self._latency.items()},
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "Nova"
+
+    def log_message(self, format, *args):
+        logger.debug("Daemon: " + format, *args)
+
+    def _send(self, status, body):
+        data = (json.dumps(body) + "\n").encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def do_GET(self):
+        service = self.server.service
+        match = re.fullmatch(r"/commands/(\d+)", self.path)
+        if self.path == "/health":
+            self._send(200, {"ok": True})
+        elif self.path == "/stats":
+            self._send(200, {**service.stats(), "pool": self.server.pool_stats(), **self.server.extra_stats()})
+        elif match:
+            record = service.get(int(match.group(1)))
+            self._send(200 if record else 404, record or {"error": "unknown request"})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/commands":
+            self._send(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            text = request["text"]
+        except (ValueError, KeyError, TypeError):
+            self._send(400, {"error": 'expected {"text": ..., "wait": true|false}'})
+            return
+
+        wait = request.get("wait", True)
+        if not isinstance(wait, bool):
+            self._send(400, {"error": '"wait" must be true or false'})
+            return
+        if not isinstance(text, str) or not text.strip():
+            self._send(400, {"error": '"text" must be a non-empty string'})
+            return
+        try:
+            record = self.server.service.submit(text, wait=wait, received=self.server.received())
+        except Exception as e:
+            logger.error("Error handling request '%s': %s", text, e, exc_info=True)
+            self._send(500, {"error": str(e)})
+            return
+        status = 202 if record["status"] == "running" else 200
+        self._send(status, record)
+
+
+class _PooledServerMixin:
+    """Serves connections on a bounded worker pool instead of a thread per connection.
+
+    Up to `workers` requests run at once and `backlog` more may queue;
+    beyond that a connection is answered with 503 straight away.
+    """
+
+    def init_pool(self, service, workers, backlog, extra_stats=None):
+        self.service = service
+        self.extra_stats = extra_stats or dict
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="daemon")
+        self._slots = threading.BoundedSemaphore(workers + backlog)
+        self._active = 0
+        self._active_lock = threading.Lock()
+        self._local = threading.local()
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            self.service.reject()
+            try:
+                request.sendall(_BUSY)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self._pool.submit(self._process, request, client_address, time.perf_counter())
+
+    def _process(self, request, client_address, received):
+        with self._active_lock:
+            self._active += 1
+        try:
+            self._local.received = received
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._active_lock:
+                self._active -= 1
+            self._slots.release()
+
+    def received(self):
+        """When the connection being handled on this thread was accepted"""
+        return self._local.received
+
+    def pool_stats(self):
+        with self._active_lock:
+            return {"workers": self.workers, "active": self._active}
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _TCPServer(_PooledServerMixin, HTTPServer):
+    pass
+
+
+class _UnixServer(_PooledServerMixin, socketserver.UnixStreamServer):
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+        # Anyone who can connect can control the players
+        os.chmod(self.server_address, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class CommandServer:
+    """HTTP front end for a CommandService, run on a background thread"""
+
+    def __init__(self, service, host=DAEMON_HOST, port=DAEMON_PORT, socket_path=DAEMON_SOCKET,
+                 workers=DAEMON_WORKERS, backlog=DAEMON_BACKLOG, extra_stats=None):
+        self.service = service
+        if socket_path:
+            self._httpd = _UnixServer(socket_path, _Handler)
+        else:
+            self._httpd = _TCPServer((host, port), _Handler)
+        self._httpd.request_queue_size = max(backlog, 5)
+        self._httpd.init_pool(service, workers, backlog, extra_stats)
+        self._thread = None
+
+    @property
+    def address(self):
+        address = self._httpd.server_address
+        return address if isinstance(address, str) else f"http://{address[0]}:{address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="daemon", daemon=True)
+        self._thread.start()
+        logger.info("Command API listening on %s", self.address)
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def start_daemon(parse, dispatch, extra_stats=None):
+    """Start the command API with the default settings; returns the running CommandServer"""
+    return CommandServer(CommandService(parse, dispatch), extra_stats=extra_stats).start()
+
+
+def main():
+    import startup
+    import main as app
+    from tiered_parser import parse
+    from dispatch import dispatcher
+    from executor import player_state
+    from control_bridge import get_control_backend
+
+    if app.WARMUP:
+        app.warm_up(audio=False)
+    startup.report()
+    tracing = app.tracing
+    tracing.start_exporter()
+    player_state.start_refresh(get_control_backend)
+
+    server = start_daemon(parse, app.dispatch_commands, extra_stats=lambda: {"dispatch": dispatcher.stats()})
+    print(f"Nova command API on {server.address}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        logger.info("Stopping command API")
+    finally:
+        server.stop()
+        logger.info("Command API requests: %s", server.service.stats()["requests"])
+        tracing.stop_exporter()
+
+
+if __name__ == "__main__":
+    main()
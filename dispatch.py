@@ -0,0 +1,355 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from dotenv import load_dotenv
+from logger import logger
+from tracing import tracer
+import executor
+
+load_dotenv()
+
+# Seconds a backend gets to run one command before the caller stops waiting
+SPOTIFY_TIMEOUT = float(os.getenv("NOVA_DISPATCH_SPOTIFY_TIMEOUT", "5"))
+# Includes the YouTube search when it wasn't done ahead of time
+YOUTUBE_TIMEOUT = float(os.getenv("NOVA_DISPATCH_YOUTUBE_TIMEOUT", "10"))
+VOLUME_TIMEOUT = float(os.getenv("NOVA_DISPATCH_VOLUME_TIMEOUT", "3"))
+
+MEDIA_ACTIONS = ("play", "pause", "resume", "next", "previous")
+VOLUME_ACTIONS = ("volume_up", "volume_down", "set_volume")
+
+
+class Backend:
+    """Runs the commands for one player on its own worker thread.
+
+    Commands are queued and run in the order they were submitted, so
+    commands to the same player never overtake each other, while each
+    backend's queue moves independently of the others. Whenever the worker
+    picks up work it takes everything already queued, and adjacent
+    commands run as one batch through executor.execute_batch, which nets
+    volume changes and skips into single calls; if the batch fails, every
+    command in it resolves as failed. A command that runs longer than
+    `timeout` (or a batch, longer than `timeout` per command) resolves as
+    failed; the worker cannot abandon it, so later commands for the same
+    backend still wait for it to return.
+    """
+
+    name = None
+    actions = ()
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self.depth = 0
+        self.max_depth = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+
+    def submit(self, func, *args, timeout=None, **kwargs):
+        """Queue `func(*args, **kwargs)`; returns a Future that resolves to True on success"""
+        future = Future()
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=f"dispatch-{self.name}", daemon=True)
+                self._worker.start()
+            self.depth += 1
+            self.max_depth = max(self.max_depth, self.depth)
+            depth = self.depth
+        tracer.gauge(f"dispatch.{self.name}.depth", depth)
+        self._queue.put((future, func, args, kwargs, timeout or self.timeout, time.perf_counter()))
+        return future
+
+    def submit_commands(self, commands, prepared=None):
+        """Queue commands for this backend to run in order; returns a Future like submit"""
+        return self.submit(self.run_commands, commands, prepared or {}, timeout=self.timeout * len(commands))
+
+    def run_commands(self, commands, prepared):
+        """Run one command through its own method, or several as one batch"""
+        if len(commands) == 1:
+            return getattr(self, commands[0].action)(commands[0], **prepared.get(0, {}))
+        return executor.execute_batch(commands, prepared)
+
+    def _expire(self, futures, timeout):
+        with self._lock:
+            futures = [future for future in futures if not future.done()]
+            if not futures:
+                return
+            self.timeouts += len(futures)
+            for future in futures:
+                future.set_result(False)
+        logger.warning(
+            "%s backend did not finish within %.1fs; its queue waits until it does", self.name, timeout
+        )
+
+    def _resolve(self, future, ok):
+        with self._lock:
+            self.depth -= 1
+            depth = self.depth
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+            if not future.done():
+                future.set_result(ok)
+            elif ok:
+                logger.info("%s backend finished a command after it had timed out", self.name)
+        tracer.gauge(f"dispatch.{self.name}.depth", depth)
+
+    def _start(self, jobs):
+        """The jobs that weren't cancelled while they waited, marked as running"""
+        started = []
+        for job in jobs:
+            # Cancelled while waiting, e.g. by an interrupting wake word
+            if job[0].set_running_or_notify_cancel():
+                started.append(job)
+                continue
+            with self._lock:
+                self.depth -= 1
+                depth = self.depth
+            tracer.gauge(f"dispatch.{self.name}.depth", depth)
+        return started
+
+    def _run(self):
+        while True:
+            jobs = [self._queue.get()]
+            while True:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            while jobs:
+                group = [jobs.pop(0)]
+                if group[0][1] == self.run_commands:
+                    while jobs and jobs[0][1] == self.run_commands:
+                        group.append(jobs.pop(0))
+                group = self._start(group)
+                if group:
+                    self._execute(group)
+
+    def _execute(self, jobs):
+        start = time.perf_counter()
+        for _, _, _, _, _, queued in jobs:
+            tracer.record(f"dispatch.{self.name}.wait", start - queued)
+
+        if len(jobs) == 1:
+            _, func, args, kwargs, timeout, _ = jobs[0]
+        else:
+            # Adjacent command jobs: one batch, with each job's prepared
+            # results moved to the command's place in it
+            commands, prepared = [], {}
+            for _, _, (job_commands, job_prepared), _, _, _ in jobs:
+                prepared.update((len(commands) + i, kwargs) for i, kwargs in job_prepared.items())
+                commands.extend(job_commands)
+            func, args, kwargs = self.run_commands, (commands, prepared), {}
+            timeout = sum(job[4] for job in jobs)
+            logger.info("Running %s queued %s jobs as one batch", len(jobs), self.name)
+
+        futures = [job[0] for job in jobs]
+        timer = threading.Timer(timeout, self._expire, (futures, timeout))
+        timer.daemon = True
+        timer.start()
+        ok = False
+        try:
+            ok = func(*args, **kwargs) is not False
+        except Exception as e:
+            logger.error("Error in %s backend: %s", self.name, e, exc_info=True)
+        finally:
+            timer.cancel()
+            tracer.record(f"dispatch.{self.name}", time.perf_counter() - start, error=not ok)
+            for future in futures:
+                self._resolve(future, ok)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "completed": self.completed,
+                "failed": self.failed,
+                "timeouts": self.timeouts,
+            }
+
+
+class SpotifyBackend(Backend):
+    name = "spotify"
+    actions = MEDIA_ACTIONS
+
+    def play(self, command):
+        executor.play_on_spotify(command.song)
+
+    def pause(self, command):
+        executor.pause_spotify()
+
+    def resume(self, command):
+        executor.resume_spotify()
+
+    def next(self, command):
+        executor.next_spotify()
+
+    def previous(self, command):
+        executor.previous_spotify()
+
+
+class YouTubeBackend(Backend):
+    name = "youtube"
+    actions = MEDIA_ACTIONS
+
+    def play(self, command, link=None):
+        executor.play_on_youtube(command.song, link=link)
+
+    def pause(self, command):
+        executor.pause_youtube()
+
+    def resume(self, command):
+        executor.resume_youtube()
+
+    def next(self, command):
+        executor.next_youtube()
+
+    def previous(self, command):
+        executor.previous_youtube()
+
+
+class VolumeBackend(Backend):
+    """System volume; platform independent"""
+    name = "volume"
+    actions = VOLUME_ACTIONS
+
+    def volume_up(self, command):
+        executor.volume_up()
+
+    def volume_down(self, command):
+        executor.volume_down()
+
+    def set_volume(self, command):
+        executor.set_volume(command.volume_level)
+
+
+class Dispatcher:
+    """Routes each command to the backend that owns its player.
+
+    Media actions go to the backend registered for the command's platform
+    (Spotify when none is given), volume actions to the volume backend.
+    """
+
+    def __init__(self):
+        self.backends = {}
+        self._routes = {}
+
+    def register(self, backend, platform=None):
+        """Route the backend's actions to it; `platform` is None for platform-independent backends"""
+        self.backends[backend.name] = backend
+        for action in backend.actions:
+            self._routes[(action, platform)] = backend
+
+    def route(self, command):
+        platform = None if command.action in VOLUME_ACTIONS else command.platform or "spotify"
+        backend = self._routes.get((command.action, platform))
+        if backend is None:
+            raise ValueError(f"No backend for {command.action} on {platform}")
+        return backend
+
+    def _checked_route(self, command):
+        """The command's backend, or None (logged) when it can't be run"""
+        if command.action == "play" and not command.song:
+            logger.error("No song specified for play action")
+            return None
+        if command.action == "set_volume" and command.volume_level is None:
+            logger.error("No volume level specified for set_volume action")
+            return None
+        try:
+            return self.route(command)
+        except ValueError as e:
+            logger.error("%s", e)
+            return None
+
+    def dispatch(self, command, prepared=None):
+        """Queue a command on its backend; returns a Future that resolves to True on success"""
+        backend = self._checked_route(command)
+        if backend is None:
+            return _done(False)
+
+        logger.info("Dispatching %s to the %s backend", command, backend.name)
+        return backend.submit_commands([command], {0: prepared} if prepared else {})
+
+    def dispatch_batch(self, commands, prepared=None):
+        """Queue every command of a request on its player's backend.
+
+        The commands for one backend keep their order and run as a single
+        batch on that backend's worker, behind whatever it already had
+        queued and merged with any commands queued right next to them; the
+        batches for different backends run side by side.
+        `prepared` maps command indexes to their prepare_command results.
+        Returns a Future that resolves to True when every command succeeded.
+        """
+        prepared = prepared or {}
+        if len(commands) == 1:
+            return self.dispatch(commands[0], prepared.get(0))
+
+        groups = {}
+        for index, command in enumerate(commands):
+            backend = self._checked_route(command)
+            if backend is None:
+                return _done(False)
+            group, group_prepared = groups.setdefault(backend, ([], {}))
+            if index in prepared:
+                group_prepared[len(group)] = prepared[index]
+            group.append(command)
+
+        futures = []
+        for backend, (group, group_prepared) in groups.items():
+            logger.info("Dispatching %s to the %s backend", group, backend.name)
+            futures.append(backend.submit_commands(group, group_prepared))
+        return _all(futures)
+
+    def execute(self, command, prepared=None):
+        """Run a command and wait for it; returns True on success"""
+        return self.dispatch(command, prepared).result()
+
+    def stats(self):
+        return {name: backend.stats() for name, backend in self.backends.items()}
+
+
+def _done(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _all(futures):
+    """A Future that resolves to True once all `futures` have, and all to True"""
+    combined = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            combined.set_result(all(not future.cancelled() and future.result() for future in futures))
+        except InvalidStateError:
+            # Cancelled by the caller in the meantime
+            pass
+
+    def on_cancel(future):
+        if future.cancelled():
+            for part in futures:
+                part.cancel()
+
+    combined.add_done_callback(on_cancel)
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+
+dispatcher = Dispatcher()
+dispatcher.register(SpotifyBackend(SPOTIFY_TIMEOUT), "spotify")
+dispatcher.register(YouTubeBackend(YOUTUBE_TIMEOUT), "youtube")
+dispatcher.register(VolumeBackend(VOLUME_TIMEOUT))
@@ -1,278 +1,202 @@
-import subprocess
-from youtubesearchpython import VideosSearch
+from concurrent.futures import ThreadPoolExecutor
 from logger import logger
+from control_bridge import ControlOp, get_control_backend
+from player_state import PlayerState, Coalescer
+from youtube_search import get_youtube_search
+from tracing import tracer, traced
 
-def run_applescript(script):
-    logger.info("Executing AppleScript")
-    logger.debug(f"AppleScript content: {script}")
-    try:
-        result = subprocess.run(
-            ["osascript", "-e", script],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            logger.info("AppleScript executed successfully")
-            if result.stdout:
-                logger.debug(f"AppleScript output: {result.stdout}")
-        else:
-            logger.error(f"AppleScript failed with error: {result.stderr}")
-        return result
-    except Exception as e:
-        logger.error(f"Error executing AppleScript: {str(e)}", exc_info=True)
-        raise
+# Local mirror of volume and player status, kept current by our own writes
+player_state = PlayerState()
+# Merges bursts of volume and skip commands into one backend call
+coalescer = Coalescer(get_control_backend, player_state)
+# Runs the lookups of a multi-command request side by side
+_prepare_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prepare")
+
+def control(op):
+    """Run one operation over the shared control backend"""
+    logger.debug("Control operation: %s", op)
+    with tracer.span("control"):
+        result = get_control_backend().execute(op)
+    player_state.apply(op, result)
+    return result
 
 # Spotify Controls
+@traced("executor.play_on_spotify")
 def play_on_spotify(song_name):
-    logger.info(f"Attempting to play '{song_name}' on Spotify")
+    logger.info("Attempting to play '%s' on Spotify", song_name)
     try:
-        song_uri = f"spotify:search:{song_name}"
-        logger.debug(f"Generated Spotify URI: {song_uri}")
-
-        script = f'''
-        tell application "Spotify"
-            activate
-            play track "{song_uri}"
-        end tell
-        '''
-        logger.info(f"Playing '{song_name}' on Spotify app...")
-        result = run_applescript(script)
+        logger.info("Playing '%s' on Spotify app...", song_name)
+        result = control(ControlOp("play", "spotify", song_name))
 
         if result.returncode == 0:
-            logger.info(f"Successfully initiated playback of '{song_name}' on Spotify")
+            logger.info("Successfully initiated playback of '%s' on Spotify", song_name)
         else:
-            logger.error(f"Failed to play '{song_name}' on Spotify")
+            logger.error("Failed to play '%s' on Spotify", song_name)
 
     except Exception as e:
-        logger.error(f"Error playing on Spotify: {str(e)}", exc_info=True)
+        logger.error("Error playing on Spotify: %s", e, exc_info=True)
         raise
 
+@traced("executor.pause_spotify")
 def pause_spotify():
     logger.info("Attempting to pause Spotify")
     try:
-        script = '''
-        tell application "Spotify"
-            pause
-        end tell
-        '''
-        result = run_applescript(script)
+        result = control(ControlOp("pause", "spotify"))
         if result.returncode == 0:
             logger.info("Successfully paused Spotify")
         else:
             logger.error("Failed to pause Spotify")
     except Exception as e:
-        logger.error(f"Error pausing Spotify: {str(e)}", exc_info=True)
+        logger.error("Error pausing Spotify: %s", e, exc_info=True)
         raise
 
+@traced("executor.resume_spotify")
 def resume_spotify():
     logger.info("Attempting to resume Spotify")
     try:
-        script = '''
-        tell application "Spotify"
-            play
-        end tell
-        '''
-        result = run_applescript(script)
+        result = control(ControlOp("resume", "spotify"))
         if result.returncode == 0:
             logger.info("Successfully resumed Spotify")
         else:
             logger.error("Failed to resume Spotify")
     except Exception as e:
-        logger.error(f"Error resuming Spotify: {str(e)}", exc_info=True)
+        logger.error("Error resuming Spotify: %s", e, exc_info=True)
         raise
 
+@traced("executor.next_spotify")
 def next_spotify():
     logger.info("Attempting to play next track on Spotify")
     try:
-        script = '''
-        tell application "Spotify"
-            next track
-        end tell
-        '''
-        result = run_applescript(script)
-        if result.returncode == 0:
-            logger.info("Successfully played next track on Spotify")
-        else:
-            logger.error("Failed to play next track on Spotify")
+        coalescer.skip("spotify", 1)
+        logger.info("Successfully played next track on Spotify")
     except Exception as e:
-        logger.error(f"Error playing next track on Spotify: {str(e)}", exc_info=True)
+        logger.error("Error playing next track on Spotify: %s", e, exc_info=True)
         raise
 
+@traced("executor.previous_spotify")
 def previous_spotify():
     logger.info("Attempting to play previous track on Spotify")
     try:
-        script = '''
-        tell application "Spotify"
-            previous track
-        end tell
-        '''
-        result = run_applescript(script)
-        if result.returncode == 0:
-            logger.info("Successfully played previous track on Spotify")
-        else:
-            logger.error("Failed to play previous track on Spotify")
+        coalescer.skip("spotify", -1)
+        logger.info("Successfully played previous track on Spotify")
     except Exception as e:
-        logger.error(f"Error playing previous track on Spotify: {str(e)}", exc_info=True)
+        logger.error("Error playing previous track on Spotify: %s", e, exc_info=True)
         raise
 
 # YouTube Controls
-def play_on_youtube(song_name):
-    logger.info(f"Attempting to play '{song_name}' on YouTube")
+@traced("executor.search_youtube")
+def search_youtube(song_name):
+    """Return the link of the top YouTube result for a query"""
+    return get_youtube_search().search(song_name)
+
+@traced("executor.play_on_youtube")
+def play_on_youtube(song_name, link=None):
+    logger.info("Attempting to play '%s' on YouTube", song_name)
     try:
-        logger.debug(f"Searching YouTube for: {song_name}")
-        results = VideosSearch(song_name, limit=1).result()
-
-        if not results['result']:
-            logger.error(f"No results found on YouTube for: {song_name}")
-            raise Exception("No YouTube results found")
-
-        link = results['result'][0]['link']
-        logger.debug(f"Found YouTube link: {link}")
-
-        logger.info(f"Playing '{song_name}' on YouTube...")
-        script = f'''
-        tell application "Google Chrome"
-            if (count of windows) = 0 then
-                make new window
-            end if
-            set theUrl to "{link}"
-            if (count of tabs of front window) = 0 then
-                make new tab at end of tabs of front window with properties {{URL:theUrl}}
-            else
-                set URL of active tab of front window to theUrl
-            end if
-            activate
-        end tell
-        '''
-        result = run_applescript(script)
+        # The link may already have been looked up by prepare_command
+        if link is None:
+            link = search_youtube(song_name)
+
+        logger.info("Playing '%s' on YouTube...", song_name)
+        result = control(ControlOp("play", "youtube", link))
         if result.returncode == 0:
-            logger.info(f"Successfully opened YouTube link for '{song_name}' in Chrome")
+            logger.info("Successfully opened YouTube link for '%s' in Chrome", song_name)
         else:
             logger.error("Failed to open YouTube link in Chrome")
 
     except Exception as e:
-        logger.error(f"Error playing on YouTube: {str(e)}", exc_info=True)
+        logger.error("Error playing on YouTube: %s", e, exc_info=True)
         raise
 
+@traced("executor.pause_youtube")
 def pause_youtube():
     logger.info("Attempting to pause YouTube")
     try:
-        script = '''
-        tell application "Google Chrome"
-            execute front window's active tab javascript "document.querySelector('video').pause()"
-        end tell
-        '''
-        result = run_applescript(script)
+        result = control(ControlOp("pause", "youtube"))
         if result.returncode == 0:
             logger.info("Successfully paused YouTube")
         else:
             logger.error("Failed to pause YouTube")
     except Exception as e:
-        logger.error(f"Error pausing YouTube: {str(e)}", exc_info=True)
+        logger.error("Error pausing YouTube: %s", e, exc_info=True)
         raise
 
+@traced("executor.resume_youtube")
 def resume_youtube():
     logger.info("Attempting to resume YouTube")
     try:
-        script = '''
-        tell application "Google Chrome"
-            execute front window's active tab javascript "document.querySelector('video').play()"
-        end tell
-        '''
-        result = run_applescript(script)
+        result = control(ControlOp("resume", "youtube"))
         if result.returncode == 0:
             logger.info("Successfully resumed YouTube")
         else:
             logger.error("Failed to resume YouTube")
     except Exception as e:
-        logger.error(f"Error resuming YouTube: {str(e)}", exc_info=True)
+        logger.error("Error resuming YouTube: %s", e, exc_info=True)
         raise
 
+@traced("executor.next_youtube")
 def next_youtube():
     logger.info("Attempting to play next video on YouTube")
     try:
-        script = '''
-        tell application "Google Chrome"
-            execute front window's active tab javascript "document.querySelector('.ytp-next-button').click()"
-        end tell
-        '''
-        result = run_applescript(script)
-        if result.returncode == 0:
-            logger.info("Successfully played next video on YouTube")
-        else:
-            logger.error("Failed to play next video on YouTube")
+        coalescer.skip("youtube", 1)
+        logger.info("Successfully played next video on YouTube")
     except Exception as e:
-        logger.error(f"Error playing next video on YouTube: {str(e)}", exc_info=True)
+        logger.error("Error playing next video on YouTube: %s", e, exc_info=True)
         raise
 
+@traced("executor.previous_youtube")
 def previous_youtube():
     logger.info("Attempting to play previous video on YouTube")
     try:
-        script = '''
-        tell application "Google Chrome"
-            execute front window's active tab javascript "document.querySelector('.ytp-prev-button').click()"
-        end tell
-        '''
-        result = run_applescript(script)
-        if result.returncode == 0:
-            logger.info("Successfully played previous video on YouTube")
-        else:
-            logger.error("Failed to play previous video on YouTube")
+        coalescer.skip("youtube", -1)
+        logger.info("Successfully played previous video on YouTube")
     except Exception as e:
-        logger.error(f"Error playing previous video on YouTube: {str(e)}", exc_info=True)
+        logger.error("Error playing previous video on YouTube: %s", e, exc_info=True)
         raise
 
 # System Volume Controls
 def get_current_volume():
     logger.info("Getting current system volume")
     try:
-        script = '''
-        output volume of (get volume settings)
-        '''
-        result = run_applescript(script)
+        volume = player_state.known_volume()
+        if volume is not None:
+            logger.info("Current volume (mirrored): %s", volume)
+            return volume
+
+        result = control(ControlOp("get_volume"))
         if result.returncode == 0:
             volume = int(result.stdout.strip())
-            logger.info(f"Current volume: {volume}")
+            logger.info("Current volume: %s", volume)
             return volume
         else:
             logger.error("Failed to get current volume")
             return None
     except Exception as e:
-        logger.error(f"Error getting current volume: {str(e)}", exc_info=True)
+        logger.error("Error getting current volume: %s", e, exc_info=True)
         return None
 
+@traced("executor.set_volume")
 def set_volume(level):
     """Set system volume to a specific percentage (0-100)"""
-    logger.info(f"Setting system volume to {level}%")
+    logger.info("Setting system volume to %s%%", level)
     try:
-        # Ensure volume is between 0 and 100
-        level = max(0, min(100, int(level)))
-
-        script = f'''
-        set volume output volume {level}
-        '''
-        result = run_applescript(script)
-        if result.returncode == 0:
-            logger.info(f"Successfully set volume to {level}%")
-        else:
-            logger.error(f"Failed to set volume to {level}%")
+        level = coalescer.set_volume(level)
+        logger.info("Successfully set volume to %s%%", level)
     except Exception as e:
-        logger.error(f"Error setting volume: {str(e)}", exc_info=True)
+        logger.error("Error setting volume: %s", e, exc_info=True)
         raise
 
+@traced("executor.volume_up")
 def volume_up():
     """Increase volume by 10%"""
-    current_volume = get_current_volume()
-    if current_volume is not None:
-        new_volume = min(current_volume + 10, 100)
-        set_volume(new_volume)
+    level = coalescer.volume_delta(10)
+    logger.info("Volume up to %s%%", level)
 
+@traced("executor.volume_down")
 def volume_down():
     """Decrease volume by 10%"""
-    current_volume = get_current_volume()
-    if current_volume is not None:
-        new_volume = max(current_volume - 10, 0)
-        set_volume(new_volume)
+    level = coalescer.volume_delta(-10)
+    logger.info("Volume down to %s%%", level)
 
 def set_volume_to_percentage(percentage):
     """Set volume to a specific percentage"""
@@ -282,7 +206,7 @@ def set_volume_to_percentage(percentage):
         percentage = float(percentage)
         set_volume(percentage)
     except ValueError:
-        logger.error(f"Invalid volume percentage: {percentage}")
+        logger.error("Invalid volume percentage: %s", percentage)
         raise ValueError("Invalid volume percentage")
 
 def lower_volume_to_percentage(percentage):
@@ -296,53 +220,109 @@ def lower_volume_to_percentage(percentage):
             if percentage < current_volume:
                 set_volume(percentage)
             else:
-                logger.info(f"Current volume ({current_volume}%) is already lower than requested ({percentage}%)")
+                logger.info("Current volume (%s%%) is already lower than requested (%s%%)", current_volume, percentage)
         except ValueError:
-            logger.error(f"Invalid volume percentage: {percentage}")
+            logger.error("Invalid volume percentage: %s", percentage)
             raise ValueError("Invalid volume percentage")
 
-def execute_command(command):
-    """Execute a parsed command"""
-    try:
-        logger.info(f"Executing command: {command}")
-
-        if command.action == "play":
-            if command.platform == "spotify":
-                play_on_spotify(command.song)
-            elif command.platform == "youtube":
-                play_on_youtube(command.song)
-        elif command.action == "pause":
-            if command.platform == "spotify":
-                pause_spotify()
-            elif command.platform == "youtube":
-                pause_youtube()
-        elif command.action == "resume":
-            if command.platform == "spotify":
-                resume_spotify()
-            elif command.platform == "youtube":
-                resume_youtube()
-        elif command.action == "next":
-            if command.platform == "spotify":
-                next_spotify()
-            elif command.platform == "youtube":
-                next_youtube()
-        elif command.action == "previous":
-            if command.platform == "spotify":
-                previous_spotify()
-            elif command.platform == "youtube":
-                previous_youtube()
-        elif command.action == "volume_up":
-            volume_up()
-        elif command.action == "volume_down":
-            volume_down()
-        elif command.action == "set_volume":
-            if command.volume_level is not None:
-                set_volume(command.volume_level)
-            else:
-                logger.error("Volume level not specified for set_volume action")
+def prepare_command(command):
+    """Do the side-effect-free part of a command ahead of time.
 
-        logger.info("Command executed successfully")
+    Returns keyword arguments for the matching play function, so speculative
+    work can be handed over once the command is confirmed, or simply dropped
+    if it isn't.
+    """
+    if command.action == "play" and command.platform == "youtube" and command.song:
+        return {"link": search_youtube(command.song)}
+    return {}
 
-    except Exception as e:
-        logger.error(f"Error executing command: {str(e)}", exc_info=True)
-        raise
+def prepare_commands(commands):
+    """prepare_command for every command of a request, run in parallel.
+
+    Returns {index: keyword arguments} for the commands that needed any.
+    """
+    futures = [_prepare_pool.submit(prepare_command, command) for command in commands]
+    results = [future.result() for future in futures]
+    return {i: kwargs for i, kwargs in enumerate(results) if kwargs}
+
+@traced("executor.execute_batch")
+def execute_batch(commands, prepared=None):
+    """Execute several commands for one player in order, as one batch.
+
+    The YouTube searches the batch needs run in parallel first. Runs of
+    play, pause and resume operations then go to the control backend in a
+    single submit, so they cost one round trip. Runs of volume changes are
+    netted into one update, and runs of skips into one skip count, which go
+    through the coalescer like single commands do. Returns True if every
+    operation succeeded.
+    """
+    prepared = dict(prepared or {})
+    lookups = {
+        i: _prepare_pool.submit(prepare_command, command)
+        for i, command in enumerate(commands) if i not in prepared
+    }
+    prepared.update((i, future.result()) for i, future in lookups.items())
+
+    # Consecutive commands of the same kind become one step:
+    # ["ops", [ControlOp]], ["volume", level or None, delta] or ["skip", platform, steps]
+    steps = []
+    for i, command in enumerate(commands):
+        action = command.action
+        platform = command.platform or "spotify"
+        last = steps[-1] if steps else None
+        if action == "play":
+            if not command.song:
+                logger.error("No song specified for play action")
+                return False
+            arg = prepared[i]["link"] if platform == "youtube" else command.song
+            op = ControlOp("play", platform, arg)
+        elif action in ("pause", "resume"):
+            op = ControlOp(action, platform)
+        elif action in ("next", "previous"):
+            step = 1 if action == "next" else -1
+            if last and last[0] == "skip" and last[1] == platform:
+                last[2] += step
+            else:
+                steps.append(["skip", platform, step])
+            continue
+        else:
+            if not (last and last[0] == "volume"):
+                last = ["volume", None, 0]
+                steps.append(last)
+            if action == "set_volume":
+                if command.volume_level is None:
+                    logger.error("No volume level specified for set_volume action")
+                    return False
+                last[1], last[2] = command.volume_level, 0
+            else:
+                last[2] += 10 if action == "volume_up" else -10
+            continue
+        if last and last[0] == "ops":
+            last[1].append(op)
+        else:
+            steps.append(["ops", [op]])
+
+    logger.info("Running %s commands as %s steps", len(commands), len(steps))
+    ok = True
+    for step in steps:
+        try:
+            if step[0] == "ops":
+                with tracer.span("control"):
+                    results = get_control_backend().submit(step[1])
+                for op, result in zip(step[1], results):
+                    player_state.apply(op, result)
+                    if not result.ok:
+                        logger.error("Failed to %s (%s): %s", op.action, op.platform, result.error)
+                        ok = False
+            elif step[0] == "volume":
+                _, level, delta = step
+                if level is not None:
+                    coalescer.set_volume(max(0, min(100, level + delta)))
+                elif delta:
+                    coalescer.volume_delta(delta)
+            elif step[2]:
+                coalescer.skip(step[1], step[2])
+        except Exception as e:
+            logger.error("Error executing %s: %s", step, e, exc_info=True)
+            ok = False
+    return ok
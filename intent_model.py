@@ -0,0 +1,415 @@
+"""Learned intent and slot model trained on logged transcript → command pairs.
+
+Successful turns are appended to a JSON lines file (NOVA_INTENT_DATA). Train
+a model from it with:
+
+    python intent_model.py train [--data FILE] [--out FILE]
+
+The intent classifier is a softmax regression over hashed TF-IDF features
+(words, word bigrams and character trigrams). A second, token-level
+classifier tags the words that make up the song. Both are plain NumPy at
+inference time and answer in tens of microseconds.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+import numpy as np
+from dotenv import load_dotenv
+from logger import logger
+from parse_cache import normalize
+
+load_dotenv()
+
+# Where successful turns are recorded and whether to record them at all
+INTENT_DATA = os.getenv("NOVA_INTENT_DATA", os.path.join("data", "intents.jsonl"))
+INTENT_CAPTURE = os.getenv("NOVA_INTENT_CAPTURE", "1") == "1"
+# Trained model; the tier is skipped while the file doesn't exist
+INTENT_MODEL = os.getenv("NOVA_INTENT_MODEL", os.path.join("models", "intent.npz"))
+# Model answers below this confidence go on to the next tier
+INTENT_CONFIDENCE = float(os.getenv("NOVA_INTENT_CONFIDENCE", "0.9"))
+# Fewer captured examples than this are not enough to train on
+INTENT_MIN_EXAMPLES = int(os.getenv("NOVA_INTENT_MIN_EXAMPLES", "20"))
+
+# Hashed feature space; a power of two
+FEATURE_BITS = 14
+# Label for requests holding several commands, which the model leaves to other tiers
+MULTI = "<multi>"
+
+_NUMBER = re.compile(r"\d+")
+# The words normalize() keeps, found in the original text
+_WORD = re.compile(r"[\w%]+")
+_LEVEL = re.compile(r"(?<!\w)(\d{1,3})(?!\d)")
+
+
+def _tokens(text):
+    return normalize(text).split()
+
+
+def _token_spans(text):
+    """(start, end) in `text` of each token _tokens(text) returns"""
+    return [match.span() for match in _WORD.finditer(text)]
+
+
+def _hash(feature, mask):
+    return zlib.crc32(feature.encode()) & mask
+
+
+def _hashed(features, mask):
+    counts = Counter(_hash(feature, mask) for feature in features)
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    return indices, values
+
+
+def _intent_features(tokens):
+    words = [_NUMBER.sub("0", token) for token in tokens]
+    features = ["<bias>"]
+    features += ["w:" + word for word in words]
+    features += ["b:" + a + " " + b for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"<{word}>"
+        features += ["c:" + padded[i:i + 3] for i in range(len(padded) - 2)]
+    return features
+
+
+def _tag_features(tokens, i):
+    def at(j):
+        return tokens[j] if 0 <= j < len(tokens) else "<s>"
+
+    features = ["<bias>", "t:" + at(i), "p:" + at(i - 1), "n:" + at(i + 1), "p2:" + at(i - 2), "n2:" + at(i + 1) + " " + at(i + 2)]
+    # Everything said before this word, so "play ... <song>" is seen at any distance
+    features += ["l:" + token for token in tokens[:i]]
+    return features
+
+
+def _label(command):
+    action = command["action"]
+    if action in ("volume_up", "volume_down", "set_volume"):
+        return action
+    return f"{action}:{command.get('platform') or 'spotify'}"
+
+
+def _song_positions(tokens, song):
+    """Indices of the words of `song` in `tokens`, or None when it isn't there verbatim"""
+    words = _tokens(song)
+    for start in range(len(tokens) - len(words) + 1):
+        if words and tokens[start:start + len(words)] == words:
+            return range(start, start + len(words))
+    return None
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    np.exp(logits, out=logits)
+    return logits / logits.sum(axis=-1, keepdims=True)
+
+
+def _fit_softmax(X, y, classes, l2, max_iter):
+    """Multinomial logistic regression on a sparse matrix with L-BFGS"""
+    from scipy.optimize import minimize
+
+    n, dim = X.shape
+    Y = np.zeros((n, classes))
+    Y[np.arange(n), y] = 1.0
+
+    def objective(theta):
+        W = theta[:dim * classes].reshape(dim, classes)
+        b = theta[dim * classes:]
+        P = _softmax(X @ W + b)
+        loss = -np.log(P[np.arange(n), y] + 1e-12).mean() + 0.5 * l2 * np.dot(theta[:dim * classes], theta[:dim * classes])
+        G = (P - Y) / n
+        grad = np.concatenate([(X.T @ G + l2 * W).ravel(), G.sum(axis=0)])
+        return loss, grad
+
+    theta = np.zeros(dim * classes + classes)
+    result = minimize(objective, theta, jac=True, method="L-BFGS-B", options={"maxiter": max_iter})
+    W = result.x[:dim * classes].reshape(dim, classes).astype(np.float32)
+    return W, result.x[dim * classes:].astype(np.float32)
+
+
+class IntentModel:
+    """Hashed TF-IDF softmax intent classifier with a song tagger"""
+
+    def __init__(self, labels, idf, weights, bias, tag_weights, tag_bias):
+        self.labels = list(labels)
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+        self.tag_weights = tag_weights
+        self.tag_bias = tag_bias
+        self.mask = len(idf) - 1
+
+    def _vector(self, tokens):
+        indices, values = _hashed(_intent_features(tokens), self.mask)
+        values = (1.0 + np.log(values)) * self.idf[indices]
+        return indices, values / np.sqrt(np.dot(values, values))
+
+    def _song(self, tokens):
+        """(start, end, confidence) of the tagged words; the song runs from the first to the last"""
+        probabilities = []
+        for i in range(len(tokens)):
+            indices, values = _hashed(_tag_features(tokens, i), self.mask)
+            logits = values @ self.tag_weights[indices] + self.tag_bias
+            probabilities.append(_softmax(logits)[1])
+        probabilities = np.array(probabilities)
+        tagged = np.flatnonzero(probabilities > 0.5)
+        if not len(tagged):
+            return None, None, 0.0
+        start, end = tagged[0], tagged[-1] + 1
+        inside = probabilities[start:end]
+        outside = np.concatenate([probabilities[:start], probabilities[end:]])
+        confidence = float(np.concatenate([inside, 1.0 - outside]).min())
+        return start, end, confidence
+
+    def predict(self, text):
+        """Return a (command dict, confidence) pair, like command_parser.parse_command_with_confidence"""
+        tokens = _tokens(text)
+        if not tokens:
+            return None, 0.0
+        indices, values = self._vector(tokens)
+        probabilities = _softmax(values @ self.weights[indices] + self.bias)
+        best = int(probabilities.argmax())
+        label, confidence = self.labels[best], float(probabilities[best])
+        if label == MULTI:
+            return None, 0.0
+
+        action, _, platform = label.partition(":")
+        command = {"action": action}
+        if platform:
+            command["platform"] = platform
+        if action == "play":
+            start, end, song_confidence = self._song(tokens)
+            if start is None:
+                return None, 0.0
+            # Cut the song from what was said, keeping its apostrophes and punctuation
+            spans = _token_spans(text)
+            command["song"] = text[spans[start][0]:spans[end - 1][1]]
+            confidence = min(confidence, song_confidence)
+        elif action == "set_volume":
+            level = _LEVEL.search(" ".join(tokens))
+            if level is None:
+                return None, 0.0
+            command["volume_level"] = min(int(level.group(1)), 100)
+        return command, confidence
+
+    @classmethod
+    def fit(cls, examples, bits=FEATURE_BITS, l2=1e-5, max_iter=300, min_examples=INTENT_MIN_EXAMPLES):
+        """Train on (text, list of command dicts) pairs.
+
+        Raises ValueError with fewer than `min_examples` examples or fewer
+        than two distinct intents: a model that has only ever seen one
+        intent answers every request with it at full confidence.
+        """
+        from scipy.sparse import csr_matrix
+
+        dim = 1 << bits
+        mask = dim - 1
+        labels = sorted({MULTI if len(commands) > 1 else _label(commands[0]) for _, commands in examples})
+        if len(examples) < min_examples:
+            raise ValueError(f"Need at least {min_examples} examples to train on, got {len(examples)}")
+        if len(labels) < 2:
+            raise ValueError(f"Need at least 2 distinct intents to train on, got {labels}")
+        label_index = {label: i for i, label in enumerate(labels)}
+
+        rows, y = [], []
+        tag_rows, tag_y = [], []
+        for text, commands in examples:
+            tokens = _tokens(text)
+            rows.append(_hashed(_intent_features(tokens), mask))
+            y.append(label_index[MULTI if len(commands) > 1 else _label(commands[0])])
+            if len(commands) == 1 and commands[0].get("song"):
+                positions = _song_positions(tokens, commands[0]["song"])
+                if positions is None:
+                    continue
+                for i in range(len(tokens)):
+                    tag_rows.append(_hashed(_tag_features(tokens, i), mask))
+                    tag_y.append(int(i in positions))
+
+        def matrix(hashed_rows):
+            indptr = np.cumsum([0] + [len(indices) for indices, _ in hashed_rows])
+            indices = np.concatenate([indices for indices, _ in hashed_rows])
+            values = np.concatenate([values for _, values in hashed_rows])
+            return csr_matrix((values, indices, indptr), shape=(len(hashed_rows), dim))
+
+        X = matrix(rows)
+        document_frequency = np.bincount(X.indices, minlength=dim)
+        idf = np.log((1.0 + len(rows)) / (1.0 + document_frequency)).astype(np.float32) + 1.0
+        X.data = (1.0 + np.log(X.data)) * idf[X.indices]
+        norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+        X = csr_matrix(X.multiply(1.0 / norms[:, None]))
+        weights, bias = _fit_softmax(X, np.array(y), len(labels), l2, max_iter)
+
+        if tag_rows:
+            tag_weights, tag_bias = _fit_softmax(matrix(tag_rows), np.array(tag_y), 2, l2, max_iter)
+        else:
+            tag_weights, tag_bias = np.zeros((dim, 2), dtype=np.float32), np.array([0.0, -1.0], dtype=np.float32)
+        return cls(labels, idf, weights, bias, tag_weights, tag_bias)
+
+    def save(self, path):
+        if len(self.labels) < 2:
+            raise ValueError("Refusing to save a model with fewer than 2 intents")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f, labels=np.array(self.labels), idf=self.idf, weights=self.weights, bias=self.bias,
+                tag_weights=self.tag_weights, tag_bias=self.tag_bias,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            model = cls(
+                data["labels"].tolist(), data["idf"], data["weights"], data["bias"],
+                data["tag_weights"], data["tag_bias"],
+            )
+        if len(model.labels) < 2:
+            raise ValueError(f"{path} was trained on fewer than 2 intents; retrain it on more data")
+        return model
+
+
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def get_intent_model():
+    """Return the trained model, or None when there is none yet"""
+    global _model, _model_loaded
+    with _model_lock:
+        if not _model_loaded:
+            _model_loaded = True
+            if os.path.exists(INTENT_MODEL):
+                start = time.perf_counter()
+                try:
+                    _model = IntentModel.load(INTENT_MODEL)
+                except ValueError as e:
+                    logger.warning("Not using intent model: %s", e)
+                    return None
+                logger.info(
+                    "Loaded intent model %s (%d intents) in %.3fs",
+                    INTENT_MODEL, len(_model.labels), time.perf_counter() - start
+                )
+            else:
+                logger.info("No intent model at %s; train one with 'python intent_model.py train'", INTENT_MODEL)
+        return _model
+
+
+_capture_lock = threading.Lock()
+
+
+def record_example(text, commands, path=None):
+    """Append a transcript and the commands it was executed as to the training data"""
+    if not INTENT_CAPTURE or not text or not commands:
+        return
+    path = path or INTENT_DATA
+    line = json.dumps({
+        "text": text,
+        "commands": [command.model_dump(exclude_none=True) for command in commands],
+        "ts": time.time(),
+    })
+    try:
+        with _capture_lock:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        logger.warning("Could not record training example: %s", e)
+
+
+def load_examples(path):
+    """(text, commands) pairs from a capture file; a transcript seen again replaces the earlier entry"""
+    examples = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get("text") and entry.get("commands"):
+                examples[normalize(entry["text"])] = (entry["text"], entry["commands"])
+    return list(examples.values())
+
+
+def evaluate(model, examples, threshold):
+    """Accuracy overall, and how many examples the model answers at `threshold` and how many of those correctly"""
+    correct = answered = answered_correct = 0
+    start = time.perf_counter()
+    for text, commands in examples:
+        command, confidence = model.predict(text)
+        # Requests with several commands are right when the model leaves them alone
+        right = command is None if len(commands) > 1 else command == commands[0]
+        correct += right
+        if command is not None and confidence >= threshold:
+            answered += 1
+            answered_correct += right
+    elapsed = time.perf_counter() - start
+    return {
+        "examples": len(examples),
+        "accuracy": correct / len(examples) if examples else 0.0,
+        "coverage": answered / len(examples) if examples else 0.0,
+        "precision": answered_correct / answered if answered else 0.0,
+        "latency_us": elapsed / len(examples) * 1e6 if examples else 0.0,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Train the local intent model from captured turns")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    train = commands.add_parser("train", help="fit a model and report held-out accuracy")
+    train.add_argument("--data", default=INTENT_DATA, help="captured transcript/command pairs (JSON lines)")
+    train.add_argument("--out", default=INTENT_MODEL, help="where to write the model")
+    train.add_argument("--holdout", type=float, default=0.1, help="share of examples kept out for evaluation")
+    train.add_argument("--threshold", type=float, default=None, help="confidence to report coverage at")
+    train.add_argument("--l2", type=float, default=1e-5, help="weight penalty; larger gives less confident answers")
+    predict = commands.add_parser("predict", help="parse transcripts with a trained model")
+    predict.add_argument("text", nargs="+")
+    predict.add_argument("--model", default=INTENT_MODEL)
+    args = arg_parser.parse_args()
+
+    if args.command == "predict":
+        model = IntentModel.load(args.model)
+        for text in args.text:
+            print(text, "->", *model.predict(text))
+        return
+
+    threshold = INTENT_CONFIDENCE if args.threshold is None else args.threshold
+
+    examples = load_examples(args.data)
+    order = np.random.default_rng(0).permutation(len(examples))
+    held_out = math.floor(len(examples) * args.holdout)
+    test = [examples[i] for i in order[:held_out]]
+    train_set = [examples[i] for i in order[held_out:]]
+
+    start = time.perf_counter()
+    try:
+        model = IntentModel.fit(train_set, l2=args.l2)
+    except ValueError as e:
+        raise SystemExit(f"Not enough training data in {args.data}: {e}")
+    print(f"Trained on {len(train_set)} examples, {len(model.labels)} intents, in {time.perf_counter() - start:.1f}s")
+    for name, subset in (("train", train_set), ("held out", test)):
+        if subset:
+            stats = evaluate(model, subset, threshold)
+            print(
+                f"{name:<9} accuracy {stats['accuracy'] * 100:.1f}%  "
+                f"answers {stats['coverage'] * 100:.1f}% at confidence {threshold:.2f} "
+                f"with {stats['precision'] * 100:.1f}% right  ({stats['latency_us']:.0f} µs per parse)"
+            )
+
+    if held_out:
+        # Ship a model that has seen everything
+        model = IntentModel.fit(examples, l2=args.l2)
+    model.save(args.out)
+    print(f"Saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
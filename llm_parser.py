@@ -1,19 +1,30 @@
-from langchain.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain.output_parsers import PydanticOutputParser
-from pydantic import BaseModel, Field
-from typing import Optional, Literal
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Literal
+import functools
+import json
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from logger import logger
+from parse_cache import ParseCache
+from tracing import tracer
 
 # Load environment variables
 load_dotenv()
 
 # Get API key from environment variable
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY environment variable is not set. Please set it in your .env file or environment.")
+# The client also honours OPENAI_BASE_URL for the primary endpoint
+LLM_MODEL = os.getenv("NOVA_LLM_MODEL", "gpt-3.5-turbo")
+# Optional second OpenAI-compatible endpoint (e.g. a local server) asked when the primary is slow or failing
+LLM_SECONDARY_BASE_URL = os.getenv("NOVA_LLM_SECONDARY_BASE_URL", "")
+LLM_SECONDARY_MODEL = os.getenv("NOVA_LLM_SECONDARY_MODEL", LLM_MODEL)
+LLM_SECONDARY_API_KEY = os.getenv("NOVA_LLM_SECONDARY_API_KEY") or OPENAI_API_KEY
+# Seconds before the secondary is asked too, until the primary has enough calls for a p95
+LLM_HEDGE_DELAY = float(os.getenv("NOVA_LLM_HEDGE_DELAY", "1.5"))
+# Seconds before a parse gives up on every endpoint
+LLM_TIMEOUT = float(os.getenv("NOVA_LLM_TIMEOUT", "10"))
 
 class Command(BaseModel):
     """Schema for parsed voice commands"""
@@ -37,68 +48,341 @@ class Command(BaseModel):
         description="The volume level to set (0-100, only for set_volume action)"
     )
 
-# Create the parser at module level
-parser = PydanticOutputParser(pydantic_object=Command)
+class CommandList(BaseModel):
+    """One or more commands from a single request, in the order given"""
+    commands: List[Command] = Field(description="The commands to perform, in order")
+
+# Stream the completion and hand out each command as soon as it is complete
+LLM_STREAM = os.getenv("NOVA_LLM_STREAM", "1") == "1"
+
+# Fields a command needs before it can run without waiting for the rest of
+# its object; media actions that omit the platform are handed out once
+# their object closes
+_REQUIRED_FIELDS = {
+    "play": ("platform", "song"),
+    "set_volume": ("volume_level",),
+    "volume_up": (),
+    "volume_down": (),
+}
+_MEDIA_FIELDS = ("platform",)
+
+class CommandStream:
+    """Incremental parser for a streamed {"commands": [...]} reply.
+
+    Feed it chunks of the completion as they arrive. Each command object is
+    validated and passed to `on_command(index, command)` as soon as the
+    fields its action needs are complete, which is usually before the
+    model has finished writing the object, let alone the reply. `result`
+    parses the whole reply once the stream ends.
+    """
+
+    def __init__(self, on_command=None):
+        self.on_command = on_command
+        self.emitted = {}
+        self._chunks = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._scalar = False
+        self._token = []
+        self._key = None
+        self._expect_value = False
+        self._fields = {}
+        self._index = -1
+
+    def feed(self, chunk):
+        self._chunks.append(chunk)
+        for char in chunk:
+            self._step(char)
+
+    def _step(self, char):
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 3:
+                    self._string_done(json.loads('"' + "".join(self._token) + '"'))
+                return
+            self._token.append(char)
+            return
+
+        if self._scalar:
+            if char not in ",}]" and not char.isspace():
+                self._token.append(char)
+                return
+            self._scalar_done()
+
+        if char == '"':
+            self._in_string = True
+            self._token = []
+        elif char in "{[":
+            self._depth += 1
+            if char == "{" and self._depth == 3:
+                self._index += 1
+                self._fields = {}
+                self._key = None
+                self._expect_value = False
+        elif char in "}]":
+            if char == "}" and self._depth == 3:
+                self._check(closed=True)
+            self._depth -= 1
+        elif self._depth != 3:
+            return
+        elif char == ":":
+            self._expect_value = True
+        elif char == ",":
+            self._key = None
+            self._expect_value = False
+        elif self._expect_value and not char.isspace():
+            self._scalar = True
+            self._token = [char]
+
+    def _string_done(self, value):
+        if self._expect_value:
+            self._set(value)
+        else:
+            self._key = value
+
+    def _scalar_done(self):
+        self._scalar = False
+        try:
+            self._set(json.loads("".join(self._token)))
+        except ValueError:
+            self._expect_value = False
+
+    def _set(self, value):
+        self._fields[self._key] = value
+        self._expect_value = False
+        self._check(closed=False)
+
+    def _check(self, closed):
+        if self._index in self.emitted:
+            return
+        action = self._fields.get("action")
+        if action is None:
+            return
+        required = _REQUIRED_FIELDS.get(action, _MEDIA_FIELDS)
+        if not closed and any(field not in self._fields for field in required):
+            return
+        try:
+            command = Command(**{k: v for k, v in self._fields.items() if v is not None})
+        except ValidationError:
+            return
+        self.emitted[self._index] = command
+        if self.on_command is not None:
+            self.on_command(self._index, command)
+
+    @property
+    def text(self):
+        return "".join(self._chunks)
+
+    def result(self) -> List[Command]:
+        """All commands of the finished reply; those already handed out are kept as they were"""
+        try:
+            commands = CommandList.model_validate_json(self.text).commands
+        except ValidationError:
+            if not self.emitted:
+                raise
+            logger.warning("Streamed reply was incomplete, keeping the %d finished commands", len(self.emitted))
+            return [self.emitted[i] for i in sorted(self.emitted)]
+        for index, command in self.emitted.items():
+            if index < len(commands):
+                commands[index] = command
+        return commands
+
+# Results of previous parses, keyed on the normalized transcript
+parse_cache = ParseCache()
+
+# langchain is slow to import, so the chains are built on first use:
+# endpoint name -> (parsing chain, streaming chain)
+_chains = {}
+_chain_lock = threading.Lock()
+
+_router = None
+_router_lock = threading.Lock()
+
+# Short enough to send with every request, unlike the JSON schema that
+# PydanticOutputParser.get_format_instructions() produces
+SYSTEM_PROMPT = """Parse voice commands for a media player into JSON.
+Actions: play, pause, resume, next, previous, volume_up, volume_down, set_volume. Platforms: spotify, youtube.
+Reply only with {{"commands":[{{"action":...,"platform":...,"song":...,"volume_level":...}}]}}: one object per command in the order given, keys in that order, leaving out keys that don't apply.
+platform: only for play, pause, resume, next and previous; if none is said, the one named earlier in the request, else spotify.
+song: only for play. volume_level: 0-100, only for set_volume.
+Examples:
+play hotel california on spotify -> {{"commands":[{{"action":"play","platform":"spotify","song":"hotel california"}}]}}
+volume up -> {{"commands":[{{"action":"volume_up"}}]}}
+pause youtube and set the volume to 30 -> {{"commands":[{{"action":"pause","platform":"youtube"}},{{"action":"set_volume","volume_level":30}}]}}"""
+
+def create_llm_parser(model=LLM_MODEL, base_url=None, api_key=None):
+    """Create and configure the LLM parser; returns the parsing and streaming chains"""
+    api_key = api_key or OPENAI_API_KEY
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set. Please set it in your .env file or environment.")
 
-def create_llm_parser():
-    """Create and configure the LLM parser"""
     try:
-        # Initialize the LLM
+        from langchain.prompts import ChatPromptTemplate
+        from langchain_openai import ChatOpenAI
+        from langchain.output_parsers import PydanticOutputParser
+
+        output_parser = PydanticOutputParser(pydantic_object=CommandList)
+
+        # Initialize the LLM; JSON mode keeps the reply parseable without the long format instructions
         llm = ChatOpenAI(
-            model="gpt-3.5-turbo",
+            model=model,
             temperature=0,
-            api_key=OPENAI_API_KEY
-        )
+            api_key=api_key,
+            base_url=base_url or None,
+            # The provider router enforces the overall deadline and retries elsewhere
+            timeout=LLM_TIMEOUT,
+            max_retries=0,
+        ).bind(response_format={"type": "json_object"})
 
         # Create the prompt template
         prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a voice command parser for a media control assistant.
-Your task is to parse natural language commands into structured actions.
-Available actions are: play, pause, resume, next, previous, volume_up, volume_down, set_volume.
-Available platforms are: spotify, youtube.
-
-Examples:
-- "play hotel california on spotify" -> {{"action": "play", "platform": "spotify", "song": "hotel california"}}
-- "pause the music" -> {{"action": "pause", "platform": "spotify"}}
-- "next song" -> {{"action": "next", "platform": "spotify"}}
-- "volume up" -> {{"action": "volume_up"}}
-- "set volume to 75%" -> {{"action": "set_volume", "volume_level": 75}}
-
-If no platform is specified, default to spotify.
-For volume commands, don't include a platform.
-Only include the song field for play actions.
-For set_volume action, include the volume_level field (0-100).
-
-{format_instructions}"""),
+            ("system", SYSTEM_PROMPT),
             ("user", "{input}")
         ])
 
-        # Create the chain
-        chain = prompt | llm | parser
+        # Create the chains; the streaming one yields raw message chunks for CommandStream
+        chain = prompt | llm | output_parser
+        stream_chain = prompt | llm
 
-        return chain
+        return chain, stream_chain
 
     except Exception as e:
-        logger.error(f"Error creating LLM parser: {str(e)}", exc_info=True)
+        logger.error("Error creating LLM parser: %s", e, exc_info=True)
         raise
 
-def parse_command(text: str) -> Optional[Command]:
-    """Parse a voice command using the LLM"""
+def llm_endpoints():
+    """Configured endpoints in order of preference: name -> (model, base URL, API key)"""
+    endpoints = {"primary": (LLM_MODEL, None, OPENAI_API_KEY)}
+    if LLM_SECONDARY_BASE_URL:
+        endpoints["secondary"] = (LLM_SECONDARY_MODEL, LLM_SECONDARY_BASE_URL, LLM_SECONDARY_API_KEY)
+    return endpoints
+
+def get_llm_parser(name="primary"):
+    """Return the shared chain for an endpoint, creating it on first use"""
+    return _get_chains(name)[0]
+
+def _get_chains(name):
+    with _chain_lock:
+        if name not in _chains:
+            _chains[name] = create_llm_parser(*llm_endpoints()[name])
+        return _chains[name]
+
+def get_llm_router():
+    """Router that hedges and fails over between the configured endpoints"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            from providers import ProviderRouter
+            _router = ProviderRouter("llm", llm_endpoints(), LLM_HEDGE_DELAY, LLM_TIMEOUT)
+        return _router
+
+def _stream_commands(stream_chain, text, on_command):
+    start = time.perf_counter()
+
+    def emit(index, command):
+        if len(stream.emitted) == 1:
+            tracer.record("llm.first_command", time.perf_counter() - start)
+        if on_command is not None:
+            on_command(index, command)
+
+    stream = CommandStream(emit)
+    for chunk in stream_chain.stream({"input": text}):
+        stream.feed(chunk.content)
+    return CommandList(commands=stream.result())
+
+def _ask(name, text, on_command):
+    chain, stream_chain = _get_chains(name)
+    if LLM_STREAM:
+        return _stream_commands(stream_chain, text, on_command)
+    return chain.invoke({"input": text})
+
+def _ask_endpoints(text, on_command):
+    """Ask the endpoints through the router; only one of them may hand out commands early.
+
+    Once an endpoint's commands have started running, another endpoint's
+    answer is only used if it agrees with every command already run, so a
+    claiming endpoint that then fails doesn't lose the whole parse. No
+    commands are handed out after an answer has been accepted.
+    """
+    claim_lock = threading.Lock()
+    claimed = []
+    dispatched = {}
+    accepted = []
+
+    def claim(name):
+        def emit(index, command):
+            with claim_lock:
+                if accepted:
+                    return
+                if not claimed:
+                    claimed.append(name)
+                if claimed[0] != name:
+                    return
+                dispatched[index] = command
+            if on_command is not None:
+                on_command(index, command)
+        return emit
+
+    def agrees(result):
+        return all(
+            index < len(result.commands) and result.commands[index] == command
+            for index, command in dispatched.items()
+        )
+
+    def is_good(name, result):
+        if result is None:
+            return False
+        with claim_lock:
+            if claimed and claimed[0] != name and not agrees(result):
+                return False
+            accepted.append(name)
+            return True
+
+    attempts = {name: functools.partial(_ask, name, text, claim(name)) for name in llm_endpoints()}
+    return get_llm_router().call(attempts, is_good=is_good)
+
+def parse_commands(text: str, on_command=None) -> List[Command]:
+    """Parse a voice request into its commands using the LLM.
+
+    With streaming enabled, `on_command(index, command)` is called for each
+    command as soon as it can run, while the rest of the reply is still
+    being generated. Cached results are only returned. A slow or failing
+    primary endpoint is hedged against the secondary one, when configured.
+    """
     if not text:
-        return None
+        return []
 
     try:
-        logger.info(f"Parsing command: {text}")
+        cached = parse_cache.get(text)
+        if cached is not None:
+            try:
+                result = CommandList.model_validate_json(cached).commands
+                logger.info("Parsed commands from cache: %s", result)
+                return result
+            except ValidationError:
+                # Written by an older schema; parse it again
+                parse_cache.invalidate(text)
 
-        # Create the parser
-        chain = create_llm_parser()
+        logger.info("Parsing command: %s", text)
 
-        # Parse the command
-        result = chain.invoke({"input": text, "format_instructions": parser.get_format_instructions()})
+        # Parse the command, hedged across the configured endpoints
+        result = _ask_endpoints(text, on_command)
 
-        logger.info(f"Parsed command: {result}")
-        return result
+        parse_cache.put(text, result.model_dump_json())
+        logger.info("Parsed commands: %s", result.commands)
+        return result.commands
 
     except Exception as e:
-        logger.error(f"Error parsing command: {str(e)}", exc_info=True)
-        return None
\ No newline at end of file
+        logger.error("Error parsing command: %s", e, exc_info=True)
+        return []
+
+def parse_command(text: str) -> Optional[Command]:
+    """Parse a voice command using the LLM; returns the first command"""
+    commands = parse_commands(text)
+    return commands[0] if commands else None
@@ -1,27 +1,100 @@
+import atexit
+import json
 import logging
-from datetime import datetime
+import logging.handlers
 import os
+import queue
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("NOVA_LOG_LEVEL", "INFO").upper()
+# Kept in the user's state directory so runs from a checkout don't write into it
+LOG_FILE = os.path.expanduser(os.getenv("NOVA_LOG_FILE", os.path.join("~", ".nova", "logs", "nova.log")))
+# "text" for the classic format, "json" for one compact JSON object per line
+LOG_FORMAT = os.getenv("NOVA_LOG_FORMAT", "text")
+# Hand records to a background writer thread instead of writing on the caller's thread
+LOG_QUEUE = os.getenv("NOVA_LOG_QUEUE", "1") == "1"
+# Size-based rotation, or time-based when NOVA_LOG_ROTATE_WHEN is set (e.g. "midnight")
+LOG_MAX_BYTES = int(os.getenv("NOVA_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("NOVA_LOG_ROTATE_WHEN")
+LOG_BACKUPS = int(os.getenv("NOVA_LOG_BACKUPS", "5"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class JSONFormatter(logging.Formatter):
+    """One compact JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(",", ":"))
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the writer thread.
+
+    The stock handler renders the message before enqueueing it. The queue
+    never leaves this process, so the record can travel as-is and the
+    caller only pays for creating it.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def _file_handler(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUPS)
+    return logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+
+
+_listener = None
+
 
 def setup_logger():
-    # Create logs directory if it doesn't exist
-    logs_dir = "logs"
-    if not os.path.exists(logs_dir):
-        os.makedirs(logs_dir)
-
-    # Configure logging
-    log_file = os.path.join(logs_dir, f'nova_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log')
-
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler()
-        ]
-    )
+    global _listener
+    formatter = JSONFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [_file_handler(LOG_FILE), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    if LOG_QUEUE:
+        # Unbounded, so a slow disk or console can never block the audio or command threads
+        log_queue = queue.SimpleQueue()
+        root.addHandler(_LazyQueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+    else:
+        for handler in handlers:
+            root.addHandler(handler)
 
     # Create and return logger
     return logging.getLogger("nova")
 
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 # Create a singleton logger instance
-logger = setup_logger()
\ No newline at end of file
+logger = setup_logger()
@@ -1,125 +1,128 @@
-from wake import detect_wake_word
+import startup  # noqa: F401  (first, so the imports below are timed)
 from speech import listen_to_command
-from llm_parser import parse_command
-from executor import (
-    play_on_spotify, play_on_youtube,
-    pause_spotify, resume_spotify, next_spotify, previous_spotify,
-    pause_youtube, resume_youtube, next_youtube, previous_youtube,
-    volume_up, volume_down, set_volume
-)
+from stt import get_stt_backend, STT_BACKEND, STT_FALLBACKS
+from tiered_parser import parse_commands, FALLBACK_PARSER
+from speculation import SpeculativeParser, SPECULATION_ENABLED
+from pipeline import Pipeline
+from audio_capture import get_capture_service, stop_capture_service
+from executor import prepare_commands, player_state
+from dispatch import dispatcher
+from control_bridge import get_control_backend
+from youtube_search import get_youtube_search
+from intent_model import get_intent_model, record_example
+from tts import voice
+import tracing
 from logger import logger
+import asyncio
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-def execute_command(command):
-    if not command:
-        logger.error("No command received")
-        return False
-
-    action = command.action
-    platform = command.platform
-
-    try:
-        if action == "play":
-            song = command.song
-            if not song:
-                logger.error("No song specified for play action")
-                return False
-
-            if platform == "spotify":
-                logger.info(f"Playing on Spotify: {song}")
-                play_on_spotify(song)
-            elif platform == "youtube":
-                logger.info(f"Playing on YouTube: {song}")
-                play_on_youtube(song)
-
-        elif action == "pause":
-            if platform == "spotify":
-                pause_spotify()
-            elif platform == "youtube":
-                pause_youtube()
-
-        elif action == "resume":
-            if platform == "spotify":
-                resume_spotify()
-            elif platform == "youtube":
-                resume_youtube()
-
-        elif action == "next":
-            if platform == "spotify":
-                next_spotify()
-            elif platform == "youtube":
-                next_youtube()
-
-        elif action == "previous":
-            if platform == "spotify":
-                previous_spotify()
-            elif platform == "youtube":
-                previous_youtube()
-
-        elif action == "volume_up":
-            volume_up()
-
-        elif action == "volume_down":
-            volume_down()
-
-        elif action == "set_volume":
-            if command.volume_level is not None:
-                logger.info(f"Setting volume to {command.volume_level}%")
-                set_volume(command.volume_level)
-            else:
-                logger.error("No volume level specified for set_volume action")
-                return False
-
-        return True
-
-    except Exception as e:
-        logger.error(f"Error executing command: {str(e)}", exc_info=True)
-        return False
+# Build clients and load models before the first wake word instead of on it
+WARMUP = os.getenv("NOVA_WARMUP", "1") == "1"
+
+def dispatch_commands(commands, prepared=None):
+    """Start executing every command of a request.
+
+    Each command is queued on its player's backend, so it runs alongside
+    commands for other players and in order with those for the same one.
+    Returns a Future that resolves to True when everything succeeded.
+    """
+    return dispatcher.dispatch_batch(commands, prepared)
+
+def warm_up(audio=True):
+    """Pre-build every client and model the first command will need.
+
+    Without `audio` the microphone, wake word and STT steps are skipped, for
+    the text-only command API.
+    """
+    from wake import get_porcupine
+
+    def stt():
+        for name in [STT_BACKEND] + STT_FALLBACKS:
+            backend = get_stt_backend(name)
+            if hasattr(backend, "wait_until_ready"):
+                backend.wait_until_ready()
+
+    def llm():
+        import llm_parser
+        for name in llm_parser.llm_endpoints():
+            llm_parser.get_llm_parser(name)
+
+    steps = {"stt": stt, "wake word": get_porcupine, "microphone": get_capture_service} if audio else {}
+    steps.update({
+        "control": lambda: player_state.refresh(get_control_backend()),
+        "youtube search": lambda: get_youtube_search().warm(),
+        "intent model": get_intent_model,
+    })
+    if audio:
+        steps["speech output"] = voice.warm
+    if FALLBACK_PARSER == "llm":
+        steps["llm"] = llm
+    startup.warm_up(steps)
 
 def main():
+    # Imported here so the rest of this module works without the wake word engine
+    from wake import detect_wake_word, wake_stats
+    from daemon import DAEMON_ENABLED, start_daemon
+    from tiered_parser import parse
+
     # Check for OpenAI API key
-    if not os.getenv("OPENAI_API_KEY"):
+    if FALLBACK_PARSER == "llm" and not os.getenv("OPENAI_API_KEY"):
         logger.error("OPENAI_API_KEY environment variable not set!")
         print("Error: OPENAI_API_KEY environment variable not set!")
         return
 
     logger.info("Starting Nova Assistant")
-    while True:
-        try:
-            logger.info("Waiting for wake word...")
-            detect_wake_word()
-            logger.info("Wake word detected!")
-
-            logger.info("Listening for command...")
-            command_text = listen_to_command()
-            logger.info(f"Received command: {command_text}")
-
-            if not command_text:
-                logger.warning("No command received")
-                print("Sorry, I didn't understand that command.")
-                continue
-
-            logger.info("Parsing command...")
-            command = parse_command(command_text)
-
-            if command:
-                logger.info(f"Executing command: {command}")
-                if execute_command(command):
-                    logger.info("Command executed successfully")
-                else:
-                    logger.error("Failed to execute command")
-                    print("Sorry, I couldn't execute that command.")
-            else:
-                logger.warning(f"Could not parse command: {command_text}")
-                print("Sorry, I didn't understand that command.")
-
-        except Exception as e:
-            logger.error(f"Error in main loop: {str(e)}", exc_info=True)
-            print("An error occurred. Please try again.")
+
+    if WARMUP:
+        warm_up()
+    startup.report()
+
+    # Per-stage latency histograms, when NOVA_TRACING=1
+    tracing.start_exporter()
+
+    # Keep the local volume/player mirror fresh in the background
+    player_state.start_refresh(get_control_backend)
+
+    # Text commands from other programs, sharing the parser and players with the voice loop
+    command_api = None
+    if DAEMON_ENABLED:
+        command_api = start_daemon(parse, dispatch_commands, extra_stats=lambda: {"dispatch": dispatcher.stats()})
+
+    def on_done(turn, ok):
+        # Executed turns become training data for the local intent model
+        if ok:
+            voice.confirm(turn.commands)
+            record_example(turn.text, turn.commands)
+
+    def make_speculator():
+        return SpeculativeParser(parse_commands, prepare_commands)
+
+    pipeline = Pipeline(
+        detect_wake_word=detect_wake_word,
+        listen=listen_to_command,
+        parse=parse_commands,
+        execute=dispatch_commands,
+        make_speculator=make_speculator if SPECULATION_ENABLED else None,
+        on_feedback=voice.say,
+        on_done=on_done,
+    )
+    try:
+        asyncio.run(pipeline.run())
+    except KeyboardInterrupt:
+        logger.info("Stopping Nova Assistant")
+    finally:
+        logger.info("Wake word loop: %s", wake_stats.summary())
+        logger.info("Dispatch queues: %s", dispatcher.stats())
+        if command_api is not None:
+            command_api.stop()
+        # Closing the microphone also releases a thread blocked on the wake word
+        stop_capture_service()
+        voice.close()
+        tracing.stop_exporter()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,122 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+CACHE_SIZE = int(os.getenv("NOVA_PARSE_CACHE_SIZE", "256"))
+CACHE_TTL = float(os.getenv("NOVA_PARSE_CACHE_TTL", "86400"))
+# Path to an SQLite file that keeps the cache across restarts; unset disables it
+CACHE_DB = os.getenv("NOVA_PARSE_CACHE_DB")
+
+
+def normalize(text):
+    """Cache key for a transcript: lowercase, no punctuation, single spaces"""
+    text = re.sub(r"[^\w\s%]", " ", text.lower())
+    return " ".join(text.split())
+
+
+class ParseCache:
+    """LRU cache with TTL for serialized parse results, optionally backed by SQLite"""
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL, db_path=CACHE_DB):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS parse_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM parse_cache WHERE created < ?", (time.time() - ttl,))
+            self._db.commit()
+            logger.info("Parse cache persisted to %s", db_path)
+
+    def get(self, text):
+        """Return the cached value for a transcript, or None"""
+        key = normalize(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created FROM parse_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, text, value):
+        """Cache a serialized value for a transcript"""
+        key = normalize(text)
+        created = time.time()
+        with self._lock:
+            self._store(key, value, created)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO parse_cache (key, value, created) VALUES (?, ?, ?)",
+                    (key, value, created)
+                )
+                self._db.commit()
+
+    def _store(self, key, value, created):
+        self._entries[key] = (value, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, text=None):
+        """Drop one transcript, or everything when `text` is None"""
+        with self._lock:
+            if text is None:
+                self._entries.clear()
+                if self._db is not None:
+                    self._db.execute("DELETE FROM parse_cache")
+                    self._db.commit()
+                return
+
+            key = normalize(text)
+            self._entries.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM parse_cache WHERE key = ?", (key,))
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,342 @@
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Optional
+from dotenv import load_dotenv
+from logger import logger
+from tracing import tracer
+
+load_dotenv()
+
+QUEUE_SIZE = int(os.getenv("NOVA_PIPELINE_QUEUE_SIZE", "4"))
+PARSE_CONCURRENCY = int(os.getenv("NOVA_PARSE_CONCURRENCY", "2"))
+# Commands share the players, so by default they run one at a time and in order
+EXECUTE_CONCURRENCY = int(os.getenv("NOVA_EXECUTE_CONCURRENCY", "1"))
+# "queue" lets a new wake word wait behind in-flight commands, "interrupt" cancels them
+INTERRUPT_POLICY = os.getenv("NOVA_INTERRUPT_POLICY", "queue")
+# Run commands the parser streams out before it has finished the whole request
+EARLY_DISPATCH = os.getenv("NOVA_EARLY_DISPATCH", "1") == "1"
+
+_turn_ids = itertools.count(1)
+
+
+@dataclass(eq=False)
+class Turn:
+    """One wake word to action cycle as it moves through the pipeline"""
+    wake_position: int
+    # Order in which the turn was heard; turns execute in this order
+    seq: int = -1
+    id: int = field(default_factory=lambda: next(_turn_ids))
+    started: float = field(default_factory=time.perf_counter)
+    text: Optional[str] = None
+    commands: list = field(default_factory=list)
+    prepared: dict = field(default_factory=dict)
+    early: dict = field(default_factory=dict)
+    speculator: Any = None
+    cancelled: bool = False
+    tasks: set = field(default_factory=set)
+
+
+class Pipeline:
+    """Wake → listen → parse → execute as asyncio stages joined by bounded queues.
+
+    The microphone stage (wake word and recording) runs on its own thread so
+    it keeps listening while earlier commands are still being parsed or
+    executed. Parsing and execution each run in their own thread pool with
+    a concurrency limit. Stage callables are injected so the pipeline can be
+    driven by fakes.
+
+    With early dispatch, `parse` is called with an `on_command(index,
+    command)` callback. Commands passed to it are executed straight away,
+    each on its own, and the execute stage then only runs the rest.
+    `on_done(turn, ok)` is called once for every turn that was heard,
+    however it ends.
+
+    `execute` may return a Future instead of waiting for the commands to
+    finish. The execute stage then moves on to the next turn straight
+    away, and the result is collected in the background.
+
+    Several turns may be parsed at once, but they reach the execute stage
+    in the order they were heard: a turn whose parse finishes early waits
+    in a reorder buffer for the turns before it. Early dispatch is only
+    used by the oldest turn still being parsed, once every earlier turn has
+    been handed to `execute`.
+    """
+
+    def __init__(self, detect_wake_word, listen, parse, execute,
+                 make_speculator=None, on_feedback=print, on_done=None,
+                 queue_size=QUEUE_SIZE, parse_concurrency=PARSE_CONCURRENCY,
+                 execute_concurrency=EXECUTE_CONCURRENCY, interrupt_policy=INTERRUPT_POLICY,
+                 early_dispatch=EARLY_DISPATCH):
+        self.detect_wake_word = detect_wake_word
+        self.listen = listen
+        self.parse = parse
+        self.execute = execute
+        self.make_speculator = make_speculator
+        self.on_feedback = on_feedback
+        self.on_done = on_done
+        self.early_dispatch = early_dispatch
+        self.interrupt_policy = interrupt_policy
+        self.parse_concurrency = parse_concurrency
+        self.execute_concurrency = execute_concurrency
+
+        self._parse_queue = asyncio.Queue(maxsize=queue_size)
+        self._execute_queue = asyncio.Queue(maxsize=queue_size)
+        self._mic_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mic")
+        self._parse_pool = ThreadPoolExecutor(max_workers=parse_concurrency, thread_name_prefix="parse")
+        self._execute_pool = ThreadPoolExecutor(max_workers=execute_concurrency, thread_name_prefix="execute")
+        self._in_flight = set()
+        self._completions = set()
+
+        # Reorder buffer between parse and execute, keyed by Turn.seq
+        self._sequence = itertools.count()
+        self._next_seq = 0
+        self._reorder = {}
+        self._unstarted = 0
+        self._order_lock = threading.Lock()
+        self._release_lock = asyncio.Lock()
+
+    async def _run_blocking(self, pool, turn, func, *args):
+        """Run a blocking call in `pool`; cancelling the turn abandons the wait"""
+        future = asyncio.get_running_loop().run_in_executor(pool, func, *args)
+        task = asyncio.ensure_future(future)
+        turn.tasks.add(task)
+        try:
+            return await task
+        finally:
+            turn.tasks.discard(task)
+
+    def _finish(self, turn, ok):
+        self._in_flight.discard(turn)
+        if self.on_done is not None:
+            self.on_done(turn, ok)
+
+    def _interrupt_in_flight(self):
+        for turn in list(self._in_flight):
+            logger.info("Interrupting turn %s", turn.id)
+            turn.cancelled = True
+            for task in list(turn.tasks):
+                task.cancel()
+            for future in turn.early.values():
+                future.cancel()
+        self._in_flight.clear()
+
+    async def _listen_stage(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            logger.info("Waiting for wake word...")
+            wake_position = await loop.run_in_executor(self._mic_pool, self.detect_wake_word)
+            logger.info("Wake word detected!")
+
+            if self.interrupt_policy == "interrupt":
+                self._interrupt_in_flight()
+
+            turn = Turn(wake_position)
+            self._in_flight.add(turn)
+            if self.make_speculator is not None:
+                turn.speculator = self.make_speculator()
+            on_partial = turn.speculator.on_partial if turn.speculator else None
+
+            logger.info("Listening for command...")
+            listen = functools.partial(self.listen, wake_position, on_partial=on_partial)
+            turn.text = await loop.run_in_executor(self._mic_pool, listen)
+            logger.info("Received command: %s", turn.text)
+
+            if not turn.text:
+                logger.warning("No command received")
+                self.on_feedback("Sorry, I didn't understand that command.")
+                self._finish(turn, False)
+                continue
+
+            turn.seq = next(self._sequence)
+            await self._parse_queue.put(turn)
+
+    def _dispatch_early(self, turn, index, command):
+        """Called on a parse thread for each command the parser has finished"""
+        if turn.cancelled:
+            return
+        with self._order_lock:
+            # Running now could overtake an earlier turn; leave it to the execute stage
+            if turn.seq != self._next_seq or self._unstarted:
+                return
+        logger.info("Dispatching command %d of turn %s before parsing finished: %s", index, turn.id, command)
+        turn.early[index] = self._execute_pool.submit(self.execute, [command], {})
+
+    def _parse_turn(self, turn):
+        kwargs = {}
+        if self.early_dispatch:
+            kwargs["on_command"] = functools.partial(self._dispatch_early, turn)
+        if turn.speculator is not None:
+            return turn.speculator.finalize(turn.text, **kwargs)
+        return self.parse(turn.text, **kwargs), {}
+
+    async def _release(self, turn, execute):
+        """Hand parsed turns to the execute stage in the order they were heard.
+
+        Every turn taken by a parse stage is released exactly once; with
+        `execute` false it only frees its place in the order.
+        """
+        with self._order_lock:
+            self._reorder[turn.seq] = turn if execute else None
+        # One releaser at a time, so queue puts can't overtake each other
+        async with self._release_lock:
+            while True:
+                with self._order_lock:
+                    if self._next_seq not in self._reorder:
+                        return
+                    ready = self._reorder.pop(self._next_seq)
+                    self._next_seq += 1
+                    if ready is not None:
+                        self._unstarted += 1
+                if ready is not None:
+                    await self._execute_queue.put(ready)
+
+    async def _parse_stage(self):
+        while True:
+            turn = await self._parse_queue.get()
+            execute = False
+            try:
+                if turn.cancelled:
+                    self._finish(turn, False)
+                    continue
+                logger.info("Parsing command for turn %s...", turn.id)
+                turn.commands, turn.prepared = await self._run_blocking(
+                    self._parse_pool, turn, self._parse_turn, turn
+                )
+                if not turn.commands and not turn.early:
+                    logger.warning("Could not parse command: %s", turn.text)
+                    self.on_feedback("Sorry, I didn't understand that command.")
+                    self._finish(turn, False)
+                    continue
+                execute = True
+            except asyncio.CancelledError:
+                if not turn.cancelled:
+                    raise
+                logger.info("Parsing cancelled for turn %s", turn.id)
+                self._finish(turn, False)
+            except Exception as e:
+                logger.error("Error parsing turn %s: %s", turn.id, e, exc_info=True)
+                self.on_feedback("An error occurred. Please try again.")
+                self._finish(turn, False)
+            finally:
+                self._parse_queue.task_done()
+                await self._release(turn, execute)
+
+    async def _await_result(self, turn, result):
+        """Wait for what `execute` returned, which may be a Future of the result"""
+        while isinstance(result, concurrent.futures.Future):
+            task = asyncio.ensure_future(asyncio.wrap_future(result))
+            turn.tasks.add(task)
+            try:
+                result = await task
+            finally:
+                turn.tasks.discard(task)
+        return result
+
+    async def _start_turn(self, turn):
+        """Hand the turn's commands to `execute`; returns what each call gave back"""
+        # Commands dispatched while parsing were submitted first, so they run first
+        results = list(turn.early.values())
+        remaining, prepared = [], {}
+        for index, command in enumerate(turn.commands):
+            if index in turn.early:
+                continue
+            if index in turn.prepared:
+                prepared[len(remaining)] = turn.prepared[index]
+            remaining.append(command)
+        if remaining:
+            results.append(await self._run_blocking(self._execute_pool, turn, self.execute, remaining, prepared))
+        return results
+
+    async def _complete_turn(self, turn, results, started):
+        ok = False
+        try:
+            ok = True
+            for result in results:
+                done = await self._await_result(turn, result)
+                ok = ok and bool(done)
+            tracer.record("execute", time.perf_counter() - started)
+            elapsed = time.perf_counter() - turn.started
+            if ok:
+                tracer.record("wake_to_action", elapsed)
+                logger.info("Command executed successfully (%.2fs after wake word)", elapsed)
+            else:
+                logger.error("Failed to execute command")
+                self.on_feedback("Sorry, I couldn't execute that command.")
+        except asyncio.CancelledError:
+            ok = False
+            if not turn.cancelled:
+                raise
+            logger.info("Execution cancelled for turn %s", turn.id)
+        except Exception as e:
+            ok = False
+            logger.error("Error executing turn %s: %s", turn.id, e, exc_info=True)
+            self.on_feedback("An error occurred. Please try again.")
+        finally:
+            self._finish(turn, ok)
+
+    async def _execute_stage(self):
+        while True:
+            turn = await self._execute_queue.get()
+            try:
+                if turn.cancelled:
+                    self._finish(turn, False)
+                    continue
+                logger.info("Executing commands: %s", turn.commands)
+                started = time.perf_counter()
+                results = await self._start_turn(turn)
+                # When `execute` only queues the commands, waiting for them
+                # happens off the stage so the next turn can be queued meanwhile
+                task = asyncio.ensure_future(self._complete_turn(turn, results, started))
+                self._completions.add(task)
+                task.add_done_callback(self._completions.discard)
+            except asyncio.CancelledError:
+                if not turn.cancelled:
+                    raise
+                logger.info("Execution cancelled for turn %s", turn.id)
+                self._finish(turn, False)
+            except Exception as e:
+                logger.error("Error executing turn %s: %s", turn.id, e, exc_info=True)
+                self.on_feedback("An error occurred. Please try again.")
+                self._finish(turn, False)
+            finally:
+                with self._order_lock:
+                    self._unstarted -= 1
+                self._execute_queue.task_done()
+
+    async def _supervise(self, name, stage):
+        """Keep a stage running if it crashes on something unexpected"""
+        while True:
+            try:
+                await stage()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error in %s stage: %s", name, e, exc_info=True)
+                self.on_feedback("An error occurred. Please try again.")
+                await asyncio.sleep(1)
+
+    async def run(self):
+        """Run all stages until cancelled"""
+        stages = [self._supervise("listen", self._listen_stage)]
+        stages += [self._supervise("parse", self._parse_stage) for _ in range(self.parse_concurrency)]
+        stages += [self._supervise("execute", self._execute_stage) for _ in range(self.execute_concurrency)]
+        tasks = [asyncio.ensure_future(stage) for stage in stages]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            tasks += self._completions
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.close()
+
+    def close(self):
+        for pool in (self._mic_pool, self._parse_pool, self._execute_pool):
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from dotenv import load_dotenv
+from logger import logger
+from control_bridge import ControlOp
+
+load_dotenv()
+
+# A mirrored volume older than this is re-read before relative changes
+VOLUME_MAX_AGE = float(os.getenv("NOVA_VOLUME_MAX_AGE", "60"))
+# Seconds between background refreshes of the mirror; 0 disables them
+REFRESH_INTERVAL = float(os.getenv("NOVA_STATE_REFRESH_SECONDS", "30"))
+
+
+class PlayerState:
+    """Local mirror of system volume and what each player is doing.
+
+    Updated from the executor's own writes and from periodic refreshes, so
+    relative commands don't have to read the live volume first.
+    """
+
+    def __init__(self, max_age=VOLUME_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._volume = None
+        self._volume_updated = 0.0
+        self._players = {
+            "spotify": {"status": "unknown", "track": None},
+            "youtube": {"status": "unknown", "track": None},
+        }
+        self._refresh_thread = None
+        self._stop = threading.Event()
+
+    def known_volume(self):
+        """Mirrored volume, or None if it is unknown or too old to trust"""
+        with self._lock:
+            if self._volume is None or time.monotonic() - self._volume_updated > self.max_age:
+                return None
+            return self._volume
+
+    def set_known_volume(self, level):
+        with self._lock:
+            self._volume = level
+            self._volume_updated = time.monotonic()
+
+    def apply(self, op, result):
+        """Record the effect of an operation the backend has carried out"""
+        if not result.ok:
+            return
+        if op.action == "get_volume":
+            try:
+                self.set_known_volume(int(result.output.strip()))
+            except ValueError:
+                pass
+        elif op.action == "set_volume":
+            self.set_known_volume(max(0, min(100, int(op.arg))))
+        elif op.platform in self._players:
+            with self._lock:
+                player = self._players[op.platform]
+                if op.action == "pause":
+                    player["status"] = "paused"
+                elif op.action in ("play", "resume", "next", "previous"):
+                    player["status"] = "playing"
+                if op.action == "play":
+                    player["track"] = op.arg
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "volume": self._volume,
+                "players": {name: dict(player) for name, player in self._players.items()},
+            }
+
+    def refresh(self, backend):
+        """Re-read the live volume from the backend"""
+        op = ControlOp("get_volume")
+        result = backend.execute(op)
+        self.apply(op, result)
+        return self.known_volume()
+
+    def start_refresh(self, get_backend, interval=REFRESH_INTERVAL):
+        """Refresh the mirror every `interval` seconds on a background thread"""
+        if interval <= 0 or self._refresh_thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.refresh(get_backend())
+                except Exception as e:
+                    logger.warning("Player state refresh failed: %s", e)
+
+        self._refresh_thread = threading.Thread(target=run, name="player-state", daemon=True)
+        self._refresh_thread.start()
+
+    def stop_refresh(self):
+        self._stop.set()
+
+
+class Coalescer:
+    """Merges bursts of volume and skip commands into single backend calls.
+
+    A command is sent as soon as no other flush is in flight. Commands that
+    arrive while one is in flight are merged and sent together when it
+    returns: relative volume changes are summed into one set_volume against
+    the mirrored level, and skips are netted per platform and sent as one
+    batch. A caller that is alone, such as a dispatch worker, never waits
+    for anyone else.
+    """
+
+    def __init__(self, get_backend, state):
+        self.get_backend = get_backend
+        self.state = state
+        self._lock = threading.Lock()
+        self._pending = None
+        self._flushing = False
+        self.merged = 0
+        self.flushes = 0
+
+    def _new_batch(self):
+        return {"volume": None, "delta": 0, "skips": {}, "futures": []}
+
+    def _add(self, update):
+        future = Future()
+        with self._lock:
+            batch = self._pending or self._new_batch()
+            update(batch)
+            batch["futures"].append(future)
+            if self._pending is None:
+                self._pending = batch
+            else:
+                self.merged += 1
+            # The first caller flushes, and keeps flushing what piles up meanwhile
+            leader = not self._flushing
+            self._flushing = True
+
+        if leader:
+            self._drain()
+        return future.result()
+
+    def volume_delta(self, delta):
+        """Change the volume by `delta`; returns the level that was set"""
+        def update(batch):
+            batch["delta"] += delta
+        return self._add(update)
+
+    def set_volume(self, level):
+        """Set an absolute volume; later deltas merged with it apply on top"""
+        def update(batch):
+            batch["volume"] = max(0, min(100, int(level)))
+            batch["delta"] = 0
+        return self._add(update)
+
+    def skip(self, platform, steps):
+        """Skip forward (positive) or back (negative) on a platform"""
+        def update(batch):
+            batch["skips"][platform] = batch["skips"].get(platform, 0) + steps
+        return self._add(update)
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                batch = self._pending
+                self._pending = None
+                if batch is None:
+                    self._flushing = False
+                    return
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            backend = self.get_backend()
+            ops = []
+            level = None
+            if batch["volume"] is not None or batch["delta"]:
+                base = batch["volume"]
+                if base is None:
+                    base = self.state.known_volume()
+                if base is None:
+                    base = self.state.refresh(backend)
+                if base is None:
+                    raise RuntimeError("Could not read the current volume")
+                level = max(0, min(100, base + batch["delta"]))
+                ops.append(ControlOp("set_volume", arg=level))
+
+            for platform, steps in batch["skips"].items():
+                action = "next" if steps > 0 else "previous"
+                ops.extend(ControlOp(action, platform) for _ in range(abs(steps)))
+
+            results = backend.submit(ops) if ops else []
+            for op, result in zip(ops, results):
+                self.state.apply(op, result)
+            self.flushes += 1
+
+            failed = [result.error for result in results if not result.ok]
+            if failed:
+                raise RuntimeError("; ".join(failed))
+            for future in batch["futures"]:
+                future.set_result(level)
+        except Exception as e:
+            for future in batch["futures"]:
+                future.set_exception(e)
@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+from logger import logger
+from tracing import tracer
+
+load_dotenv()
+
+# Latencies kept per provider for the rolling percentiles
+ROUTER_WINDOW = int(os.getenv("NOVA_ROUTER_WINDOW", "100"))
+# Calls a provider needs before its own p95 replaces the configured hedge delay
+HEDGE_MIN_SAMPLES = int(os.getenv("NOVA_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_QUANTILE = 0.95
+# Consecutive failures that open a provider's circuit, and how long it stays open
+BREAKER_FAILURES = int(os.getenv("NOVA_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("NOVA_BREAKER_COOLDOWN", "30"))
+
+# Threads per router; hedged requests that lose keep theirs until they return,
+# so each router has its own and a slow kind of provider can't starve another
+ROUTER_WORKERS = int(os.getenv("NOVA_ROUTER_WORKERS", "4"))
+
+
+class ProviderError(RuntimeError):
+    """No provider produced a usable answer in time"""
+
+
+class CircuitBreaker:
+    """Stops calling a provider after repeated failures.
+
+    After `failures` failures in a row the circuit opens and the provider
+    is skipped for `cooldown` seconds. After that it is half-open: calls
+    are let through again, the next success closes the circuit and the
+    next failure reopens it straight away.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = None
+        self.trips = 0
+
+    def _cooled_down(self):
+        return time.monotonic() - self._opened_at >= self.cooldown
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if self._cooled_down() else "open"
+
+    def allow(self):
+        with self._lock:
+            return self._opened_at is None or self._cooled_down()
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        """Count a failure; returns True when it (re)opened the circuit"""
+        with self._lock:
+            self._consecutive += 1
+            if self._opened_at is None:
+                opens = self._consecutive >= self.failures
+            else:
+                # Late failures of calls started before the circuit opened don't extend it
+                opens = self._cooled_down()
+            if opens:
+                self._opened_at = time.monotonic()
+                self.trips += 1
+            return opens
+
+
+class ProviderStats:
+    """Rolling latency window and outcome counts for one provider"""
+
+    def __init__(self, window=ROUTER_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.wins = 0
+        self.hedges = 0
+
+    def quantile(self, q):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+class ProviderRouter:
+    """Calls the preferred provider and hedges or fails over to the others.
+
+    Providers are tried in preference order, skipping those whose circuit
+    is open. If the current one has not answered by its rolling p95 (or
+    `hedge_delay` until it has enough history), the next one is started
+    as well, and the first good answer wins. A failure starts the next
+    provider straight away. Answers that arrive after the winner still
+    count towards each provider's latency history; only errors and
+    timeouts count towards opening its circuit, and a call that timed out
+    is not recorded again when it finally returns. Attempts that haven't
+    started when the call ends are cancelled.
+    """
+
+    def __init__(self, kind, names, hedge_delay, timeout, hedging=True, workers=ROUTER_WORKERS):
+        self.kind = kind
+        self.names = list(names)
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self.hedging = hedging
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{kind}-provider")
+        self._lock = threading.Lock()
+        self._stats = {name: ProviderStats() for name in self.names}
+        self._breakers = {name: CircuitBreaker() for name in self.names}
+
+    def hedge_after(self, name):
+        """Seconds to wait on `name` before also asking the next provider"""
+        with self._lock:
+            stats = self._stats[name]
+            if len(stats.latencies) < HEDGE_MIN_SAMPLES:
+                return self.hedge_delay
+            return stats.quantile(HEDGE_QUANTILE)
+
+    def _order(self, attempts):
+        names = [name for name in self.names if name in attempts]
+        available = [name for name in names if self._breakers[name].allow()]
+        # With every circuit open, trying anyway beats failing without a call
+        return available or names
+
+    def _record(self, name, started, ok):
+        elapsed = time.perf_counter() - started
+        tracer.record(f"{self.kind}.{name}", elapsed, error=not ok)
+        with self._lock:
+            stats = self._stats[name]
+            stats.calls += 1
+            if ok:
+                stats.latencies.append(elapsed)
+            else:
+                stats.failures += 1
+        if ok:
+            self._breakers[name].record_success()
+        elif self._breakers[name].record_failure():
+            logger.warning("%s provider '%s' failing; skipping it for %.0fs", self.kind, name, BREAKER_COOLDOWN)
+
+    def call(self, attempts, is_good=None, timeout=None):
+        """Run `attempts` ({provider name: callable}) and return the first good result.
+
+        `is_good(name, result)` decides whether an answer is usable; by
+        default any truthy result is. Raises ProviderError when every
+        provider failed or none answered within the timeout.
+        """
+        is_good = is_good or (lambda name, result: bool(result))
+        deadline = time.perf_counter() + (self.timeout if timeout is None else timeout)
+        order = self._order(attempts)
+        pending = {}
+        errors = []
+        # Guards `timed_out` between this thread and the attempts' callbacks
+        settle_lock = threading.Lock()
+        timed_out = set()
+
+        def launch(name, hedge=False):
+            started = time.perf_counter()
+            future = self._pool.submit(attempts[name])
+            pending[future] = name
+
+            def done(future):
+                with settle_lock:
+                    if future.cancelled() or future in timed_out:
+                        return
+                # An answer that lost or wasn't usable still means the provider is up
+                self._record(name, started, future.exception() is None)
+
+            future.add_done_callback(done)
+            if hedge:
+                with self._lock:
+                    self._stats[name].hedges += 1
+                logger.info("%s provider '%s' is slow, also asking '%s'", self.kind, current, name)
+
+        current = order[0]
+        launch(current)
+        next_hedge = time.perf_counter() + self.hedge_after(current)
+        remaining = order[1:]
+
+        while pending:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            until = deadline
+            if remaining and self.hedging:
+                until = min(until, next_hedge)
+            done, _ = wait(pending, timeout=max(0.0, until - now), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = pending.pop(future)
+                error = future.exception()
+                if error is None and is_good(name, future.result()):
+                    with self._lock:
+                        self._stats[name].wins += 1
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+                errors.append(f"{name}: {error or 'no usable answer'}")
+                logger.warning("%s provider '%s' failed: %s", self.kind, name, error or "no usable answer")
+                # Fail over right away rather than waiting for the hedge point
+                if remaining and not pending:
+                    current = remaining.pop(0)
+                    launch(current)
+                    next_hedge = time.perf_counter() + self.hedge_after(current)
+
+            if not done and remaining and self.hedging and time.perf_counter() >= next_hedge:
+                name = remaining.pop(0)
+                launch(name, hedge=True)
+                current = name
+                next_hedge = time.perf_counter() + self.hedge_after(name)
+
+        for future, name in pending.items():
+            if future.cancel():
+                errors.append(f"{name}: not started in time")
+                continue
+            with settle_lock:
+                # Finished since the last wait; its callback has recorded it
+                if future.done():
+                    errors.append(f"{name}: answered too late")
+                    continue
+                timed_out.add(future)
+            with self._lock:
+                self._stats[name].timeouts += 1
+            # A provider that hangs may never return to record its failure
+            if self._breakers[name].record_failure():
+                logger.warning("%s provider '%s' timing out; skipping it for %.0fs", self.kind, name, BREAKER_COOLDOWN)
+            errors.append(f"{name}: timed out")
+        raise ProviderError(f"No {self.kind} provider answered: {'; '.join(errors)}")
+
+    def stats(self):
+        with self._lock:
+            summary = {}
+            for name in self.names:
+                stats = self._stats[name]
+                summary[name] = {
+                    "calls": stats.calls,
+                    "wins": stats.wins,
+                    "hedges": stats.hedges,
+                    "failures": stats.failures,
+                    "timeouts": stats.timeouts,
+                    "p50": stats.quantile(0.5),
+                    "p95": stats.quantile(HEDGE_QUANTILE),
+                    "breaker": self._breakers[name].state,
+                }
+            return summary
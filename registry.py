@@ -0,0 +1,47 @@
+import importlib
+import threading
+import time
+from logger import logger
+
+
+class LazyRegistry:
+    """Named backends given as "module:attribute" strings, imported on first use.
+
+    Only the backend that is actually configured gets imported, so heavy
+    optional dependencies of the others never slow down startup. Entries
+    may also be registered directly as classes or callables.
+    """
+
+    def __init__(self, kind, entries=None):
+        self.kind = kind
+        self._entries = dict(entries or {})
+        self._resolved = {}
+        self._lock = threading.Lock()
+        self.load_times = {}
+
+    def register(self, name, target):
+        """Add or replace a backend; `target` is "module:attribute" or the object itself"""
+        with self._lock:
+            self._entries[name] = target
+            self._resolved.pop(name, None)
+
+    def names(self):
+        return sorted(self._entries)
+
+    def resolve(self, name):
+        """Import and return the backend registered under `name`"""
+        with self._lock:
+            if name in self._resolved:
+                return self._resolved[name]
+            if name not in self._entries:
+                raise ValueError(f"Unknown {self.kind}: {name} (available: {', '.join(self.names())})")
+
+            target = self._entries[name]
+            if isinstance(target, str):
+                start = time.perf_counter()
+                module_name, _, attribute = target.partition(":")
+                target = getattr(importlib.import_module(module_name), attribute)
+                self.load_times[name] = time.perf_counter() - start
+                logger.debug("Loaded %s '%s' in %.3fs", self.kind, name, self.load_times[name])
+            self._resolved[name] = target
+            return target
@@ -0,0 +1,174 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from logger import logger
+from parse_cache import normalize
+
+load_dotenv()
+
+SPECULATION_ENABLED = os.getenv("NOVA_SPECULATION", "1") == "1"
+# Partials that must agree on a prefix before it is worth parsing
+STABLE_PARTIALS = int(os.getenv("NOVA_SPECULATION_STABLE_PARTIALS", "2"))
+# Upper bound on speculative parses per utterance, to cap wasted LLM calls
+SPECULATION_LIMIT = int(os.getenv("NOVA_SPECULATION_LIMIT", "3"))
+
+
+class _Speculation:
+    """Parse and preparation started for one candidate transcript"""
+
+    def __init__(self, text):
+        self.text = text
+        self.key = normalize(text)
+        self.cancelled = threading.Event()
+        self.future = None
+
+
+class SpeculationStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.utterances = 0
+        self.started = 0
+        self.hits = 0
+        self.reused = 0
+        self.misses = 0
+        self.cancelled = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def summary(self):
+        with self._lock:
+            hit_rate = self.hits / self.utterances if self.utterances else 0.0
+            return {
+                "utterances": self.utterances,
+                "started": self.started,
+                "hits": self.hits,
+                "reused": self.reused,
+                "misses": self.misses,
+                "cancelled": self.cancelled,
+                "hit_rate": hit_rate,
+            }
+
+
+speculation_stats = SpeculationStats()
+
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="speculate")
+
+
+class SpeculativeParser:
+    """Parses stable prefixes of partial transcripts before the user finishes.
+
+    Feed partial transcripts to `on_partial` while recording. Once the same
+    word prefix has appeared in `stable_partials` consecutive partials it is
+    parsed in the background, and `prepare` is run on the result to do any
+    side-effect-free work (such as a YouTube search). Nothing is executed
+    speculatively, so rolling back a wrong guess only means discarding it.
+
+    `finalize` commits the speculation when the final transcript agrees with
+    it, and otherwise cancels it and parses the final transcript normally.
+    """
+
+    def __init__(self, parse, prepare=None, stable_partials=STABLE_PARTIALS,
+                 limit=SPECULATION_LIMIT, stats=speculation_stats):
+        self.parse = parse
+        self.prepare = prepare
+        self.stable_partials = stable_partials
+        self.limit = limit
+        self.stats = stats
+        self._lock = threading.Lock()
+        self._partials = []
+        self._current = None
+        self._started = 0
+
+    def on_partial(self, text):
+        """Receive a partial transcript from the STT stream"""
+        words = normalize(text).split()
+        with self._lock:
+            self._partials = (self._partials + [words])[-self.stable_partials:]
+            if len(self._partials) < self.stable_partials:
+                return
+
+            stable = []
+            for column in zip(*self._partials):
+                if any(word != column[0] for word in column):
+                    break
+                stable.append(column[0])
+            prefix = " ".join(stable)
+
+            if not prefix or (self._current is not None and self._current.key == prefix):
+                return
+            if self._started >= self.limit:
+                return
+
+            self._cancel_current()
+            self._current = _Speculation(prefix)
+            self._current.future = _pool.submit(self._run, self._current)
+            self._started += 1
+            self.stats.add(started=1)
+            logger.info("Speculatively parsing '%s'", prefix)
+
+    def _run(self, speculation):
+        if speculation.cancelled.is_set():
+            return None, {}
+        command = self.parse(speculation.text)
+        prepared = {}
+        if command is not None and self.prepare is not None and not speculation.cancelled.is_set():
+            try:
+                prepared = self.prepare(command)
+            except Exception as e:
+                logger.warning("Speculative preparation failed: %s", e)
+        return command, prepared
+
+    def _cancel_current(self):
+        if self._current is None:
+            return
+        self._current.cancelled.set()
+        self._current.future.cancel()
+        self.stats.add(cancelled=1)
+        self._current = None
+
+    def finalize(self, text, on_command=None):
+        """Return (command, prepared) for the final transcript.
+
+        `on_command` is passed to the parser when the transcript has to be
+        parsed again, so streamed commands can still run early.
+        """
+        with self._lock:
+            speculation = self._current
+            self._current = None
+            self._partials = []
+            self._started = 0
+        self.stats.add(utterances=1)
+
+        if speculation is not None and speculation.key == normalize(text):
+            try:
+                command, prepared = speculation.future.result()
+                self.stats.add(hits=1)
+                logger.info("Speculation hit for '%s'", text)
+                return command, prepared
+            except Exception as e:
+                logger.warning("Speculative parse failed, parsing again: %s", e)
+
+        self.stats.add(misses=1)
+        command = self.parse(text, on_command=on_command) if on_command else self.parse(text)
+
+        # A different transcript can still mean the same command ("pause" vs
+        # "pause the music"), in which case the prepared work is still valid
+        if speculation is not None:
+            speculation.cancelled.set()
+            if speculation.future.done() and not speculation.future.cancelled():
+                try:
+                    guessed, prepared = speculation.future.result()
+                    if command is not None and guessed == command:
+                        self.stats.add(reused=1)
+                        return command, prepared
+                except Exception:
+                    pass
+            else:
+                speculation.future.cancel()
+                self.stats.add(cancelled=1)
+
+        return command, {}
@@ -1,72 +1,110 @@
+import functools
 import os
-from logger import logger
-from datetime import datetime
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from elevenlabs.client import ElevenLabs
-import sounddevice as sd
+import time
 import numpy as np
-import tempfile
-import scipy.io.wavfile
-from io import BytesIO
+from logger import logger
+from audio_capture import get_capture_service
+from vad import VADConfig, record_until_silence
+from stt import get_stt_backend, get_stt_router, STT_FALLBACKS
+from tracing import tracer, traced
+
+# "vad" stops recording after trailing silence, "fixed" records FIXED_DURATION seconds
+RECORD_MODE = os.getenv("NOVA_RECORD_MODE", "vad")
+FIXED_DURATION = float(os.getenv("NOVA_FIXED_DURATION", "5"))
+
+def record_command(reader, sample_rate, preroll_samples=0, on_frame=None):
+    """Record a command using the configured recording mode"""
+    if RECORD_MODE == "fixed":
+        frame_samples = sample_rate // 50
+        audio = np.empty(int(FIXED_DURATION * sample_rate), dtype=np.int16)
+        for offset in range(0, len(audio), frame_samples):
+            frame = audio[offset:offset + frame_samples]
+            reader.read(len(frame), out=frame)
+            if on_frame is not None:
+                on_frame(frame)
+        return audio
+    return record_until_silence(
+        reader, sample_rate, VADConfig.from_env(),
+        on_frame=on_frame, preroll_samples=preroll_samples
+    )
+
+def transcribe(stream, backend, audio, sample_rate, fallbacks=()):
+    """Finish `stream`, hedged against the fallback backends given the whole recording"""
+    finishing = []
+    router = get_stt_router([backend.name] + [fallback.name for fallback in fallbacks])
+    deadline = time.perf_counter() + router.timeout
+
+    def remaining():
+        # Each attempt waits no longer than the router will, so its thread is freed
+        return max(0.0, deadline - time.perf_counter())
+
+    def finish():
+        finishing.append(True)
+        return stream.finish(remaining())
 
-# Get API keys from environment variables
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
+    def fallback_transcribe(fallback):
+        return fallback.transcribe(audio, sample_rate, timeout=remaining())
 
-if not OPENAI_API_KEY:
-    logger.error("OPENAI_API_KEY environment variable not set!")
-if not ELEVENLABS_API_KEY:
-    logger.error("ELEVENLABS_API_KEY environment variable not set!")
+    attempts = {backend.name: finish}
+    for fallback in fallbacks:
+        attempts[fallback.name] = functools.partial(fallback_transcribe, fallback)
+    try:
+        return router.call(attempts, is_good=lambda name, text: text is not None)
+    finally:
+        # The router skips a backend whose circuit is open; release its stream.
+        # One that is still finishing is left alone so its latency is recorded.
+        if not finishing:
+            stream.cancel()
 
-# Initialize ElevenLabs client
-client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+@traced("listen")
+def listen_to_command(wake_position=None, capture=None, on_partial=None, backend=None, fallbacks=None):
+    """Record a command from the shared capture stream and transcribe it.
 
-def listen_to_command():
+    When `wake_position` is given, recording starts a short pre-roll before it
+    so words spoken right after the wake word are kept. Audio is streamed to
+    the STT backend while recording, and `on_partial` receives any partial
+    transcripts the backend produces. The final transcript is hedged against
+    `fallbacks` (by default the backends in NOVA_STT_FALLBACK).
+    """
     logger.info("Starting command listening process")
+    stream = None
     try:
-        # Record audio directly using sounddevice
-        logger.info("Recording audio...")
-        print("🎙️ Listening...")
+        capture = capture or get_capture_service()
+        if wake_position is None:
+            wake_position = capture.position
+        start = capture.preroll_position(wake_position)
+        reader = capture.reader(start)
 
-        # Record 5 seconds of audio at 44.1kHz
-        duration = 5
-        fs = 44100
-        audio = sd.rec(int(duration * fs), samplerate=fs, channels=1, dtype='int16')
-        sd.wait()
+        backend = backend or get_stt_backend()
+        if fallbacks is None:
+            fallbacks = [get_stt_backend(name) for name in STT_FALLBACKS if name != backend.name]
+        fs = capture.sample_rate
+        stream = backend.open_stream(fs, on_partial=on_partial)
 
-        # Save audio to a temporary WAV file
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-            scipy.io.wavfile.write(temp_file.name, fs, audio)
+        # Record audio from the already-open microphone, transcribing as we go
+        logger.info("Recording audio...")
+        print("🎙️ Listening...")
 
-            # Read the WAV file and create a BytesIO object
-            with open(temp_file.name, 'rb') as wav_file:
-                audio_data = BytesIO(wav_file.read())
+        with tracer.span("record"):
+            audio = record_command(reader, fs, preroll_samples=wake_position - start, on_frame=stream.push)
+        if len(audio) == 0:
+            logger.info("No speech recorded")
+            stream.cancel()
+            return None
 
-        # Convert speech to text using ElevenLabs
-        logger.info("Transcribing with ElevenLabs...")
+        logger.info("Waiting for final transcript from %s...", backend.name)
         print("📝 Transcribing...")
 
-        transcription = client.speech_to_text.convert(
-            file=audio_data,
-            model_id="scribe_v1",  # Model to use
-            tag_audio_events=True,  # Tag audio events like laughter, applause, etc.
-            language_code="eng",    # Language of the audio file
-            diarize=True           # Whether to annotate who is speaking
-        )
+        # Time from the end of speech to the final transcript
+        with tracer.span("stt"):
+            transcription = transcribe(stream, backend, audio, fs, fallbacks)
 
         print(f"🗣️ Transcription: {transcription}")
-        logger.info(f"Command processing completed - Transcription: '{transcription}'")
+        logger.info("Command processing completed - Transcription: '%s'", transcription)
         return transcription
 
     except Exception as e:
-        logger.error(f"Error in listen_to_command: {str(e)}")
+        logger.error("Error in listen_to_command: %s", e)
+        if stream is not None:
+            stream.cancel()
         return None
-    finally:
-        # Clean up the temporary file
-        if 'temp_file' in locals():
-            try:
-                os.unlink(temp_file.name)
-                logger.info(f"Cleaned up temporary file: {temp_file.name}")
-            except Exception as e:
-                logger.error(f"Error cleaning up temporary file: {str(e)}")
@@ -0,0 +1,114 @@
+"""Startup timing: per-module import cost and an explicit warm-up phase.
+
+Import this module before anything else so the imports that follow are
+timed.
+"""
+import importlib.abc
+import sys
+import threading
+import time
+from concurrent.futures import Future, wait
+
+_started = time.perf_counter()
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """Times each top-level import, including everything it pulls in"""
+
+    def __init__(self):
+        self.times = {}
+        self._local = threading.local()
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        # Built-in and frozen modules are loaded by a shared class; leave those alone
+        if spec.loader is None or isinstance(spec.loader, type) or not hasattr(spec.loader, "exec_module"):
+            return spec
+
+        exec_module = spec.loader.exec_module
+        local = self._local
+
+        def timed_exec_module(module):
+            depth = getattr(local, "depth", 0)
+            local.depth = depth + 1
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                local.depth = depth
+                # Only the outermost import is recorded; nested ones are part of it
+                if depth == 0:
+                    self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+        spec.loader.exec_module = timed_exec_module
+        return spec
+
+
+import_timer = ImportTimer()
+import_timer.install()
+
+warmup_times = {}
+
+
+def warm_up(steps, timeout=60):
+    """Run the named warm-up callables in parallel and time each one.
+
+    A failing step is logged and skipped; whatever it was preparing is then
+    built lazily on first use instead. Startup waits at most `timeout`
+    seconds in total: steps still running by then are logged and left to
+    finish in the background.
+    """
+    from logger import logger
+
+    def run(name, step, future):
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.warning("Warm-up step '%s' failed: %s", name, e)
+        finally:
+            warmup_times[name] = time.perf_counter() - start
+            future.set_result(None)
+
+    # Daemon threads rather than an executor, so a stuck step can neither
+    # hold up startup past the timeout nor keep the process from exiting
+    futures = {}
+    for name, step in steps.items():
+        future = Future()
+        futures[future] = name
+        threading.Thread(target=run, args=(name, step, future), name=f"warmup-{name}", daemon=True).start()
+
+    _, pending = wait(futures, timeout)
+    for future in pending:
+        logger.warning("Warm-up step '%s' is still running after %.1fs, continuing without it",
+                       futures[future], timeout)
+
+
+def report(limit=10):
+    """Log import and warm-up costs and how long startup took overall"""
+    from logger import logger
+
+    import_timer.uninstall()
+    imports = sorted(import_timer.times.items(), key=lambda item: item[1], reverse=True)
+    logger.info("Slowest imports: %s", ", ".join(f"{name} {seconds:.3f}s" for name, seconds in imports[:limit]))
+    if warmup_times:
+        logger.info("Warm-up: %s", ", ".join(
+            f"{name} {seconds:.3f}s" for name, seconds in sorted(warmup_times.items(), key=lambda item: -item[1])
+        ))
+    logger.info("Ready %.2fs after start", time.perf_counter() - _started)
+    return {"imports": dict(imports), "warmup": dict(warmup_times), "total": time.perf_counter() - _started}
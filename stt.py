@@ -0,0 +1,401 @@
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from dotenv import load_dotenv
+from logger import logger
+from registry import LazyRegistry
+from audio_encoding import encode_audio, resample, upload_stats, TARGET_SAMPLE_RATE
+
+load_dotenv()
+
+STT_BACKEND = os.getenv("NOVA_STT_BACKEND", "elevenlabs")
+# Comma-separated backends sent the whole recording when the main one is slow or failing
+STT_FALLBACKS = [name.strip() for name in os.getenv("NOVA_STT_FALLBACK", "").split(",") if name.strip()]
+# Seconds after the end of speech before a fallback is asked too, until the
+# main backend has enough history for a p95
+STT_HEDGE_DELAY = float(os.getenv("NOVA_STT_HEDGE_DELAY", "2"))
+# Seconds after the end of speech before giving up on every backend
+STT_TIMEOUT = float(os.getenv("NOVA_STT_TIMEOUT", "15"))
+
+_END = object()
+
+
+class STTStream:
+    """Audio for one utterance, transcribed while it is still being pushed.
+
+    Chunks are handed to a worker thread so `push` never blocks the capture
+    loop. Subclasses implement `_consume` for each chunk and `_finalize`
+    to produce the final transcript, and may call `_emit_partial` whenever
+    they have a better guess.
+    """
+
+    def __init__(self, sample_rate, on_partial=None):
+        self.sample_rate = sample_rate
+        self.on_partial = on_partial
+        self._chunks = queue.Queue()
+        self._partial = None
+        self._final = None
+        self._error = None
+        self._cancelled = False
+        self._done = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="stt-stream", daemon=True)
+        self._worker.start()
+
+    def push(self, chunk):
+        """Queue a chunk of int16 audio for transcription"""
+        if not self._cancelled:
+            self._chunks.put(np.array(chunk, dtype=np.int16, copy=True))
+
+    def partial(self):
+        """Latest partial transcript, or None if there isn't one yet"""
+        return self._partial
+
+    def finish(self, timeout=None):
+        """Signal the end of audio and wait for the final transcript"""
+        self._chunks.put(_END)
+        if not self._done.wait(timeout):
+            raise TimeoutError("Timed out waiting for transcript")
+        if self._error is not None:
+            raise self._error
+        return self._final
+
+    def cancel(self):
+        """Abandon the stream; any pending result is discarded"""
+        self._cancelled = True
+        self._chunks.put(_END)
+
+    def _emit_partial(self, text):
+        if text == self._partial or self._cancelled:
+            return
+        self._partial = text
+        if self.on_partial is not None:
+            try:
+                self.on_partial(text)
+            except Exception as e:
+                logger.error("Error in partial transcript callback: %s", e, exc_info=True)
+
+    def _run(self):
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is _END:
+                    break
+                self._consume(chunk)
+            if not self._cancelled:
+                self._final = self._finalize()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done.set()
+
+    def _consume(self, chunk):
+        raise NotImplementedError
+
+    def _finalize(self):
+        raise NotImplementedError
+
+
+class STTBackend:
+    """Factory for transcription streams"""
+    name = None
+
+    def open_stream(self, sample_rate, on_partial=None):
+        raise NotImplementedError
+
+    def transcribe(self, audio, sample_rate, timeout=None):
+        """Transcribe a complete clip in one call, waiting at most `timeout` seconds"""
+        stream = self.open_stream(sample_rate)
+        stream.push(audio)
+        try:
+            return stream.finish(timeout)
+        except TimeoutError:
+            stream.cancel()
+            raise
+
+
+class _BatchStream(STTStream):
+    """Buffers audio and uploads it once the utterance ends"""
+
+    def __init__(self, backend, sample_rate, on_partial=None):
+        self._backend = backend
+        self._buffer = []
+        super().__init__(sample_rate, on_partial)
+
+    def _consume(self, chunk):
+        self._buffer.append(chunk)
+
+    def _finalize(self):
+        audio = np.concatenate(self._buffer) if self._buffer else np.zeros(0, dtype=np.int16)
+        return self._backend.transcribe_clip(audio, self.sample_rate)
+
+
+class ElevenLabsBackend(STTBackend):
+    """ElevenLabs batch speech-to-text behind the streaming interface"""
+    name = "elevenlabs"
+
+    def __init__(self, api_key=None, model_id="scribe_v1"):
+        from elevenlabs.client import ElevenLabs
+
+        api_key = api_key or os.getenv("ELEVENLABS_API_KEY")
+        if not api_key:
+            logger.error("ELEVENLABS_API_KEY environment variable not set!")
+        self.client = ElevenLabs(api_key=api_key)
+        self.model_id = model_id
+
+    def open_stream(self, sample_rate, on_partial=None):
+        return _BatchStream(self, sample_rate, on_partial)
+
+    def transcribe_clip(self, audio, sample_rate):
+        # Resample and encode in memory for upload
+        encoded = encode_audio(audio, sample_rate)
+        upload_stats.record(encoded)
+
+        logger.info("Transcribing with ElevenLabs...")
+        transcription = self.client.speech_to_text.convert(
+            file=encoded.as_file(),
+            model_id=self.model_id,  # Model to use
+            tag_audio_events=True,  # Tag audio events like laughter, applause, etc.
+            language_code="eng",    # Language of the audio file
+            diarize=True           # Whether to annotate who is speaking
+        )
+        return getattr(transcription, "text", transcription)
+
+
+class _WhisperStream(_BatchStream):
+    """Buffers audio and optionally re-decodes it periodically for partials"""
+
+    def __init__(self, backend, sample_rate, on_partial=None):
+        self._pending_partial = None
+        self._since_partial = 0
+        super().__init__(backend, sample_rate, on_partial)
+
+    def _consume(self, chunk):
+        super()._consume(chunk)
+        interval = self._backend.partial_interval
+        if not interval:
+            return
+
+        self._since_partial += len(chunk)
+        busy = self._pending_partial is not None and not self._pending_partial.done()
+        if self._since_partial >= interval * self.sample_rate and not busy:
+            self._since_partial = 0
+            audio = np.concatenate(self._buffer)
+            self._pending_partial = self._backend.submit(audio, self.sample_rate)
+            self._pending_partial.add_done_callback(self._on_partial_done)
+
+    def _on_partial_done(self, future):
+        if future.exception() is None:
+            self._emit_partial(future.result())
+
+
+def _quantize_int8(model):
+    """Dynamically quantize a Whisper model's linear layers to int8.
+
+    Whisper builds its layers from its own `Linear` subclass, which
+    quantize_dynamic neither matches nor knows how to convert, so each one
+    is first swapped for a plain torch.nn.Linear sharing its weights.
+    """
+    import torch
+
+    swaps = [
+        (parent, name, child)
+        for parent in model.modules()
+        for name, child in parent.named_children()
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear
+    ]
+    for parent, name, child in swaps:
+        plain = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+        plain.weight = child.weight
+        plain.bias = child.bias
+        setattr(parent, name, plain)
+
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    converted = sum(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in model.modules())
+    logger.info("Quantized %s linear layers to int8", converted)
+    if not converted:
+        logger.warning("NOVA_WHISPER_QUANTIZE=int8 found no linear layers to convert")
+    return model
+
+
+class WhisperBackend(STTBackend):
+    """Local Whisper model kept warm on a dedicated inference thread.
+
+    The model is loaded once when the backend is created and all decodes run
+    on a single worker thread, so callers never pay model load time and
+    inference never competes with itself for CPU.
+    """
+    name = "whisper"
+
+    def __init__(self, model_name=None, threads=None, quantize=None, partial_interval=None):
+        self.model_name = model_name or os.getenv("NOVA_WHISPER_MODEL", "base.en")
+        self.threads = int(threads or os.getenv("NOVA_WHISPER_THREADS", "0"))
+        # "none", "int8" (dynamic quantization on CPU) or "fp16" (GPU only)
+        self.quantize = quantize or os.getenv("NOVA_WHISPER_QUANTIZE", "none")
+        # Seconds of new audio between partial decodes; 0 disables partials
+        if partial_interval is None:
+            partial_interval = float(os.getenv("NOVA_WHISPER_PARTIAL_INTERVAL", "0"))
+        self.partial_interval = partial_interval
+
+        self._jobs = queue.Queue()
+        self._ready = threading.Event()
+        self._load_error = None
+        self._worker = threading.Thread(target=self._run, name="whisper-worker", daemon=True)
+        self._worker.start()
+
+    def _load(self):
+        import torch
+        import whisper
+
+        if self.threads > 0:
+            torch.set_num_threads(self.threads)
+
+        logger.info("Loading Whisper model '%s'...", self.model_name)
+        start = time.perf_counter()
+        model = whisper.load_model(self.model_name)
+        if self.quantize == "int8":
+            model = _quantize_int8(model)
+
+        # Run one decode so lazy initialisation happens now, not on the first command
+        model.transcribe(np.zeros(TARGET_SAMPLE_RATE, dtype=np.float32), fp16=self.quantize == "fp16")
+        logger.info("Whisper model ready in %.2fs", time.perf_counter() - start)
+        return model
+
+    def _run(self):
+        try:
+            model = self._load()
+        except Exception as e:
+            logger.error("Error loading Whisper model: %s", e, exc_info=True)
+            self._load_error = e
+            model = None
+        self._ready.set()
+
+        fp16 = self.quantize == "fp16"
+        while True:
+            audio, future = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            if model is None:
+                future.set_exception(self._load_error)
+                continue
+            try:
+                result = model.transcribe(audio, language="en", fp16=fp16)
+                future.set_result(result["text"].strip())
+            except Exception as e:
+                future.set_exception(e)
+
+    def wait_until_ready(self, timeout=None):
+        """Block until the model has loaded; raises if loading failed"""
+        self._ready.wait(timeout)
+        if self._load_error is not None:
+            raise self._load_error
+
+    def submit(self, audio, sample_rate):
+        """Queue a decode on the worker thread and return a Future for the text"""
+        future = Future()
+        if self._load_error is not None:
+            future.set_exception(self._load_error)
+            return future
+        audio = resample(audio, sample_rate).astype(np.float32) / 32768.0
+        self._jobs.put((audio, future))
+        return future
+
+    def open_stream(self, sample_rate, on_partial=None):
+        return _WhisperStream(self, sample_rate, on_partial)
+
+    def transcribe_clip(self, audio, sample_rate):
+        logger.info("Transcribing with local Whisper...")
+        return self.submit(audio, sample_rate).result()
+
+
+class _FakeStream(STTStream):
+    def __init__(self, backend, sample_rate, on_partial=None):
+        self._backend = backend
+        self._pushed = 0
+        super().__init__(sample_rate, on_partial)
+
+    def _consume(self, chunk):
+        self._pushed += len(chunk)
+        if self._backend.chunk_delay:
+            time.sleep(self._backend.chunk_delay)
+
+        # Reveal the script word by word as audio arrives
+        words = self._backend.transcript.split()
+        heard = self._pushed / self.sample_rate
+        count = min(len(words), int(heard / self._backend.seconds_per_word))
+        if count:
+            self._emit_partial(" ".join(words[:count]))
+
+    def _finalize(self):
+        return self._backend.final()
+
+
+class FakeSTTBackend(STTBackend):
+    """Returns a scripted transcript; for tests and offline development.
+
+    `slow_rate` of the final transcripts take `slow_delay` seconds longer
+    and `error_rate` of them fail, to exercise the provider router.
+    """
+    name = "fake"
+
+    def __init__(self, transcript=None, seconds_per_word=0.3, chunk_delay=0.0, final_delay=0.0,
+                 slow_rate=0.0, slow_delay=0.0, error_rate=0.0, seed=None, name=None):
+        self.transcript = transcript if transcript is not None else os.getenv("NOVA_FAKE_TRANSCRIPT", "")
+        self.seconds_per_word = seconds_per_word
+        self.chunk_delay = chunk_delay
+        self.final_delay = final_delay
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        if name is not None:
+            self.name = name
+
+    def final(self):
+        delay = self.final_delay
+        if self.slow_rate and self._random.random() < self.slow_rate:
+            delay += self.slow_delay
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise RuntimeError("Injected STT failure")
+        return self.transcript
+
+    def open_stream(self, sample_rate, on_partial=None):
+        return _FakeStream(self, sample_rate, on_partial)
+
+
+# Backend SDKs and models are imported by the backends themselves, on creation
+backends = LazyRegistry("STT backend", {
+    "elevenlabs": ElevenLabsBackend,
+    "whisper": WhisperBackend,
+    "fake": FakeSTTBackend,
+})
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_stt_backend(name=None):
+    """Return the shared instance of the named (or configured) STT backend"""
+    name = name or STT_BACKEND
+    with _instances_lock:
+        if name not in _instances:
+            _instances[name] = backends.resolve(name)()
+        return _instances[name]
+
+
+_routers = {}
+
+
+def get_stt_router(names):
+    """Shared provider router over the named backends, in order of preference"""
+    key = tuple(names)
+    with _instances_lock:
+        if key not in _routers:
+            from providers import ProviderRouter
+            _routers[key] = ProviderRouter("stt", key, STT_HEDGE_DELAY, STT_TIMEOUT)
+        return _routers[key]
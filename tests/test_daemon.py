@@ -0,0 +1,61 @@
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from daemon import CommandServer, CommandService  # noqa: E402
+
+
+def broken_parse(text):
+    raise RuntimeError("parser crashed")
+
+
+def never_dispatch(commands, prepared):
+    raise AssertionError("nothing should be dispatched")
+
+
+def post(server, body):
+    request = urllib.request.Request(
+        server.address + "/commands", data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_a_parser_failure_marks_the_request_failed():
+    service = CommandService(broken_parse, never_dispatch)
+
+    with pytest.raises(RuntimeError):
+        service.submit("pause spotify")
+
+    record = service.get(1)
+    assert record["status"] == "failed"
+    assert set(record["latency"]) == {"queue", "parse", "total"}
+    stats = service.stats()
+    assert stats["requests"]["failed"] == 1
+    assert stats["latency"]["total"]["count"] == 1
+
+
+def test_text_must_be_a_non_empty_string():
+    service = CommandService(broken_parse, never_dispatch)
+    server = CommandServer(service, port=0).start()
+    try:
+        for text in (5, None, "", "   ", ["pause"]):
+            status, body = post(server, {"text": text})
+            assert status == 400, text
+            assert "text" in body["error"]
+
+        status, body = post(server, {"text": "pause spotify"})
+        assert status == 500
+        assert service.get(1)["status"] == "failed"
+    finally:
+        server.stop()
@@ -0,0 +1,122 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import executor  # noqa: E402
+from control_bridge import FakeControlBackend, set_control_backend  # noqa: E402
+from dispatch import Dispatcher, SpotifyBackend, VolumeBackend  # noqa: E402
+from llm_parser import Command  # noqa: E402
+from player_state import Coalescer, PlayerState  # noqa: E402
+
+
+class GatedBackend(FakeControlBackend):
+    """Fake backend whose calls wait for `release` before they run"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def submit(self, ops):
+        self.entered.set()
+        self.release.wait(5)
+        return super().submit(ops)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_commands_arriving_during_a_flush_are_merged():
+    backend = GatedBackend(volume=0)
+    state = PlayerState()
+    state.set_known_volume(0)
+    coalescer = Coalescer(lambda: backend, state)
+
+    threads = [threading.Thread(target=coalescer.volume_delta, args=(10,))]
+    threads[0].start()
+    backend.entered.wait(5)
+    for _ in range(4):
+        threads.append(threading.Thread(target=coalescer.volume_delta, args=(10,)))
+        threads[-1].start()
+    wait_for(lambda: coalescer.merged == 3)
+    backend.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert [[op.arg for op in call] for call in backend.calls] == [[10], [50]]
+    assert coalescer.flushes == 2
+    assert state.known_volume() == 50
+
+
+def volume_dispatcher(backend):
+    set_control_backend(backend)
+    executor.player_state.set_known_volume(backend.volume)
+    dispatcher = Dispatcher()
+    dispatcher.register(VolumeBackend(1))
+    return dispatcher
+
+
+def test_a_burst_through_the_dispatcher_does_not_wait_for_a_window():
+    backend = FakeControlBackend(volume=0)
+    dispatcher = volume_dispatcher(backend)
+
+    start = time.perf_counter()
+    futures = [dispatcher.dispatch(Command(action="volume_up")) for _ in range(10)]
+    results = [future.result(5) for future in futures]
+    elapsed = time.perf_counter() - start
+
+    assert results == [True] * 10
+    assert backend.volume == 100
+    assert elapsed < 0.5
+
+
+def test_queued_volume_commands_run_as_one_call():
+    backend = FakeControlBackend(volume=30)
+    dispatcher = volume_dispatcher(backend)
+    volume = dispatcher.backends["volume"]
+    release = threading.Event()
+    blocker = volume.submit(release.wait, 5)
+
+    commands = [Command(action="volume_up")] * 4 + [Command(action="volume_down")]
+    futures = [dispatcher.dispatch(command) for command in commands]
+    release.set()
+
+    assert blocker.result(5) is True
+    assert [future.result(5) for future in futures] == [True] * 5
+    assert [[(op.action, op.arg) for op in call] for call in backend.calls] == [[("set_volume", 60)]]
+    assert volume.stats()["completed"] == 6
+
+
+def test_queued_commands_keep_their_order_around_other_work():
+    backend = FakeControlBackend()
+    set_control_backend(backend)
+    dispatcher = Dispatcher()
+    dispatcher.register(SpotifyBackend(1), "spotify")
+    spotify = dispatcher.backends["spotify"]
+    release = threading.Event()
+    seen = []
+    spotify.submit(release.wait, 5)
+
+    futures = [
+        dispatcher.dispatch(Command(action="play", platform="spotify", song="one")),
+        dispatcher.dispatch(Command(action="pause", platform="spotify")),
+        spotify.submit(lambda: seen.append(len(backend.ops))),
+        dispatcher.dispatch(Command(action="resume", platform="spotify")),
+    ]
+    cancelled = dispatcher.dispatch(Command(action="play", platform="spotify", song="two"))
+    cancelled.cancel()
+    release.set()
+
+    assert [future.result(5) for future in futures] == [True] * 4
+    assert [(op.action, op.arg) for op in backend.ops] == [("play", "one"), ("pause", None), ("resume", None)]
+    # The play and pause went out together, before the other work ran
+    assert len(backend.calls) == 2
+    assert seen == [2]
+    assert spotify.stats()["depth"] == 0
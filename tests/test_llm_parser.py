@@ -0,0 +1,130 @@
+import os
+import sys
+import threading
+
+import pytest
+from pydantic import ValidationError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_parser  # noqa: E402
+from llm_parser import Command, CommandList, CommandStream  # noqa: E402
+from providers import ProviderError, ProviderRouter  # noqa: E402
+
+REPLY = (
+    '{"commands":['
+    '{"action":"play","platform":"youtube","song":"say \\"hi\\" {live} [remix], \\\\ ok"},'
+    '{"action":"set_volume","volume_level":40},'
+    '{"action":"pause"}'
+    ']}'
+)
+
+
+def stream_reply(text, size):
+    emitted = []
+    stream = CommandStream(lambda index, command: emitted.append((index, command, len(stream.text))))
+    for start in range(0, len(text), size):
+        stream.feed(text[start:start + size])
+    return stream, emitted
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, len(REPLY)])
+def test_chunked_reply_with_braces_and_quotes_in_strings(size):
+    stream, emitted = stream_reply(REPLY, size)
+
+    song = 'say "hi" {live} [remix], \\ ok'
+    expected = [
+        Command(action="play", platform="youtube", song=song),
+        Command(action="set_volume", volume_level=40),
+        Command(action="pause"),
+    ]
+    assert [command for _, command, _ in emitted] == expected
+    assert [index for index, _, _ in emitted] == [0, 1, 2]
+    assert stream.result() == expected
+
+
+def test_commands_are_handed_out_before_their_object_closes():
+    _, emitted = stream_reply(REPLY, 1)
+    play_end = REPLY.index("ok\"") + len("ok\"")
+    assert emitted[0][2] == play_end
+    # pause has no platform, so it waits for its closing brace
+    assert REPLY[emitted[2][2] - 1] == "}"
+
+
+def test_a_truncated_reply_keeps_the_finished_commands():
+    cut = REPLY.index('{"action":"pause"') + len('{"action":"pa')
+    stream, emitted = stream_reply(REPLY[:cut], 4)
+
+    assert len(emitted) == 2
+    assert stream.result() == [command for _, command, _ in emitted]
+
+
+def test_a_reply_truncated_before_any_command_raises():
+    stream, emitted = stream_reply(REPLY[:30], 4)
+    assert emitted == []
+    with pytest.raises(ValidationError):
+        stream.result()
+
+
+def ask_endpoints(monkeypatch, answers, hedge_delay=5.0):
+    """Run _ask_endpoints against fake endpoints; `answers` maps name -> fake _ask"""
+    monkeypatch.setattr(llm_parser, "llm_endpoints", lambda: {name: None for name in answers})
+    monkeypatch.setattr(llm_parser, "_ask", lambda name, text, on_command: answers[name](on_command))
+    monkeypatch.setattr(llm_parser, "_router", ProviderRouter("llm", list(answers), hedge_delay, 2.0))
+    dispatched = []
+    result = llm_parser._ask_endpoints("play one then pause", lambda index, command: dispatched.append((index, command)))
+    return result, dispatched
+
+
+PLAY = Command(action="play", platform="spotify", song="one")
+PAUSE = Command(action="pause", platform="spotify")
+
+
+def claim_then_fail(on_command):
+    on_command(0, PLAY)
+    raise RuntimeError("connection reset")
+
+
+def test_an_agreeing_second_endpoint_is_accepted_after_early_dispatch(monkeypatch):
+    def secondary(on_command):
+        # Its own commands aren't handed out; the primary claimed the turn
+        on_command(0, PLAY)
+        on_command(1, PAUSE)
+        return CommandList(commands=[PLAY, PAUSE])
+
+    result, dispatched = ask_endpoints(monkeypatch, {"primary": claim_then_fail, "secondary": secondary})
+
+    assert result.commands == [PLAY, PAUSE]
+    assert dispatched == [(0, PLAY)]
+
+
+def test_a_disagreeing_second_endpoint_is_not_used_after_early_dispatch(monkeypatch):
+    other = Command(action="play", platform="youtube", song="one")
+
+    def secondary(on_command):
+        return CommandList(commands=[other, PAUSE])
+
+    with pytest.raises(ProviderError):
+        ask_endpoints(monkeypatch, {"primary": claim_then_fail, "secondary": secondary})
+
+
+def test_no_commands_are_handed_out_after_an_answer_is_accepted(monkeypatch):
+    accepted = threading.Event()
+    finished = threading.Event()
+
+    def primary(on_command):
+        # Slow enough to be hedged; starts streaming after the secondary won
+        accepted.wait(2)
+        on_command(0, PLAY)
+        finished.set()
+        return CommandList(commands=[PLAY])
+
+    def secondary(on_command):
+        return CommandList(commands=[PAUSE])
+
+    result, dispatched = ask_endpoints(monkeypatch, {"primary": primary, "secondary": secondary}, hedge_delay=0.01)
+    accepted.set()
+    finished.wait(2)
+
+    assert result.commands == [PAUSE]
+    assert dispatched == []
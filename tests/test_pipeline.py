@@ -0,0 +1,78 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import Pipeline  # noqa: E402
+
+
+def run_pipeline(transcripts, parse, turns, **kwargs):
+    """Drive a Pipeline over `transcripts` until `turns` turns are done"""
+    pending = list(transcripts)
+    executed = []
+    done = []
+    finished = threading.Event()
+
+    def detect_wake_word():
+        if not pending:
+            finished.wait()
+        return 0
+
+    def listen(position, on_partial=None):
+        return pending.pop(0)
+
+    def execute(commands, prepared):
+        executed.append(list(commands))
+        return True
+
+    def on_done(turn, ok):
+        done.append(turn)
+        if len(done) == turns:
+            finished.set()
+
+    async def drive():
+        pipeline = Pipeline(detect_wake_word, listen, parse, execute,
+                            on_feedback=lambda message: None, on_done=on_done, **kwargs)
+        task = asyncio.ensure_future(pipeline.run())
+        await asyncio.get_running_loop().run_in_executor(None, finished.wait, 5)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(drive())
+    return executed
+
+
+def slow_play_parse(text, on_command=None):
+    if text.startswith("play"):
+        time.sleep(0.3)
+        return [text + " (llm)"]
+    return [text]
+
+
+def test_turns_execute_in_the_order_they_were_heard():
+    executed = run_pipeline(["play something slow", "pause"], slow_play_parse, 2,
+                            parse_concurrency=2, early_dispatch=False)
+    assert executed == [["play something slow (llm)"], ["pause"]]
+
+
+def test_early_dispatch_does_not_overtake_an_earlier_turn():
+    def parse(text, on_command=None):
+        commands = slow_play_parse(text)
+        for index, command in enumerate(commands):
+            on_command(index, command)
+        return commands
+
+    executed = run_pipeline(["play something slow", "pause"], parse, 2, parse_concurrency=2)
+    assert executed == [["play something slow (llm)"], ["pause"]]
+
+
+def test_unparsed_turn_does_not_hold_up_later_turns():
+    def parse(text, on_command=None):
+        return [] if text == "mumble" else slow_play_parse(text)
+
+    executed = run_pipeline(["mumble", "play it", "pause"], parse, 3,
+                            parse_concurrency=2, early_dispatch=False)
+    assert executed == [["play it (llm)"], ["pause"]]
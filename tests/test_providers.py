@@ -0,0 +1,170 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from providers import CircuitBreaker, ProviderError, ProviderRouter  # noqa: E402
+
+
+class FakeProvider:
+    """Answers `result` after `delay` seconds, or raises `error`"""
+
+    def __init__(self, result="ok", delay=0.0, error=None):
+        self.result = result
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.finished = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        try:
+            time.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            return self.result
+        finally:
+            self.finished.set()
+
+
+def make_router(names=("primary", "secondary"), hedge_delay=1.0, timeout=2.0, **kwargs):
+    return ProviderRouter("test", names, hedge_delay, timeout, **kwargs)
+
+
+def test_a_slow_provider_is_hedged_and_the_first_answer_wins():
+    primary = FakeProvider("slow", delay=0.5)
+    secondary = FakeProvider("fast")
+    router = make_router(hedge_delay=0.05)
+
+    assert router.call({"primary": primary, "secondary": secondary}) == "fast"
+    stats = router.stats()
+    assert stats["secondary"]["hedges"] == 1
+    assert stats["secondary"]["wins"] == 1
+    # The loser's answer still counts towards its latency history
+    primary.finished.wait(2)
+    time.sleep(0.05)
+    assert router.stats()["primary"]["calls"] == 1
+
+
+def test_a_fast_provider_is_not_hedged():
+    primary = FakeProvider("ok")
+    secondary = FakeProvider("other")
+    router = make_router(hedge_delay=0.2)
+
+    assert router.call({"primary": primary, "secondary": secondary}) == "ok"
+    assert secondary.calls == 0
+
+
+def test_failures_fall_over_in_preference_order_without_waiting():
+    order = []
+
+    def provider(name, error=None):
+        def call():
+            order.append(name)
+            if error is not None:
+                raise error
+            return name
+        return call
+
+    router = make_router(names=("a", "b", "c"), hedge_delay=5.0)
+    start = time.perf_counter()
+    # Attempts are tried in the router's order, not the dict's
+    result = router.call({
+        "c": provider("c"),
+        "b": provider("b", RuntimeError("down")),
+        "a": provider("a", RuntimeError("down")),
+    })
+
+    assert result == "c"
+    assert order == ["a", "b", "c"]
+    assert time.perf_counter() - start < 1.0
+
+
+def test_an_unusable_answer_falls_over():
+    router = make_router(hedge_delay=5.0)
+    result = router.call(
+        {"primary": FakeProvider(None), "secondary": FakeProvider("text")},
+        is_good=lambda name, result: result is not None,
+    )
+    assert result == "text"
+
+
+def test_every_provider_failing_raises():
+    router = make_router()
+    with pytest.raises(ProviderError):
+        router.call({
+            "primary": FakeProvider(error=RuntimeError("down")),
+            "secondary": FakeProvider(error=RuntimeError("down")),
+        })
+
+
+def test_breaker_opens_then_half_opens_and_closes():
+    breaker = CircuitBreaker(failures=2, cooldown=0.1)
+    assert breaker.state == "closed"
+
+    assert breaker.record_failure() is False
+    assert breaker.record_failure() is True
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.15)
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    # A failure while half-open reopens it straight away
+    assert breaker.record_failure() is True
+    assert breaker.state == "open"
+
+    time.sleep(0.15)
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.trips == 2
+
+
+def test_a_provider_with_an_open_circuit_is_skipped():
+    primary = FakeProvider(error=RuntimeError("down"))
+    secondary = FakeProvider("ok")
+    router = make_router(hedge_delay=5.0)
+    attempts = {"primary": primary, "secondary": secondary}
+    router._breakers["primary"] = CircuitBreaker(failures=2, cooldown=60)
+
+    for _ in range(2):
+        assert router.call(attempts) == "ok"
+    primary.finished.wait(1)
+    time.sleep(0.05)
+    assert router.stats()["primary"]["breaker"] == "open"
+
+    assert router.call(attempts) == "ok"
+    assert primary.calls == 2
+
+
+def test_a_timed_out_call_that_returns_later_does_not_close_the_circuit():
+    slow = FakeProvider("late", delay=0.3)
+    router = make_router(names=("only",), timeout=0.05)
+    router._breakers["only"] = CircuitBreaker(failures=1, cooldown=60)
+
+    with pytest.raises(ProviderError):
+        router.call({"only": slow})
+    assert router.stats()["only"]["breaker"] == "open"
+
+    slow.finished.wait(2)
+    time.sleep(0.05)
+    stats = router.stats()
+    assert stats["only"]["breaker"] == "open"
+    assert stats["only"]["timeouts"] == 1
+    assert stats["only"]["calls"] == 0
+
+
+def test_attempts_that_have_not_started_are_cancelled():
+    blocker = FakeProvider("slow", delay=0.3)
+    queued = FakeProvider("never")
+    router = make_router(names=("a", "b"), hedge_delay=0.01, timeout=0.1, workers=1)
+
+    with pytest.raises(ProviderError):
+        router.call({"a": blocker, "b": queued})
+    blocker.finished.wait(2)
+    time.sleep(0.05)
+    assert queued.calls == 0
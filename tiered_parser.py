@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional
+from dotenv import load_dotenv
+from logger import logger
+from tracing import tracer
+from registry import LazyRegistry
+import command_parser
+from intent_model import get_intent_model, INTENT_CONFIDENCE
+from llm_parser import Command
+
+load_dotenv()
+
+# Rule-based results below this confidence are escalated to the LLM
+LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("NOVA_LOCAL_CONFIDENCE", "0.85"))
+# Parser asked when the rules are unsure; "none" runs on the rules alone
+FALLBACK_PARSER = os.getenv("NOVA_FALLBACK_PARSER", "llm")
+
+fallback_parsers = LazyRegistry("fallback parser", {
+    "llm": "llm_parser:parse_commands",
+    "none": None,
+})
+
+
+@dataclass
+class ParseResult:
+    """Parsed commands together with how they were obtained"""
+    commands: List[Command]
+    tier: str
+    confidence: float
+    latency: float
+
+    @property
+    def command(self) -> Optional[Command]:
+        return self.commands[0] if self.commands else None
+
+
+class TierStats:
+    """Counts of which tier answered each parse"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def record(self, tier):
+        with self._lock:
+            self.counts[tier] += 1
+
+    def summary(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+tier_stats = TierStats()
+
+
+def parse_local(text):
+    """Run the rule-based parser; returns (list of Command, confidence)"""
+    results, confidence = command_parser.parse_commands_with_confidence(text)
+    try:
+        return [Command(**result) for result in results], confidence
+    except Exception as e:
+        logger.debug("Rule-based result rejected by schema: %s", e)
+        return [], 0.0
+
+
+def parse_model(text):
+    """Run the learned intent model; returns (list of Command, confidence)"""
+    model = get_intent_model()
+    if model is None:
+        return [], 0.0
+    result, confidence = model.predict(text)
+    if result is None:
+        return [], 0.0
+    try:
+        return [Command(**result)], confidence
+    except Exception as e:
+        logger.debug("Intent model result rejected by schema: %s", e)
+        return [], 0.0
+
+
+def parse(text, threshold=None, on_command=None) -> ParseResult:
+    """Parse with the rules, then the learned model, and fall back to the LLM when both are unsure.
+
+    `on_command` is handed to the fallback parser so it can pass on
+    commands before it has finished; see llm_parser.parse_commands.
+    """
+    threshold = LOCAL_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    start = time.perf_counter()
+
+    commands, confidence = parse_local(text)
+    fallback = fallback_parsers.resolve(FALLBACK_PARSER)
+    model_commands, model_confidence = ([], 0.0) if commands and confidence >= threshold else parse_model(text)
+    if commands and confidence >= threshold:
+        result = ParseResult(commands, "local", confidence, time.perf_counter() - start)
+    elif model_commands and model_confidence >= INTENT_CONFIDENCE:
+        result = ParseResult(model_commands, "model", model_confidence, time.perf_counter() - start)
+    elif commands and fallback is None:
+        result = ParseResult(commands, "local", confidence, time.perf_counter() - start)
+    elif fallback is None:
+        result = ParseResult([], "local", 0.0, time.perf_counter() - start)
+    else:
+        logger.info("Local parse confidence %.2f below %.2f, asking the %s parser", confidence, threshold, FALLBACK_PARSER)
+        commands = fallback(text, on_command=on_command) if on_command else fallback(text)
+        result = ParseResult(commands, FALLBACK_PARSER, 1.0 if commands else 0.0, time.perf_counter() - start)
+
+    tier_stats.record(result.tier)
+    tracer.record("parse", result.latency)
+    tracer.record(f"parse.{result.tier}", result.latency)
+    logger.info(
+        "Parsed by %s tier in %.2f ms (confidence %.2f): %s",
+        result.tier, result.latency * 1000, result.confidence, result.commands
+    )
+    return result
+
+
+def parse_commands(text: str, on_command=None) -> List[Command]:
+    """Drop-in replacement for llm_parser.parse_commands"""
+    if not text:
+        return []
+    return parse(text, on_command=on_command).commands
+
+
+def parse_command(text: str) -> Optional[Command]:
+    """Drop-in replacement for llm_parser.parse_command"""
+    if not text:
+        return None
+    return parse(text).command
@@ -0,0 +1,265 @@
+import atexit
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+TRACING_ENABLED = os.getenv("NOVA_TRACING", "0") == "1"
+METRICS_FILE = os.getenv("NOVA_METRICS_FILE", "metrics/nova.prom")
+METRICS_JSON = os.getenv("NOVA_METRICS_JSON", "metrics/nova.json")
+# Seconds between metric exports while running
+METRICS_INTERVAL = float(os.getenv("NOVA_METRICS_INTERVAL", "30"))
+
+# Histogram bucket upper bounds in seconds, from a fast local parse to a slow STT round trip
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Recent samples kept per span for percentiles
+RESERVOIR_SIZE = 2048
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _pick(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+class Histogram:
+    """Bucketed latency distribution plus a window of recent samples for percentiles"""
+
+    def __init__(self, buckets=BUCKETS, reservoir_size=RESERVOIR_SIZE):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=reservoir_size)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def quantile(self, q):
+        return _pick(sorted(self.recent), q)
+
+    def summary(self):
+        ordered = sorted(self.recent)
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+            **{f"p{int(q * 100)}": _pick(ordered, q) for q in QUANTILES},
+        }
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.record(self.name, time.perf_counter() - self.start, error=exc_type is not None)
+        return False
+
+
+class Tracer:
+    """Collects span durations into per-name histograms.
+
+    When disabled, `span` hands back a shared no-op context manager and
+    `record` returns at once, so instrumented code pays for one attribute
+    check per call.
+    """
+
+    def __init__(self, enabled=TRACING_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._errors = {}
+        self._gauges = {}
+
+    def span(self, name):
+        """Context manager timing the enclosed block as `name`"""
+        if not self.enabled:
+            return _NOOP
+        return _Span(self, name)
+
+    def record(self, name, seconds, error=False):
+        """Record a duration measured elsewhere"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+            if error:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    def gauge(self, name, value):
+        """Set a point-in-time value such as a queue depth"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[name] = value
+
+    def gauges(self):
+        with self._lock:
+            return dict(sorted(self._gauges.items()))
+
+    def summary(self):
+        """Per-span count, mean, max and p50/p95/p99 in seconds"""
+        with self._lock:
+            return {
+                name: {**histogram.summary(), "errors": self._errors.get(name, 0)}
+                for name, histogram in sorted(self._histograms.items())
+            }
+
+    def prometheus(self):
+        """All spans in the Prometheus text exposition format"""
+        lines = [
+            "# HELP nova_span_seconds Duration of pipeline stages.",
+            "# TYPE nova_span_seconds histogram",
+        ]
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            for name, histogram in histograms:
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'nova_span_seconds_bucket{{span="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'nova_span_seconds_sum{{span="{name}"}} {histogram.sum}')
+                lines.append(f'nova_span_seconds_count{{span="{name}"}} {histogram.count}')
+
+            lines += [
+                "# HELP nova_span_quantile_seconds Recent percentiles of pipeline stage durations.",
+                "# TYPE nova_span_quantile_seconds gauge",
+            ]
+            for name, histogram in histograms:
+                for q in QUANTILES:
+                    lines.append(
+                        f'nova_span_quantile_seconds{{span="{name}",quantile="{q}"}} {histogram.quantile(q)}'
+                    )
+
+            lines += [
+                "# HELP nova_span_errors_total Spans that ended with an exception.",
+                "# TYPE nova_span_errors_total counter",
+            ]
+            for name, _ in histograms:
+                lines.append(f'nova_span_errors_total{{span="{name}"}} {self._errors.get(name, 0)}')
+
+            if self._gauges:
+                lines += [
+                    "# HELP nova_gauge Current values such as queue depths.",
+                    "# TYPE nova_gauge gauge",
+                ]
+                for name, value in sorted(self._gauges.items()):
+                    lines.append(f'nova_gauge{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, prometheus_path=METRICS_FILE, json_path=METRICS_JSON):
+        """Write the Prometheus text file and the JSON summary"""
+        if prometheus_path:
+            _write_atomic(prometheus_path, self.prometheus())
+        if json_path:
+            summary = self.summary()
+            gauges = self.gauges()
+            if gauges:
+                summary["gauges"] = gauges
+            _write_atomic(json_path, json.dumps(summary, indent=2))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._errors.clear()
+            self._gauges.clear()
+
+
+def _write_atomic(path, text):
+    # Scrapers must never see a half-written file
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+tracer = Tracer()
+
+
+def traced(name=None):
+    """Decorator that records each call to the function as a span"""
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with _Span(tracer, span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+_exporter = None
+_exporter_stop = threading.Event()
+
+
+def start_exporter(interval=METRICS_INTERVAL):
+    """Export metrics every `interval` seconds and once more at exit"""
+    global _exporter
+    if not tracer.enabled or _exporter is not None:
+        return
+
+    def run():
+        while not _exporter_stop.wait(interval):
+            try:
+                tracer.export()
+            except Exception as e:
+                logger.warning("Metrics export failed: %s", e)
+
+    _exporter = threading.Thread(target=run, name="metrics-export", daemon=True)
+    _exporter.start()
+    atexit.register(stop_exporter)
+    logger.info("Exporting latency metrics to %s and %s", METRICS_FILE, METRICS_JSON)
+
+
+def stop_exporter():
+    """Stop periodic export and write the final numbers"""
+    global _exporter
+    if _exporter is None:
+        return
+    _exporter_stop.set()
+    _exporter = None
+    try:
+        tracer.export()
+    except Exception as e:
+        logger.warning("Metrics export failed: %s", e)
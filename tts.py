@@ -0,0 +1,438 @@
+import hashlib
+import os
+import queue
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+import numpy as np
+from dotenv import load_dotenv
+from logger import logger
+from tracing import tracer
+
+load_dotenv()
+
+# Speak feedback and confirmations; without it they are only printed
+TTS_ENABLED = os.getenv("NOVA_TTS", "1") == "1"
+# Pre-rendered fixed phrases, reused across restarts
+TTS_CACHE_DIR = os.getenv("NOVA_TTS_CACHE_DIR", "cache/tts")
+# Dynamic phrases (song names, numbers) kept in memory
+TTS_CACHE_SIZE = int(os.getenv("NOVA_TTS_CACHE_SIZE", "128"))
+# Engine voice id and words per minute; empty keeps the system default
+TTS_VOICE = os.getenv("NOVA_TTS_VOICE", "")
+TTS_RATE = int(os.getenv("NOVA_TTS_RATE", "0"))
+
+# Samples quieter than this (int16) at either end of a clip are trimmed,
+# so joined phrases don't carry the engine's padding
+SILENCE_LEVEL = 300
+# Pause inserted between the parts of one sentence
+GAP_SECONDS = 0.06
+
+PLATFORM_NAMES = {"spotify": "Spotify", "youtube": "YouTube"}
+
+# Everything Nova says apart from song names and volume levels
+FIXED_PHRASES = (
+    "Sorry, I didn't understand that command.",
+    "Sorry, I couldn't execute that command.",
+    "An error occurred. Please try again.",
+    "Playing", "on Spotify", "on YouTube",
+    "Paused.", "Resuming.", "Skipping.", "Going back.",
+    "Volume up.", "Volume down.", "Volume set to",
+)
+
+_CONFIRMATIONS = {
+    "pause": "Paused.",
+    "resume": "Resuming.",
+    "next": "Skipping.",
+    "previous": "Going back.",
+    "volume_up": "Volume up.",
+    "volume_down": "Volume down.",
+}
+
+
+@dataclass
+class Clip:
+    """Mono int16 audio"""
+    samples: np.ndarray
+    sample_rate: int
+
+
+def confirmation(commands):
+    """The phrases that confirm `commands`, split so the fixed parts come from the cache"""
+    parts = []
+    for command in commands:
+        if command.action == "play":
+            parts += ["Playing", command.song, f"on {PLATFORM_NAMES.get(command.platform or 'spotify')}"]
+        elif command.action == "set_volume":
+            parts += ["Volume set to", str(command.volume_level)]
+        else:
+            parts.append(_CONFIRMATIONS[command.action])
+    return parts
+
+
+def _trim(samples):
+    loud = np.flatnonzero(np.abs(samples.astype(np.int32)) > SILENCE_LEVEL)
+    return samples[loud[0]:loud[-1] + 1] if len(loud) else samples[:0]
+
+
+def _extended(data):
+    """An 80-bit IEEE 754 extended float, as AIFF stores its sample rate"""
+    exponent, mantissa = struct.unpack(">HQ", data)
+    sign = -1 if exponent & 0x8000 else 1
+    exponent &= 0x7FFF
+    if exponent == 0 and mantissa == 0:
+        return 0.0
+    return sign * mantissa * 2.0 ** (exponent - 16383 - 63)
+
+
+def _read_aiff(path):
+    """(int16 samples, channels, sample rate) from an uncompressed 16-bit AIFF or AIFF-C file.
+
+    Parsed by hand: the standard library's aifc module is deprecated and
+    gone from Python 3.13.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < 12 or data[:4] != b"FORM" or data[8:12] not in (b"AIFF", b"AIFC"):
+        raise ValueError(f"{path} is not an AIFF file")
+
+    channels = sample_width = sample_rate = None
+    byte_order = ">"
+    sound = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id, size = struct.unpack(">4sI", data[offset:offset + 8])
+        body = data[offset + 8:offset + 8 + size]
+        if chunk_id == b"COMM":
+            channels, _, bits = struct.unpack(">hIh", body[:8])
+            sample_width = (bits + 7) // 8
+            sample_rate = _extended(body[8:18])
+            # AIFF-C names its encoding; only plain PCM, either byte order, is supported
+            compression = body[18:22] if data[8:12] == b"AIFC" else b"NONE"
+            if compression == b"sowt":
+                byte_order = "<"
+            elif compression != b"NONE":
+                raise ValueError(f"Unsupported AIFF-C compression {compression!r}")
+        elif chunk_id == b"SSND":
+            start = struct.unpack(">I", body[:4])[0]
+            sound = body[8 + start:]
+        # Chunks are padded to an even length
+        offset += 8 + size + (size & 1)
+
+    if channels is None or sound is None:
+        raise ValueError(f"{path} has no audio")
+    if sample_width != 2:
+        raise ValueError(f"{path} is not 16-bit")
+    samples = np.frombuffer(sound[:len(sound) // 2 * 2], dtype=byte_order + "i2").astype(np.int16)
+    return samples, channels, int(round(sample_rate))
+
+
+def _read_audio(path):
+    """Load what the engine wrote as mono int16; espeak writes WAV, macOS writes AIFF"""
+    try:
+        with wave.open(path, "rb") as f:
+            samples = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+            channels, sample_rate = f.getnchannels(), f.getframerate()
+            if f.getsampwidth() != 2:
+                raise wave.Error("not 16-bit")
+    except (wave.Error, EOFError):
+        samples, channels, sample_rate = _read_aiff(path)
+    if channels > 1:
+        samples = samples[:len(samples) // channels * channels]
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return Clip(_trim(samples), sample_rate)
+
+
+def _write_wav(path, clip):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(clip.sample_rate)
+        f.writeframes(clip.samples.tobytes())
+
+
+class _Pyttsx3Engine:
+    """pyttsx3 rendering to WAV files (espeak on Linux, SAPI5 on Windows)"""
+    suffix = ".wav"
+
+    def __init__(self, voice, rate):
+        import pyttsx3
+
+        self._engine = pyttsx3.init()
+        if voice:
+            self._engine.setProperty("voice", voice)
+        if rate:
+            self._engine.setProperty("rate", rate)
+
+    def render(self, text, path):
+        self._engine.save_to_file(text, path)
+        self._engine.runAndWait()
+
+
+class _SayEngine:
+    """The macOS `say` command, rendering to AIFF files.
+
+    pyttsx3's macOS driver runs NSSpeechSynthesizer on an NSRunLoop, which
+    is unreliable off the main thread, and the main thread runs the asyncio
+    pipeline. `say` uses the same voices from a child process instead.
+    """
+    suffix = ".aiff"
+
+    def __init__(self, voice, rate):
+        if shutil.which("say") is None:
+            raise RuntimeError("The macOS 'say' command was not found")
+        self._args = ["say"]
+        if voice:
+            # pyttsx3 voice ids look like com.apple.speech.synthesis.voice.Alex
+            self._args += ["-v", voice.rsplit(".", 1)[-1]]
+        if rate:
+            self._args += ["-r", str(rate)]
+
+    def render(self, text, path):
+        # The text goes in on stdin, so it is never mistaken for an option
+        subprocess.run(self._args + ["-o", path], input=text.encode(), check=True, timeout=30,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+class Synthesizer:
+    """The speech engine kept on one dedicated thread, like the Whisper backend.
+
+    pyttsx3 is not thread-safe and is slow to create, so it is built once
+    and every phrase is rendered on its worker thread. On macOS the `say`
+    command stands in for it.
+    """
+
+    def __init__(self, voice=TTS_VOICE, rate=TTS_RATE):
+        self.voice = voice
+        self.rate = rate
+        self._jobs = queue.Queue()
+        self._ready = threading.Event()
+        self._load_error = None
+        self._worker = threading.Thread(target=self._run, name="tts-worker", daemon=True)
+        self._worker.start()
+
+    @property
+    def key(self):
+        """Settings that change how a phrase sounds; part of the disk cache key"""
+        return f"{self.voice}|{self.rate}"
+
+    def _load(self):
+        engine = _SayEngine if sys.platform == "darwin" else _Pyttsx3Engine
+        return engine(self.voice, self.rate)
+
+    def _render(self, engine, text):
+        handle, path = tempfile.mkstemp(suffix=engine.suffix)
+        os.close(handle)
+        try:
+            engine.render(text, path)
+            return _read_audio(path)
+        finally:
+            os.unlink(path)
+
+    def _run(self):
+        try:
+            engine = self._load()
+        except Exception as e:
+            logger.error("Error starting the speech engine: %s", e)
+            self._load_error = e
+            engine = None
+        self._ready.set()
+
+        while True:
+            text, future = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            if engine is None:
+                future.set_exception(self._load_error)
+                continue
+            start = time.perf_counter()
+            try:
+                future.set_result(self._render(engine, text))
+            except Exception as e:
+                future.set_exception(e)
+            tracer.record("tts.synthesize", time.perf_counter() - start)
+
+    def wait_until_ready(self, timeout=None):
+        """Block until the engine has started; raises if it could not"""
+        self._ready.wait(timeout)
+        if self._load_error is not None:
+            raise self._load_error
+
+    def submit(self, text):
+        """Queue `text` for rendering and return a Future for its Clip"""
+        future = Future()
+        self._jobs.put((text, future))
+        return future
+
+
+class PhraseCache:
+    """Rendered phrases: fixed ones on disk and in memory, dynamic ones in an LRU"""
+
+    def __init__(self, synthesizer, directory=TTS_CACHE_DIR, max_size=TTS_CACHE_SIZE):
+        self.synthesizer = synthesizer
+        self.directory = directory
+        self.max_size = max_size
+        self._fixed = {}
+        self._dynamic = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, text):
+        digest = hashlib.sha1(f"{self.synthesizer.key}|{text}".encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"{digest}.wav")
+
+    def warm(self, phrases=FIXED_PHRASES):
+        """Load the fixed phrases, rendering and storing the ones not on disk yet"""
+        os.makedirs(self.directory, exist_ok=True)
+        missing = {}
+        for text in phrases:
+            path = self._path(text)
+            if os.path.exists(path):
+                self._fixed[text] = _read_audio(path)
+            else:
+                missing[text] = self.synthesizer.submit(text)
+        for text, future in missing.items():
+            clip = future.result()
+            _write_wav(self._path(text), clip)
+            self._fixed[text] = clip
+        if missing:
+            logger.info("Rendered %d spoken phrases into %s", len(missing), self.directory)
+
+    @property
+    def sample_rate(self):
+        """Rate of the fixed phrases, or None before `warm`"""
+        clip = next(iter(self._fixed.values()), None)
+        return clip.sample_rate if clip is not None else None
+
+    def get(self, text):
+        """Clip for `text`, rendering it on first use"""
+        with self._lock:
+            clip = self._fixed.get(text) or self._dynamic.get(text)
+            if clip is not None:
+                self.hits += 1
+                if text in self._dynamic:
+                    self._dynamic.move_to_end(text)
+                return clip
+            self.misses += 1
+
+        clip = self.synthesizer.submit(text).result()
+        with self._lock:
+            self._dynamic[text] = clip
+            while len(self._dynamic) > self.max_size:
+                self._dynamic.popitem(last=False)
+        return clip
+
+
+class Speaker:
+    """Plays sentences on the output device from a background thread.
+
+    `say` returns at once. Sentences are played in order through one
+    output stream that stays open, so playback starts without reopening
+    the device.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._queue = queue.SimpleQueue()
+        self._stream = None
+        self._worker = threading.Thread(target=self._run, name="speaker", daemon=True)
+        self._worker.start()
+
+    def say(self, parts):
+        """Queue a sentence given as a list of phrases"""
+        self._queue.put((parts, time.perf_counter()))
+
+    def _audio(self, parts):
+        clips = [self.cache.get(part) for part in parts if part]
+        sample_rate = clips[0].sample_rate
+        gap = np.zeros(int(GAP_SECONDS * sample_rate), dtype=np.int16)
+        pieces = []
+        for clip in clips:
+            pieces += [clip.samples, gap]
+        return np.concatenate(pieces[:-1]), sample_rate
+
+    def _open(self, sample_rate):
+        import sounddevice
+
+        if self._stream is not None:
+            if self._stream.samplerate == sample_rate:
+                return
+            self._stream.close()
+        self._stream = sounddevice.OutputStream(samplerate=sample_rate, channels=1, dtype="int16")
+        self._stream.start()
+
+    def _run(self):
+        while True:
+            parts, queued = self._queue.get()
+            try:
+                samples, sample_rate = self._audio(parts)
+                self._open(sample_rate)
+                tracer.record("tts.start", time.perf_counter() - queued)
+                self._stream.write(samples.reshape(-1, 1))
+            except Exception as e:
+                logger.error("Error speaking '%s': %s", " ".join(parts), e)
+
+    def warm(self, sample_rate):
+        self._open(sample_rate)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+
+class Voice:
+    """Spoken feedback; prints every message too, as before"""
+
+    def __init__(self, enabled=TTS_ENABLED):
+        self.enabled = enabled
+        self._speaker = None
+        self._lock = threading.Lock()
+
+    def _get_speaker(self):
+        with self._lock:
+            if self._speaker is None:
+                self._speaker = Speaker(PhraseCache(Synthesizer()))
+            return self._speaker
+
+    def warm(self):
+        """Start the engine, render the fixed phrases and open the output device"""
+        if not self.enabled:
+            return
+        speaker = self._get_speaker()
+        try:
+            speaker.cache.synthesizer.wait_until_ready()
+            speaker.cache.warm()
+            speaker.warm(speaker.cache.sample_rate)
+        except Exception:
+            # Keep printing rather than failing every turn on a missing engine or device
+            self.enabled = False
+            raise
+
+    def say(self, text):
+        """Feedback message, e.g. the pipeline's error messages"""
+        print(text)
+        if self.enabled:
+            self._get_speaker().say([text])
+
+    def confirm(self, commands):
+        """Say what was just done"""
+        parts = confirmation(commands)
+        print(" ".join(parts))
+        if self.enabled:
+            self._get_speaker().say(parts)
+
+    def close(self):
+        if self._speaker is not None:
+            self._speaker.close()
+
+
+voice = Voice()
@@ -0,0 +1,143 @@
+import os
+from dataclasses import dataclass
+import numpy as np
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+
+@dataclass
+class VADConfig:
+    """Tuning knobs for voice-activity endpointing"""
+    frame_ms: int = 30
+    # Absolute level a frame must exceed to count as speech
+    threshold_db: float = -45.0
+    # How far above the running noise floor a frame must be to count as speech
+    margin_db: float = 10.0
+    # Smoothing factor for the noise floor estimate (0 freezes it)
+    noise_adapt: float = 0.05
+    # Consecutive speech frames needed before speech is considered started
+    speech_frames: int = 3
+    trailing_silence_ms: int = 700
+    min_duration_ms: int = 500
+    max_duration_ms: int = 8000
+    # Give up if nobody starts speaking within this window
+    no_speech_timeout_ms: int = 3000
+
+    @classmethod
+    def from_env(cls):
+        """Build a config from NOVA_VAD_* environment variables"""
+        def env(name, default, cast):
+            value = os.getenv(f"NOVA_VAD_{name}")
+            return cast(value) if value else default
+
+        defaults = cls()
+        return cls(
+            frame_ms=env("FRAME_MS", defaults.frame_ms, int),
+            threshold_db=env("THRESHOLD_DB", defaults.threshold_db, float),
+            margin_db=env("MARGIN_DB", defaults.margin_db, float),
+            noise_adapt=env("NOISE_ADAPT", defaults.noise_adapt, float),
+            speech_frames=env("SPEECH_FRAMES", defaults.speech_frames, int),
+            trailing_silence_ms=env("TRAILING_SILENCE_MS", defaults.trailing_silence_ms, int),
+            min_duration_ms=env("MIN_DURATION_MS", defaults.min_duration_ms, int),
+            max_duration_ms=env("MAX_DURATION_MS", defaults.max_duration_ms, int),
+            no_speech_timeout_ms=env("NO_SPEECH_TIMEOUT_MS", defaults.no_speech_timeout_ms, int),
+        )
+
+
+def frame_db(frame):
+    """RMS level of an int16 frame in dBFS"""
+    samples = frame.astype(np.float32)
+    rms = np.sqrt(np.dot(samples, samples) / max(len(samples), 1)) / 32768.0
+    return 20.0 * np.log10(max(rms, 1e-10))
+
+
+class EnergyVAD:
+    """Frame-level energy detector with an adaptive noise floor"""
+
+    def __init__(self, config):
+        self.config = config
+        self.noise_floor_db = None
+
+    def is_speech(self, frame):
+        level = frame_db(frame)
+        if self.noise_floor_db is None:
+            self.noise_floor_db = level
+
+        threshold = max(self.config.threshold_db, self.noise_floor_db + self.config.margin_db)
+        speech = level > threshold
+        if not speech:
+            # Only track the floor on non-speech frames so talking doesn't raise it
+            self.noise_floor_db += self.config.noise_adapt * (level - self.noise_floor_db)
+        return speech
+
+
+class Endpointer:
+    """Decides when an utterance has ended from a stream of VAD decisions"""
+
+    def __init__(self, config, sample_rate):
+        self.config = config
+        self.vad = EnergyVAD(config)
+        self.frame_samples = int(sample_rate * config.frame_ms / 1000)
+        self._ms_per_frame = config.frame_ms
+        self.elapsed_ms = 0
+        self.speech_started = False
+        self._speech_run = 0
+        self._silence_ms = 0
+
+    def process(self, frame):
+        """Feed one frame; returns True once recording should stop"""
+        self.elapsed_ms += self._ms_per_frame
+
+        if self.vad.is_speech(frame):
+            self._speech_run += 1
+            self._silence_ms = 0
+            if self._speech_run >= self.config.speech_frames:
+                self.speech_started = True
+        else:
+            self._speech_run = 0
+            self._silence_ms += self._ms_per_frame
+
+        if self.elapsed_ms >= self.config.max_duration_ms:
+            return True
+        if self.elapsed_ms < self.config.min_duration_ms:
+            return False
+        if not self.speech_started:
+            return self.elapsed_ms >= self.config.no_speech_timeout_ms
+        return self._silence_ms >= self.config.trailing_silence_ms
+
+
+def record_until_silence(reader, sample_rate, config=None, on_frame=None, preroll_samples=0):
+    """Read frames from a capture reader until the endpointer fires.
+
+    The first `preroll_samples` are kept but not endpointed, so the tail of
+    the wake word can't count as the start of the command. `on_frame` is
+    called with each frame as it arrives so callers can stream audio onwards
+    while the user is still speaking. Returns the recorded audio, or an
+    empty array if no speech was detected.
+    """
+    config = config or VADConfig.from_env()
+    endpointer = Endpointer(config, sample_rate)
+    frame_samples = endpointer.frame_samples
+    preroll_frames = preroll_samples // frame_samples
+    max_frames = max(1, config.max_duration_ms // config.frame_ms) + preroll_frames
+    audio = np.empty(max_frames * frame_samples, dtype=np.int16)
+
+    frames = 0
+    while frames < max_frames:
+        frame = audio[frames * frame_samples:(frames + 1) * frame_samples]
+        reader.read(frame_samples, out=frame)
+        frames += 1
+        if on_frame is not None:
+            on_frame(frame)
+        if frames > preroll_frames and endpointer.process(frame):
+            break
+
+    duration_ms = endpointer.elapsed_ms
+    if not endpointer.speech_started:
+        logger.info("No speech detected after %s ms", duration_ms)
+        return audio[:0]
+
+    logger.info("Endpointed command after %s ms", duration_ms)
+    return audio[:frames * frame_samples]
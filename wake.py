@@ -1,43 +1,168 @@
-import pvporcupine
-import pyaudio
-import struct
+import ctypes
 import os
+import threading
+import numpy as np
 from dotenv import load_dotenv
 from logger import logger
+from audio_capture import get_capture_service
+from tracing import traced
+from vad import EnergyVAD, VADConfig
 
 load_dotenv()
 
-def detect_wake_word():
-    access_key = os.getenv('PICOVOICE_ACCESS_KEY')
-    if not access_key:
-        raise ValueError("Please set the PICOVOICE_ACCESS_KEY environment variable")
-
-    porcupine = pvporcupine.create(
-        access_key=access_key,
-        keyword_paths=["assets/hey-nova.ppn"]
-    )
-    pa = pyaudio.PyAudio()
-
-    stream = pa.open(
-        rate=porcupine.sample_rate,
-        channels=1,
-        format=pyaudio.paInt16,
-        input=True,
-        frames_per_buffer=porcupine.frame_length,
-    )
+# Skip keyword inference on frames that are no louder than the background
+WAKE_GATE = os.getenv("NOVA_WAKE_GATE", "0") == "1"
+# Absolute level (dBFS) and margin over the noise floor that open the gate
+WAKE_GATE_DB = float(os.getenv("NOVA_WAKE_GATE_DB", "-55"))
+WAKE_GATE_MARGIN_DB = float(os.getenv("NOVA_WAKE_GATE_MARGIN_DB", "6"))
+# Frames from just before the gate opened that are still fed to Porcupine,
+# so a soft start of the keyword isn't cut off
+WAKE_GATE_LOOKBACK = int(os.getenv("NOVA_WAKE_GATE_LOOKBACK_FRAMES", "8"))
+# Frames kept open after the last loud one
+WAKE_GATE_HANGOVER = int(os.getenv("NOVA_WAKE_GATE_HANGOVER_FRAMES", "30"))
 
+_porcupine = None
+_porcupine_lock = threading.Lock()
+
+def get_porcupine():
+    """Create the Porcupine engine once and reuse it across turns"""
+    global _porcupine
+    with _porcupine_lock:
+        if _porcupine is None:
+            import pvporcupine
+
+            access_key = os.getenv('PICOVOICE_ACCESS_KEY')
+            if not access_key:
+                raise ValueError("Please set the PICOVOICE_ACCESS_KEY environment variable")
+
+            _porcupine = pvporcupine.create(
+                access_key=access_key,
+                keyword_paths=["assets/hey-nova.ppn"]
+            )
+        return _porcupine
+
+class WakeStats:
+    """Counters for the always-on wake word loop"""
+
+    def __init__(self):
+        self.frames = 0
+        self.processed = 0
+        self.gated = 0
+        self.detections = 0
+
+    def summary(self, capture=None):
+        summary = {
+            "frames": self.frames,
+            "processed": self.processed,
+            "gated": self.gated,
+            "gated_ratio": self.gated / self.frames if self.frames else 0.0,
+            "detections": self.detections,
+        }
+        if capture is not None:
+            summary.update(capture.stats())
+        return summary
+
+wake_stats = WakeStats()
+
+class FrameBuffer:
+    """One reusable frame visible both as a ctypes array and a NumPy view.
+
+    The capture reader copies each frame straight into the NumPy view and
+    Porcupine reads the same memory through ctypes, so no per-frame arrays
+    or Python int tuples are created.
+    """
+
+    def __init__(self, length):
+        self.c_array = (ctypes.c_short * length)()
+        self.array = np.frombuffer(self.c_array, dtype=np.int16)
+
+def frame_processor(porcupine, frame):
+    """Return a callable that runs Porcupine on `frame` and returns the keyword index.
+
+    Calls the engine's C function directly with the shared buffer when the
+    binding exposes it; `Porcupine.process` would otherwise rebuild a ctypes
+    array from the samples one by one on every frame.
+    """
+    process_func = getattr(porcupine, "_process_func", None)
+    handle = getattr(porcupine, "_handle", None)
+    if process_func is None or handle is None:
+        return lambda: porcupine.process(frame.array)
+
+    result = ctypes.c_int()
+    result_ref = ctypes.byref(result)
+
+    def process():
+        status = process_func(handle, frame.c_array, result_ref)
+        if getattr(status, "value", status) != 0:
+            # Let the binding turn the failure into its usual exception
+            return porcupine.process(frame.array)
+        return result.value
+    return process
+
+def _make_gate():
+    return EnergyVAD(VADConfig(threshold_db=WAKE_GATE_DB, margin_db=WAKE_GATE_MARGIN_DB))
+
+@traced("wake")
+def detect_wake_word(capture=None, gate=None):
+    """Block until the wake word is heard and return the capture position after it"""
+    porcupine = get_porcupine()
+    capture = capture or get_capture_service()
+    gate = WAKE_GATE if gate is None else gate
+
+    if porcupine.sample_rate != capture.sample_rate:
+        raise ValueError(
+            f"Capture runs at {capture.sample_rate} Hz but Porcupine needs {porcupine.sample_rate} Hz"
+        )
+
+    length = porcupine.frame_length
+    frame = FrameBuffer(length)
+    process = frame_processor(porcupine, frame)
+    energy = _make_gate() if gate else None
+    open_frames = 0
+    stats = wake_stats
+
+    reader = capture.reader()
+    # End of the newest frame read so far; frames before it are replays after a rewind
+    seen = reader.position
+    # Consecutive frames just skipped by the gate, the only ones worth rewinding to
+    gated_run = 0
     logger.info("Listening for 'Hey Nova'...")
 
-    try:
-        while True:
-            pcm = stream.read(porcupine.frame_length, exception_on_overflow=False)
-            pcm = struct.unpack_from("h" * porcupine.frame_length, pcm)
-
-            if porcupine.process(pcm) >= 0:
-                logger.info("Wake word detected!")
-                break
-    finally:
-        stream.stop_stream()
-        stream.close()
-        pa.terminate()
-        porcupine.delete()
+    while True:
+        reader.read(length, out=frame.array)
+        replay = reader.position <= seen
+        if not replay:
+            seen = reader.position
+            stats.frames += 1
+
+        if energy is not None and replay:
+            # Already judged by the gate (and counted) when first read
+            open_frames = max(open_frames - 1, 0)
+        elif energy is not None:
+            loud = energy.is_speech(frame.array)
+            if loud and open_frames == 0:
+                # Gate just opened: step back so the frames leading up to
+                # this one are also heard, then carry on from there
+                available = (reader.position - length - capture.ring.oldest) // length
+                lookback = min(WAKE_GATE_LOOKBACK, gated_run, available)
+                if lookback > 0:
+                    reader.position -= (lookback + 1) * length
+                    open_frames = lookback + 1 + WAKE_GATE_HANGOVER
+                    # Those frames are processed after all
+                    stats.gated -= lookback
+                    gated_run = 0
+                    continue
+            if loud:
+                open_frames = max(open_frames, WAKE_GATE_HANGOVER)
+            elif open_frames == 0:
+                stats.gated += 1
+                gated_run += 1
+                continue
+            open_frames = max(open_frames - 1, 0)
+            gated_run = 0
+
+        stats.processed += 1
+        if process() >= 0:
+            stats.detections += 1
+            logger.info("Wake word detected!")
+            return reader.position
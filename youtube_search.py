@@ -0,0 +1,146 @@
+import asyncio
+import os
+import re
+import threading
+from dotenv import load_dotenv
+from logger import logger
+from parse_cache import ParseCache, normalize
+
+load_dotenv()
+
+# Results page to search; point it at a local stub server for testing
+SEARCH_URL = os.getenv("NOVA_YOUTUBE_SEARCH_URL", "https://www.youtube.com/results")
+SEARCH_TIMEOUT = float(os.getenv("NOVA_YOUTUBE_SEARCH_TIMEOUT", "5"))
+SEARCH_CACHE_SIZE = int(os.getenv("NOVA_YOUTUBE_CACHE_SIZE", "512"))
+SEARCH_CACHE_TTL = float(os.getenv("NOVA_YOUTUBE_CACHE_TTL", "604800"))
+# Path to an SQLite file that keeps found links across restarts; unset disables it
+SEARCH_CACHE_DB = os.getenv("NOVA_YOUTUBE_CACHE_DB")
+
+WATCH_URL = "https://www.youtube.com/watch?v="
+
+# The results page embeds its data as JSON; the first videoId is the top result
+_VIDEO_ID = re.compile(r'"videoId"\s*:\s*"([\w-]{11})"')
+
+_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+
+class YouTubeSearch:
+    """Finds the top YouTube video for a query over a pooled HTTP client.
+
+    Found links are cached by normalized query with a TTL and LRU eviction,
+    so replaying a favourite track skips the network entirely. Concurrent
+    searches for the same query share one request. The client and its
+    connection pool live on a private event loop thread, which lets the
+    blocking `search` be called from any thread while `search_async` can be
+    awaited on that loop.
+    """
+
+    def __init__(self, url=SEARCH_URL, timeout=SEARCH_TIMEOUT, cache=None):
+        self.url = url
+        self.timeout = timeout
+        self.cache = cache if cache is not None else ParseCache(
+            SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_DB
+        )
+        self._client = None
+        self._in_flight = {}
+        self._loop = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.deduplicated = 0
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="youtube-search", daemon=True)
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                headers=_HEADERS,
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=8, max_keepalive_connections=4, keepalive_expiry=120),
+            )
+        return self._client
+
+    async def _fetch(self, query):
+        self.requests += 1
+        logger.debug("Searching YouTube for: %s", query)
+        response = await self._get_client().get(self.url, params={"search_query": query})
+        response.raise_for_status()
+
+        match = _VIDEO_ID.search(response.text)
+        if match is None:
+            logger.error("No results found on YouTube for: %s", query)
+            raise LookupError("No YouTube results found")
+
+        link = WATCH_URL + match.group(1)
+        self.cache.put(query, link)
+        logger.debug("Found YouTube link: %s", link)
+        return link
+
+    async def search_async(self, query):
+        """Return the link of the top result; must run on this searcher's loop"""
+        link = self.cache.get(query)
+        if link is not None:
+            return link
+        return await self._shared_fetch(query)
+
+    async def _shared_fetch(self, query):
+        key = normalize(query)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(query))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.deduplicated += 1
+        # Shielded so one caller timing out doesn't cancel the shared request
+        return await asyncio.shield(task)
+
+    def search(self, query, timeout=None):
+        """Blocking search, safe to call from any thread"""
+        link = self.cache.get(query)
+        if link is not None:
+            return link
+        future = asyncio.run_coroutine_threadsafe(self._shared_fetch(query), self._get_loop())
+        return future.result(timeout or self.timeout * 2)
+
+    def warm(self):
+        """Start the event loop thread and build the HTTP client ahead of the first search"""
+        async def build():
+            self._get_client()
+        asyncio.run_coroutine_threadsafe(build(), self._get_loop()).result(self.timeout)
+
+    def stats(self):
+        return {"requests": self.requests, "deduplicated": self.deduplicated, **self.cache.stats()}
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result(self.timeout)
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+
+_searcher = None
+_searcher_lock = threading.Lock()
+
+
+def get_youtube_search():
+    global _searcher
+    with _searcher_lock:
+        if _searcher is None:
+            _searcher = YouTubeSearch()
+        return _searcher